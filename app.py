@@ -1,9 +1,12 @@
 import os
 from kivy.app import App
+from kivy.core.window import Window
 from kivy.lang import Builder
 
 from ui.windows.root import RootWindow
 from settings.store import settings
+from utils.profiling import default_root as default_profile_root, profiler
+from utils.startup import startup_trace
 
 class DiamondSquareApp(App):
     kv_directory = os.path.join(os.path.dirname(__file__), "ui/windows")
@@ -14,6 +17,24 @@ class DiamondSquareApp(App):
         self.settings_store = settings
         return RootWindow()
 
+    def on_start(self):
+        Window.bind(on_draw=self._on_first_frame)
+        Window.bind(on_keyboard=self._on_keyboard)
+
+    def _on_keyboard(self, window, key, scancode, codepoint, modifiers):
+        # Hidden switch: Ctrl+Shift+P toggles per-stage profiling (utils.profiling)
+        if codepoint == 'p' and set(modifiers) >= {'ctrl', 'shift'}:
+            state = 'on' if profiler.toggle() else 'off'
+            print(f"[INFO] profiling {state}, reports in {profiler.root or default_profile_root()}")
+            return True
+        return False
+
+    def _on_first_frame(self, *args):
+        Window.unbind(on_draw=self._on_first_frame)
+        startup_trace.first_frame()
+        # The generation stack (numpy, PIL, erosion) is only needed on the first click
+        startup_trace.preload('generate.main')
+
     @property
     def settings(self):
         return self.settings_store
@@ -0,0 +1,344 @@
+"""
+Contour lines of a heightmap (marching squares) with SVG and GeoJSON writers.
+
+    python -m export.contours terrain.npy contours.svg --interval 0.1
+    python -m export.contours terrain.npy contours.geojson --count 50
+"""
+import argparse
+import json
+
+import numpy as np
+
+from store.archive import load_heightmap
+from store.shared  import as_array
+from utils.jit      import njit
+
+# Cell corners as bits: 1 top-left, 2 top-right, 4 bottom-right, 8 bottom-left (rows grow down).
+# Edges: 0 top, 1 right, 2 bottom, 3 left.
+_EDGE_MIDPOINTS = np.array([[0.5, 0.0], [1.0, 0.5], [0.5, 1.0], [0.0, 0.5]])  # (x, y)
+_EDGE_CORNERS = [{0, 1}, {1, 2}, {3, 2}, {0, 3}]
+_CORNERS = np.array([[0, 0], [1, 0], [1, 1], [0, 1]])  # (x, y) of bits 0..3
+
+def _segment_table():
+    """
+    Edge pairs of every marching-squares case, oriented so the high side is
+    always on the same side of the segment; cases 16 and 17 are the saddles
+    5 and 10 with a high cell center.
+    """
+    segments = np.full((18, 2, 2), -1, dtype=np.int64)
+    counts = np.zeros(18, dtype=np.int64)
+    saddles = {
+        5:  [(0, 3), (1, 2)],   # center low: cut off top-left and bottom-right
+        16: [(0, 1), (3, 2)],   # center high: cut off top-right and bottom-left
+        10: [(0, 1), (3, 2)],
+        17: [(0, 3), (1, 2)],
+    }
+    for case in range(18):
+        bits = {5: 5, 10: 10, 16: 5, 17: 10}.get(case, case)
+        high = [(bits >> corner) & 1 for corner in range(4)]
+        if case in saddles:
+            pairs = saddles[case]
+        else:
+            crossed = [e for e, (a, b) in enumerate([(0, 1), (1, 2), (3, 2), (0, 3)]) if high[a] != high[b]]
+            pairs = [tuple(crossed)] if crossed else []
+
+        for j, (ea, eb) in enumerate(pairs):
+            shared = _EDGE_CORNERS[ea] & _EDGE_CORNERS[eb]
+            corner = shared.pop() if shared else 0
+            d = _EDGE_MIDPOINTS[eb] - _EDGE_MIDPOINTS[ea]
+            v = _CORNERS[corner] - _EDGE_MIDPOINTS[ea]
+            left = d[0] * v[1] - d[1] * v[0] > 0
+            if left != bool(high[corner]):
+                ea, eb = eb, ea
+            segments[case, j] = ea, eb
+        counts[case] = len(pairs)
+    return segments, counts
+
+SEGMENTS, SEGMENT_COUNTS = _segment_table()
+
+def contour_levels(heightmap, interval=None, count=None):
+    """
+    Iso-levels at multiples of `interval`, or `count` levels evenly spaced
+    strictly inside the height range.
+    """
+    heightmap = as_array(heightmap)
+    lo, hi = float(np.min(heightmap)), float(np.max(heightmap))
+    if interval:
+        return np.arange(np.floor(lo / interval) + 1, np.ceil(hi / interval)) * interval
+    if count:
+        return np.linspace(lo, hi, count + 2)[1:-1]
+    raise ValueError("Give either an interval or a count of contour levels.")
+
+@njit(cache=True)
+def _walk(successor, has_predecessor):
+    """Order segments into chains: open ones from their first segment, then closed loops."""
+    n = successor.shape[0]
+    order = np.empty(n, dtype=np.int64)
+    offsets = np.empty(n + 1, dtype=np.int64)
+    closed = np.zeros(n, dtype=np.bool_)
+    visited = np.zeros(n, dtype=np.bool_)
+    pos = 0
+    chains = 0
+    for loops in range(2):
+        for i in range(n):
+            if visited[i] or (loops == 0 and has_predecessor[i]):
+                continue
+            offsets[chains] = pos
+            closed[chains] = loops == 1
+            j = i
+            while j >= 0 and not visited[j]:
+                visited[j] = True
+                order[pos] = j
+                pos += 1
+                j = successor[j]
+            chains += 1
+    offsets[chains] = pos
+    return order, offsets[:chains + 1], closed[:chains]
+
+class Contours:
+    """
+    Polylines of all levels, packed: chain i has the points
+    points[offsets[i]:offsets[i + 1]] as (x, y) = (column, row) in heightmap
+    cells, lies at levels[i] and repeats its first point at the end if closed[i].
+    """
+
+    def __init__(self, points, offsets, levels, closed, shape):
+        self.points = points
+        self.offsets = offsets
+        self.levels = levels
+        self.closed = closed
+        self.shape = shape
+
+    def __len__(self):
+        return len(self.levels)
+
+    def lines(self):
+        """Yield (level, (n, 2) points) per polyline."""
+        for i in range(len(self)):
+            yield self.levels[i], self.points[self.offsets[i]:self.offsets[i + 1]]
+
+    def __repr__(self):
+        return f"Contours({len(self)} lines, {len(self.points)} points, {len(np.unique(self.levels))} levels)"
+
+# neighbor across each edge (row, column offset) and the edge code on its side
+_ACROSS = np.array([[-1, 0, 2], [0, 1, 3], [1, 0, 0], [0, -1, 1]], dtype=np.int64)
+
+@njit(cache=True)
+def _above(h, levels):
+    """Number of levels at or below each height (np.searchsorted(levels, h, side='right'))."""
+    above = np.empty(h.shape, dtype=np.int16)
+    for r in range(h.shape[0]):
+        for c in range(h.shape[1]):
+            v = h[r, c]
+            lo, hi = 0, len(levels)
+            if v != v:
+                lo = hi  # NaN sorts last
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if levels[mid] <= v:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            above[r, c] = lo
+    return above
+
+@njit(cache=True)
+def _edge_point(h, level, r, c, edge):
+    """Where `level` crosses edge `edge` of cell (r, c) (linear interpolation), as (x, y)."""
+    horizontal = edge % 2 == 0                 # top and bottom edges
+    row = r + (edge == 2)
+    col = c + (edge == 1)
+    a = h[row, col]
+    b = h[row + (not horizontal), col + horizontal]
+    t = (level - a) / (b - a)
+    if horizontal:
+        return col + t, row + 0.0
+    return col + 0.0, row + t
+
+@njit(cache=True)
+def _count(above):
+    """Index of the first segment of every cell (row-major), plus the total at the end."""
+    rows, cols = above.shape
+    first = np.empty((rows - 1) * (cols - 1) + 1, dtype=np.int64)
+    n = 0
+    for r in range(rows - 1):
+        for c in range(cols - 1):
+            first[r * (cols - 1) + c] = n
+            a0, a1, a2, a3 = above[r, c], above[r, c + 1], above[r + 1, c + 1], above[r + 1, c]
+            lo, hi = min(min(a0, a1), min(a2, a3)), max(max(a0, a1), max(a2, a3))
+            for k in range(lo, hi):
+                case = (a0 > k) | (a1 > k) << 1 | (a2 > k) << 2 | (a3 > k) << 3
+                n += SEGMENT_COUNTS[case]
+    first[-1] = n
+    return first
+
+@njit(cache=True)
+def _segments(h, above, levels, first):
+    """
+    Cell, level, oriented (start, end) edges and start point of every
+    segment, ordered by cell, level, then slot.
+    """
+    rows, cols = above.shape
+    n = first[-1]
+    cell = np.empty(n, dtype=np.int64)
+    level = np.empty(n, dtype=np.int32)
+    start_edge = np.empty(n, dtype=np.int8)
+    end_edge = np.empty(n, dtype=np.int8)
+    start = np.empty((n, 2), dtype=np.float32)
+    for r in range(rows - 1):
+        for c in range(cols - 1):
+            i = first[r * (cols - 1) + c]
+            a0, a1, a2, a3 = above[r, c], above[r, c + 1], above[r + 1, c + 1], above[r + 1, c]
+            lo, hi = min(min(a0, a1), min(a2, a3)), max(max(a0, a1), max(a2, a3))
+            for k in range(lo, hi):
+                case = (a0 > k) | (a1 > k) << 1 | (a2 > k) << 2 | (a3 > k) << 3
+                if case == 5 or case == 10:
+                    # saddle: decided by the cell center
+                    center = (h[r, c] + h[r, c + 1] + h[r + 1, c + 1] + h[r + 1, c]) / 4
+                    if center >= levels[k]:
+                        case = 16 if case == 5 else 17
+                for slot in range(SEGMENT_COUNTS[case]):
+                    cell[i] = r * (cols - 1) + c
+                    level[i] = k
+                    start_edge[i] = SEGMENTS[case, slot, 0]
+                    end_edge[i] = SEGMENTS[case, slot, 1]
+                    start[i, 0], start[i, 1] = _edge_point(h, levels[k], r, c, start_edge[i])
+                    i += 1
+    return cell, level, start_edge, end_edge, start
+
+@njit(cache=True)
+def _successors(shape, first, cell, level, start_edge, end_edge):
+    """Segment of the same level in the cell across each segment's end edge, starting at that edge; -1 at the border."""
+    rows, cols = shape
+    successor = np.full(len(cell), -1, dtype=np.int64)
+    has_predecessor = np.zeros(len(cell), dtype=np.bool_)
+    for i in range(len(cell)):
+        e = end_edge[i]
+        r, c = cell[i] // (cols - 1), cell[i] % (cols - 1)
+        nr, nc = r + _ACROSS[e, 0], c + _ACROSS[e, 1]
+        if nr < 0 or nr >= rows - 1 or nc < 0 or nc >= cols - 1:
+            continue
+        neighbor = nr * (cols - 1) + nc
+        for j in range(first[neighbor], first[neighbor + 1]):
+            if level[j] == level[i] and start_edge[j] == _ACROSS[e, 2]:
+                successor[i] = j
+                has_predecessor[j] = True
+                break
+    return successor, has_predecessor
+
+@njit(cache=True)
+def _chain_points(h, levels, cols, cell, level, end_edge, start, order, offsets):
+    """Each chain's segment start points plus the end point of its last segment."""
+    chains = len(offsets) - 1
+    points = np.empty((len(order) + chains, 2), dtype=np.float32)
+    for i in range(chains):
+        for p in range(offsets[i], offsets[i + 1]):
+            points[p + i] = start[order[p]]
+        s = order[offsets[i + 1] - 1]
+        x, y = _edge_point(h, levels[level[s]], cell[s] // (cols - 1), cell[s] % (cols - 1), end_edge[s])
+        points[offsets[i + 1] + i, 0], points[offsets[i + 1] + i, 1] = x, y
+    return points
+
+def contours(heightmap, levels):
+    """
+    Marching squares for all `levels` at once. One compiled pass over the
+    cells visits the (cell, level) pairs that cross (between the cell's
+    lowest and highest corner level index) and looks their segments up in
+    one case table shared by every level. A segment's successor is the
+    segment of the same level in the cell across its end edge, found by
+    index arithmetic instead of a search, so stitching is linear as well.
+
+    :param heightmap: Array or SharedArray handle (mapped read-only, not copied).
+    :return: Contours.
+    """
+    h = np.ascontiguousarray(as_array(heightmap), dtype=np.float64)
+    levels = np.unique(np.asarray(levels, dtype=np.float64))
+
+    # corner is high for level k exactly when k < above[corner]
+    above = _above(h, levels)
+    first = _count(above)
+    cell, level, start_edge, end_edge, start = _segments(h, above, levels, first)
+    del above
+    successor, has_predecessor = _successors(h.shape, first, cell, level, start_edge, end_edge)
+    del first
+    order, offsets, closed = _walk(successor, has_predecessor)
+    del successor, has_predecessor, start_edge
+    chains = len(closed)
+
+    return Contours(
+        _chain_points(h, levels, h.shape[1], cell, level, end_edge, start, order, offsets),
+        offsets + np.arange(chains + 1),
+        levels[level[order[offsets[:-1]]]],
+        closed,
+        h.shape,
+    )
+
+def _formatted(points, template):
+    """Every point formatted with `template` in one bulk string operation."""
+    return ((template + '\n') * len(points) % tuple(points.ravel().tolist())).split('\n')[:-1]
+
+def _by_level(lines, text, join, closing=''):
+    """{level: [joined point text of each chain]} in level order."""
+    chains = {}
+    for i, level in enumerate(lines.levels.tolist()):
+        chain = join.join(text[lines.offsets[i]:lines.offsets[i + 1]])
+        chains.setdefault(level, []).append(chain + (closing if lines.closed[i] else ''))
+    return chains
+
+def write_svg(lines, path, stroke='#3a2a1a', stroke_width=0.5):
+    """One <path> per level; rows are flipped so north matches the on-screen map."""
+    rows, cols = lines.shape
+    flipped = lines.points.astype(np.float64)
+    flipped[:, 1] = rows - 1 - flipped[:, 1]
+    paths = _by_level(lines, _formatted(flipped, '%.2f,%.2f'), ' L', closing='Z')
+
+    with open(path, 'w') as f:
+        f.write(f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {cols - 1} {rows - 1}" '
+                f'width="{cols - 1}" height="{rows - 1}">\n'
+                f'<g fill="none" stroke="{stroke}" stroke-width="{stroke_width}">\n')
+        for level, chains in paths.items():
+            f.write(f'<path data-level="{level:.6g}" d="M{" M".join(chains)}"/>\n')
+        f.write('</g>\n</svg>\n')
+    return path
+
+def write_geojson(lines, path):
+    """FeatureCollection with one MultiLineString per level, in (column, row) coordinates."""
+    features = _by_level(lines, _formatted(lines.points.astype(np.float64), '[%.3f,%.3f]'), ',')
+
+    with open(path, 'w') as f:
+        f.write('{"type":"FeatureCollection","features":[')
+        for n, (level, chains) in enumerate(features.items()):
+            f.write(('' if n == 0 else ',')
+                    + '{"type":"Feature","properties":{"elevation":%s},' % json.dumps(level)
+                    + '"geometry":{"type":"MultiLineString","coordinates":[[')
+            f.write('],['.join(chains))
+            f.write(']]}}')
+        f.write(']}\n')
+    return path
+
+WRITERS = {
+    '.svg': write_svg,
+    '.geojson': write_geojson,
+    '.json': write_geojson,
+}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', help="heightmap .npy or .dsa archive (or erosion checkpoint .npz)")
+    parser.add_argument('output', help=".svg or .geojson")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--interval', type=float, help="height between levels")
+    group.add_argument('--count', type=int, help="number of evenly spaced levels")
+    args = parser.parse_args(argv)
+
+    ext = args.output[args.output.rfind('.'):].lower()
+    if ext not in WRITERS:
+        parser.error(f"unknown output format '{ext}', expected one of {sorted(WRITERS)}")
+    heightmap = load_heightmap(args.input)
+
+    lines = contours(heightmap, contour_levels(heightmap, args.interval, args.count))
+    WRITERS[ext](lines, args.output)
+    print(f"[INFO] {lines} -> {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,392 @@
+"""
+Adaptive triangle meshes from heightmaps (right-triangulated irregular
+networks, RTIN) and binary glTF, STL and OBJ writers.
+
+    python -m export.mesh terrain.npy terrain.glb --max-error 0.01 --z-scale 64
+"""
+import argparse
+import json
+import struct
+
+import numpy as np
+
+from store.archive import load_heightmap
+from store.shared  import as_array
+from utils.jit      import njit
+
+def _view(array, r0, c0, step, rows, cols):
+    """
+    Lattice view array[r0 + step*i, c0 + step*j] for i < rows, j < cols,
+    clipped to the array. :return: (view, row slice, col slice) of the lattice it covers.
+    """
+    size_r, size_c = array.shape
+    i0 = max(0, -(-(-r0) // step))
+    j0 = max(0, -(-(-c0) // step))
+    i1 = min(rows, (size_r - 1 - r0) // step + 1)
+    j1 = min(cols, (size_c - 1 - c0) // step + 1)
+    if i1 <= i0 or j1 <= j0:
+        return None, None, None
+    view = array[r0 + step * i0:r0 + step * (i1 - 1) + 1:step, c0 + step * j0:c0 + step * (j1 - 1) + 1:step]
+    return view, slice(i0, i1), slice(j0, j1)
+
+def _propagate(errors, out, r0, c0, step, offsets):
+    """out = max(out, errors at each offset from the lattice r0 + step*i, c0 + step*j)."""
+    rows, cols = out.shape
+    for dy, dx in offsets:
+        view, i, j = _view(errors, r0 + dy, c0 + dx, step, rows, cols)
+        if view is not None:
+            np.maximum(out[i, j], view, out=out[i, j])
+
+@njit(cache=True)
+def _plane(h, ay, ax, by, bx, cy, cx):
+    """Height at corner a and gradient (d/dy, d/dx) of the plane through corners a, b and c."""
+    ha, hb, hc = h[ay, ax], h[by, bx], h[cy, cx]
+    uy, ux, vy, vx = by - ay, bx - ax, cy - ay, cx - ax
+    det = uy * vx - ux * vy
+    return ha, ((hb - ha) * vx - ux * (hc - ha)) / det, (uy * (hc - ha) - vy * (hb - ha)) / det
+
+@njit(cache=True)
+def _row_error(h, y, lo, hi, base, gx, worst):
+    """max(worst, |h[y, x] - (base + x * gx)|) over columns lo..hi."""
+    for x in range(lo, hi + 1):
+        worst = max(worst, abs(h[y, x] - (base + x * gx)))
+    return worst
+
+@njit(cache=True)
+def _triangle_errors(h):
+    """
+    errors[y, x]: largest deviation of the (one or two) triangles that the
+    split at vertex (y, x) creates from the heights of all their grid points.
+    At lattice step S = 2*half, a square's center splits its diagonal into
+    the square's halves, and an edge midpoint splits that edge into the
+    quarters of the squares on either side (apex at their centers). Both
+    tile each square, so every square is walked once per kind, row by row.
+    """
+    size = h.shape[0]
+    errors = np.zeros(h.shape, dtype=np.float32)
+    # Step 2: the only grid points of a triangle besides its corners are split vertices,
+    # an edge midpoint off the edge's interpolation, a center off the diagonal's; the
+    # halves of a square hold its center and all four edge midpoints
+    for y in range(0, size, 2):
+        for x in range(1, size, 2):
+            errors[y, x] = abs(h[y, x] - (h[y, x - 1] + h[y, x + 1]) / 2)
+            errors[x, y] = abs(h[x, y] - (h[x - 1, y] + h[x + 1, y]) / 2)
+    for i in range((size - 1) // 2):
+        for j in range((size - 1) // 2):
+            y, x = 2 * i + 1, 2 * j + 1
+            if (i + j) % 2 == 0:
+                diagonal = (h[y - 1, x - 1] + h[y + 1, x + 1]) / 2
+            else:
+                diagonal = (h[y - 1, x + 1] + h[y + 1, x - 1]) / 2
+            errors[y, x] = max(
+                abs(h[y, x] - diagonal), errors[y - 1, x], errors[y + 1, x], errors[y, x - 1], errors[y, x + 1]
+            )
+    half = 2
+    while half < size - 1:
+        S = 2 * half
+        n = (size - 1) // S
+        for i in range(n):
+            for j in range(n):
+                y0, x0, y1, x1 = i * S, j * S, i * S + S, j * S + S
+                ym, xm = y0 + half, x0 + half
+
+                # halves: the diagonal alternates in a checkerboard, as in rtin_errors;
+                # a is below or left of it, b above or right
+                if (i + j) % 2 == 0:
+                    pa = _plane(h, y0, x0, y1, x1, y1, x0)
+                    pb = _plane(h, y0, x0, y1, x1, y0, x1)
+                else:
+                    pa = _plane(h, y0, x1, y1, x0, y0, x0)
+                    pb = _plane(h, y0, x1, y1, x0, y1, x1)
+                # quarters: top, bottom, left, right, with the center as apex
+                pt = _plane(h, y0, x0, y0, x1, ym, xm)
+                pd = _plane(h, y1, x0, y1, x1, ym, xm)
+                pl = _plane(h, y0, x0, y1, x0, ym, xm)
+                pr = _plane(h, y0, x1, y1, x1, ym, xm)
+                ea = eb = et = ed = el = er = 0.0
+                for dy in range(S + 1):
+                    y = y0 + dy
+                    # plane value at (y, 0) of each triangle, from its corner a
+                    ba = pa[0] + (y - y0) * pa[1] - (x0 if (i + j) % 2 == 0 else x1) * pa[2]
+                    bb = pb[0] + (y - y0) * pb[1] - (x0 if (i + j) % 2 == 0 else x1) * pb[2]
+                    if (i + j) % 2 == 0:
+                        ea = _row_error(h, y, x0, x0 + dy, ba, pa[2], ea)
+                        eb = _row_error(h, y, x0 + dy, x1, bb, pb[2], eb)
+                    else:
+                        ea = _row_error(h, y, x0, x1 - dy, ba, pa[2], ea)
+                        eb = _row_error(h, y, x1 - dy, x1, bb, pb[2], eb)
+                    k = min(dy, S - dy)
+                    el = _row_error(h, y, x0, x0 + k, pl[0] + (y - y0) * pl[1] - x0 * pl[2], pl[2], el)
+                    er = _row_error(h, y, x1 - k, x1, pr[0] + (y - y0) * pr[1] - x1 * pr[2], pr[2], er)
+                    if dy <= half:
+                        et = _row_error(h, y, x0 + dy, x1 - dy, pt[0] + (y - y0) * pt[1] - x0 * pt[2], pt[2], et)
+                    if dy >= half:
+                        ed = _row_error(h, y, x1 - dy, x0 + dy, pd[0] + (y - y1) * pd[1] - x0 * pd[2], pd[2], ed)
+                errors[ym, xm] = max(ea, eb)
+                errors[y0, xm] = max(errors[y0, xm], et)
+                errors[y1, xm] = max(errors[y1, xm], ed)
+                errors[ym, x0] = max(errors[ym, x0], el)
+                errors[ym, x1] = max(errors[ym, x1], er)
+        half = S
+    return errors
+
+def rtin_errors(heightmap):
+    """
+    Error hierarchy of the RTIN over `heightmap`.
+
+    errors[y, x] is the largest distance between a height and the plane of
+    the triangles the split at (y, x) creates, over all grid points they
+    cover (not only the split vertex), maxed with the errors of every vertex
+    below it in the hierarchy. So splitting on `errors > max_error` never
+    leaves cracks, and every grid height is within max_error of the mesh.
+
+    :param heightmap: Square (2^k+1)² array.
+    :return: float32 array shaped like `heightmap`.
+    """
+    h = np.asarray(heightmap, dtype=np.float64)
+    size = h.shape[0]
+    if h.shape != (size, size) or size < 3 or (size - 1) & (size - 2):
+        raise ValueError(f"RTIN needs a square (2^k+1)² heightmap, got {h.shape}.")
+
+    own_errors = _triangle_errors(h)
+    errors = np.zeros(h.shape, dtype=np.float32)
+    half = 1
+    while half < size - 1:
+        step = 2 * half
+
+        # Edge midpoints: split axis-aligned hypotenuses of length `step`.
+        # Their children are the square centers of the previous level at (±half/2, ±half/2).
+        children = [(dy, dx) for dy in (-half // 2, half // 2) for dx in (-half // 2, half // 2)] if half > 1 else []
+        for r0, c0 in ((0, half), (half, 0)):   # horizontal, vertical
+            own = own_errors[r0::step, c0::step].copy()
+            _propagate(errors, own, r0, c0, step, children)
+            errors[r0::step, c0::step] = own
+
+        # Square centers: split a diagonal, which alternates in a checkerboard
+        # (squares with an even index sum use the top-left/bottom-right one).
+        own = own_errors[half::step, half::step].copy()
+        _propagate(errors, own, half, half, step, [(-half, 0), (half, 0), (0, -half), (0, half)])
+        errors[half::step, half::step] = own
+
+        half = step
+    return errors
+
+def _clip_polygon(points, axis, limit):
+    """
+    Part of a convex polygon of (y, x) grid points with point[axis] <= limit
+    (Sutherland-Hodgman). RTIN edges run along rows, columns or diagonals,
+    so every cut lands on a grid point and stays integer.
+    """
+    out = []
+    for k, p in enumerate(points):
+        q = points[(k + 1) % len(points)]
+        if p[axis] <= limit:
+            out.append(p)
+        if (p[axis] - limit) * (q[axis] - limit) < 0:
+            other = 1 - axis
+            cut = [0, 0]
+            cut[axis] = limit
+            cut[other] = p[other] + (limit - p[axis]) * (q[other] - p[other]) // (q[axis] - p[axis])
+            out.append(tuple(cut))
+    return out
+
+class RTIN:
+    """
+    Heightmap plus its precomputed error hierarchy; `mesh(max_error)` extracts
+    a crack-free adaptive triangulation in one vectorized pass per level.
+    Heightmaps of any shape: others than (2^k+1)² are edge-padded to the next
+    lattice and the triangulation is clipped back to them.
+    """
+
+    def __init__(self, heightmap):
+        """:param heightmap: Array or SharedArray handle (mapped read-only, not copied)."""
+        heightmap = np.asarray(as_array(heightmap))
+        self.shape = heightmap.shape
+        rows, cols = self.shape
+        self.size = 2 ** max(1, (max(rows, cols) - 2).bit_length()) + 1
+        if self.shape != (self.size, self.size):
+            heightmap = np.pad(heightmap, ((0, self.size - rows), (0, self.size - cols)), mode='edge')
+        self.heightmap = heightmap
+        self.errors = rtin_errors(self.heightmap)
+
+    def triangles(self, max_error=0.0):
+        """
+        Grid triangles within `max_error` of every grid height they cover, within the map's shape.
+        :return: (T, 3) uint32 flat indices (y * size + x) into the padded
+                 lattice, counter-clockwise seen from +z.
+        """
+        last = self.size - 1
+        # Triangle corners as int32 columns: a-b is the hypotenuse, c the right angle
+        ay, ax = np.array([0, last], np.int32), np.array([0, last], np.int32)
+        by, bx = np.array([last, 0], np.int32), np.array([last, 0], np.int32)
+        cy, cx = np.array([0, last], np.int32), np.array([last, 0], np.int32)
+        leaves = []
+
+        while ay.size:
+            my, mx = (ay + by) >> 1, (ax + bx) >> 1
+            split = np.maximum(np.abs(ay - by), np.abs(ax - bx)) > 1
+            split[split] = self.errors[my[split], mx[split]] > max_error
+            keep = ~split
+            if keep.any():
+                leaves.append(self._leaves(ay[keep], ax[keep], by[keep], bx[keep], cy[keep], cx[keep]))
+
+            ay, ax, by, bx, cy, cx, my, mx = (v[split] for v in (ay, ax, by, bx, cy, cx, my, mx))
+            # children (a, c, m) and (c, b, m)
+            ay, ax, by, bx, cy, cx = (
+                np.concatenate([ay, cy]), np.concatenate([ax, cx]),
+                np.concatenate([cy, by]), np.concatenate([cx, bx]),
+                np.concatenate([my, my]), np.concatenate([mx, mx]),
+            )
+
+        flat = np.concatenate(leaves)
+        if self.shape != (self.size, self.size):
+            flat = self._clip(flat)
+        return flat
+
+    def _clip(self, flat):
+        """
+        Triangles cut at the last row and column of the map: inside ones are
+        kept, outside ones dropped and the few crossing ones clipped and fanned.
+        Cuts are grid points, shared by the triangles on both sides of an edge.
+        """
+        rows, cols = self.shape
+        y, x = np.divmod(flat, np.uint32(self.size))
+        # column-wise, reductions over a length-3 axis are slow
+        inside = (np.maximum(np.maximum(y[:, 0], y[:, 1]), y[:, 2]) < rows) & \
+                 (np.maximum(np.maximum(x[:, 0], x[:, 1]), x[:, 2]) < cols)
+        crossing = ~inside & (np.minimum(np.minimum(y[:, 0], y[:, 1]), y[:, 2]) < rows - 1) & \
+                   (np.minimum(np.minimum(x[:, 0], x[:, 1]), x[:, 2]) < cols - 1)
+
+        fans = []
+        for ty, tx in zip(y[crossing].astype(np.int64).tolist(), x[crossing].astype(np.int64).tolist()):
+            polygon = _clip_polygon(list(zip(ty, tx)), 1, cols - 1)
+            polygon = _clip_polygon(polygon, 0, rows - 1)
+            (ay, ax), rest = polygon[0], polygon[1:]
+            for (by, bx), (cy, cx) in zip(rest, rest[1:]):
+                if (bx - ax) * (cy - ay) - (by - ay) * (cx - ax) != 0:
+                    fans.append((ay * self.size + ax, by * self.size + bx, cy * self.size + cx))
+        return np.concatenate([flat[inside], np.array(fans, dtype=np.uint32).reshape(-1, 3)])
+
+    def _leaves(self, ay, ax, by, bx, cy, cx):
+        """Flat corner indices, with b and c swapped where a-b-c runs clockwise (x = column, y = row)."""
+        clockwise = (bx - ax) * (cy - ay) - (by - ay) * (cx - ax) < 0
+        by, cy = np.where(clockwise, cy, by), np.where(clockwise, by, cy)
+        bx, cx = np.where(clockwise, cx, bx), np.where(clockwise, bx, cx)
+        size = np.uint32(self.size)
+        return np.stack([
+            ay.astype(np.uint32) * size + ax.astype(np.uint32),
+            by.astype(np.uint32) * size + bx.astype(np.uint32),
+            cy.astype(np.uint32) * size + cx.astype(np.uint32),
+        ], axis=1)
+
+    def mesh(self, max_error=0.0, cell_size=1.0, z_scale=1.0):
+        """
+        Vertex and index buffers of the triangulation at `max_error`.
+        :return: (vertices (V, 3) float32 as x, y, z with z up, indices (T, 3) uint32).
+        """
+        flat = self.triangles(max_error)
+
+        # grid index -> vertex index, in grid order (no sort needed)
+        used = np.zeros(self.size * self.size, dtype=bool)
+        used[flat.reshape(-1)] = True
+        remap = np.cumsum(used, dtype=np.uint32) - 1
+        cells = np.flatnonzero(used)
+
+        y, x = np.divmod(cells, self.size)
+        vertices = np.empty((len(cells), 3), dtype=np.float32)
+        vertices[:, 0] = x * cell_size
+        vertices[:, 1] = y * cell_size
+        vertices[:, 2] = self.heightmap.reshape(-1)[cells] * z_scale
+        return vertices, remap[flat]
+
+def face_normals(vertices, indices):
+    v = vertices[indices]
+    normals = np.cross(v[:, 1] - v[:, 0], v[:, 2] - v[:, 0])
+    length = np.linalg.norm(normals, axis=1, keepdims=True)
+    return (normals / np.where(length > 0, length, 1)).astype(np.float32)
+
+def write_stl(path, vertices, indices):
+    """Binary STL, one 50-byte record per triangle written in a single block."""
+    record = np.dtype([('normal', '<f4', 3), ('corners', '<f4', (3, 3)), ('attribute', '<u2')])
+    data = np.zeros(len(indices), dtype=record)
+    data['normal'] = face_normals(vertices, indices)
+    data['corners'] = vertices[indices]
+    with open(path, 'wb') as f:
+        f.write(b'diamond-square terrain'.ljust(80, b'\0'))
+        f.write(struct.pack('<I', len(indices)))
+        data.tofile(f)
+    return path
+
+def write_glb(path, vertices, indices):
+    """Binary glTF 2.0 with one indexed triangle mesh (Y up, as glTF requires)."""
+    # z-up (x, y, z) -> y-up (x, z, -y): a rotation, so the winding stays counter-clockwise
+    positions = np.ascontiguousarray(np.column_stack([vertices[:, 0], vertices[:, 2], -vertices[:, 1]]), dtype='<f4')
+    index_bytes = np.ascontiguousarray(indices, dtype='<u4').tobytes()
+    position_bytes = positions.tobytes()
+    binary = index_bytes + position_bytes  # both multiples of 4 bytes
+
+    gltf = {
+        'asset': {'version': '2.0', 'generator': 'diamond-square'},
+        'scene': 0,
+        'scenes': [{'nodes': [0]}],
+        'nodes': [{'mesh': 0}],
+        'meshes': [{'primitives': [{'attributes': {'POSITION': 1}, 'indices': 0, 'mode': 4}]}],
+        'buffers': [{'byteLength': len(binary)}],
+        'bufferViews': [
+            {'buffer': 0, 'byteOffset': 0, 'byteLength': len(index_bytes), 'target': 34963},
+            {'buffer': 0, 'byteOffset': len(index_bytes), 'byteLength': len(position_bytes), 'target': 34962},
+        ],
+        'accessors': [
+            {'bufferView': 0, 'componentType': 5125, 'count': int(indices.size), 'type': 'SCALAR'},
+            {'bufferView': 1, 'componentType': 5126, 'count': len(positions), 'type': 'VEC3',
+             'min': positions.min(axis=0).tolist(), 'max': positions.max(axis=0).tolist()},
+        ],
+    }
+    json_bytes = json.dumps(gltf, separators=(',', ':')).encode('utf-8')
+    json_bytes += b' ' * (-len(json_bytes) % 4)
+
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<4sII', b'glTF', 2, 12 + 8 + len(json_bytes) + 8 + len(binary)))
+        f.write(struct.pack('<I4s', len(json_bytes), b'JSON'))
+        f.write(json_bytes)
+        f.write(struct.pack('<I4s', len(binary), b'BIN\0'))
+        f.write(binary)
+    return path
+
+def write_obj(path, vertices, indices):
+    """Wavefront OBJ (text); formatted in two bulk string operations."""
+    with open(path, 'w') as f:
+        f.write(('v %.6f %.6f %.6f\n' * len(vertices)) % tuple(vertices.ravel().tolist()))
+        f.write(('f %d %d %d\n' * len(indices)) % tuple((indices.ravel() + 1).tolist()))
+    return path
+
+WRITERS = {
+    '.glb': write_glb,
+    '.stl': write_stl,
+    '.obj': write_obj,
+}
+
+def export_mesh(heightmap, path, max_error=0.0, cell_size=1.0, z_scale=1.0):
+    """Triangulate `heightmap` at `max_error` and write it; the format follows the extension."""
+    ext = path[path.rfind('.'):].lower()
+    if ext not in WRITERS:
+        raise ValueError(f"Unknown mesh format '{ext}', expected one of {sorted(WRITERS)}.")
+    vertices, indices = RTIN(heightmap).mesh(max_error, cell_size, z_scale)
+    WRITERS[ext](path, vertices, indices)
+    print(f"[INFO] mesh: {len(vertices)} vertices, {len(indices)} triangles -> {path}")
+    return vertices, indices
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', help="heightmap .npy or .dsa archive (or erosion checkpoint .npz)")
+    parser.add_argument('output', help="mesh file: .glb, .stl or .obj")
+    parser.add_argument('--max-error', type=float, default=0.0, help="in height units, before --z-scale")
+    parser.add_argument('--cell-size', type=float, default=1.0)
+    parser.add_argument('--z-scale', type=float, default=1.0)
+    args = parser.parse_args(argv)
+
+    heightmap = load_heightmap(args.input)
+    export_mesh(heightmap, args.output, args.max_error, args.cell_size, args.z_scale)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Batched generation of many small maps: datasets and throughput.
+
+Seeds start, start+1, ... are generated `--batch` at a time with
+`make_batch` (default `make` parameters) into one (count, size, size)
+.npy file, which is written batch by batch and can be opened with
+np.load(path, mmap_mode='r'). --benchmark compares maps per second
+against calling `make` once per seed, --check that every map equals the
+one `make` returns for its seed, including where `tol` stops erosion early.
+
+    python -m generate.batch --count 1024 --size 257 --out maps.npy
+    python -m generate.batch --size 257 --benchmark
+    python -m generate.batch --size 65 --count 8 --check
+"""
+import argparse
+import contextlib
+import io
+import time
+
+import numpy as np
+
+from generate.ds.terrain import make, make_batch
+from texture.plot        import colored_rgba
+
+def generate(path, count, size=257, batch=32, start=0, **params):
+    """
+    Write the heightmaps of seeds start .. start+count-1 to the .npy file `path`.
+    :param params: Further `make_batch` parameters.
+    :return: Maps per second.
+    """
+    began = time.perf_counter()
+    out = None
+    for first in range(start, start + count, batch):
+        seeds = range(first, min(first + batch, start + count))
+        with contextlib.redirect_stdout(io.StringIO()):
+            maps = make_batch(seeds, size=size, **params)
+        if out is None:
+            out = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(count,) + maps.shape[1:])
+        out[first - start:first - start + len(seeds)] = maps
+        print(f"[INFO] batch: {first - start + len(seeds)}/{count} maps", end='\r')
+    out.flush()
+    print()
+    rate = count / (time.perf_counter() - began)
+    print(f"[INFO] batch: {count} maps of {size}x{size} in {path}, {rate:.1f} maps/s")
+    return rate
+
+def benchmark(size=257, count=64, batches=(8, 32)):
+    """
+    Maps per second, heightmap and colormap, of `make` per seed against `make_batch`.
+    :return: List of (batch size, maps/s); batch size 1 is the `make` loop.
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        make_batch([0], size=9)  # compile the erosion kernels outside the timings
+        start = time.perf_counter()
+        for seed in range(count):
+            colored_rgba(make(size=size, seed=seed))
+    rows = [(1, count / (time.perf_counter() - start))]
+
+    for batch in batches:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for first in range(0, count, batch):
+                colored_rgba(make_batch(range(first, min(first + batch, count)), size=size))
+        rows.append((batch, count / (time.perf_counter() - start)))
+
+    base = rows[0][1]
+    for batch, rate in rows:
+        label = 'make loop' if batch == 1 else f"batch {batch}"
+        print(f"[INFO] {label:>10}  {rate:7.1f} maps/s  x{rate / base:.1f}")
+    return rows
+
+# erosion settings of --check: the defaults, early stops, and the jacobi thermal rule
+CHECKS = [
+    [['thermal'], ['hydraulic']],
+    [['thermal', {'iterations': 10, 'tol': 10.0}], ['hydraulic', {'iterations': 10, 'tol': 10.0}]],
+    [['thermal', {'iterations': 50, 'tol': 1e-3}], ['hydraulic', {'iterations': 50, 'tol': 1e-3}]],
+    [['thermal', {'rule': 'jacobi', 'tol': 1e-3}]],
+]
+
+def check(size=65, count=8, erosions=CHECKS):
+    """
+    Compare `make_batch` with `make` seed by seed for each erosion setting.
+    :return: True if every map is identical.
+    """
+    ok = True
+    for erosion in erosions:
+        with contextlib.redirect_stdout(io.StringIO()):
+            maps = make_batch(range(count), size=size, erosion=erosion)
+            matches = sum(np.array_equal(maps[seed], make(size=size, seed=seed, erosion=erosion)) for seed in range(count))
+        ok = ok and matches == count
+        print(f"[{'INFO' if matches == count else 'WARN'}] check: {matches}/{count} maps match make for erosion {erosion}")
+    return ok
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=64)
+    parser.add_argument('--size', type=int, default=257)
+    parser.add_argument('--batch', type=int, default=32)
+    parser.add_argument('--start', type=int, default=0, help="First seed")
+    parser.add_argument('--out', default='maps.npy')
+    parser.add_argument('--benchmark', action='store_true')
+    parser.add_argument('--check', action='store_true', help="compare make_batch with make (exit status 1 on a mismatch)")
+    args = parser.parse_args(argv)
+
+    if args.check:
+        raise SystemExit(0 if check(args.size, args.count) else 1)
+    if args.benchmark:
+        benchmark(args.size, args.count, sorted({8, args.batch}))
+    else:
+        generate(args.out, args.count, args.size, args.batch, args.start)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+import numpy as np
+
+from generate.erosion.hydraulic_fast import hydraulic_erosion
+
+BRUSHES = ['off', 'raise', 'lower', 'smooth', 'flatten', 'erode']
+
+def brush_window(shape, row, col, radius, halo=0):
+    """
+    Clip the square around (row, col) to the heightmap.
+
+    :return: (y0, y1, x0, x1) slice bounds, or None if the window is empty.
+    """
+    reach = int(radius) + int(halo)
+    y0, y1 = max(row - reach, 0), min(row + reach + 1, shape[0])
+    x0, x1 = max(col - reach, 0), min(col + reach + 1, shape[1])
+    if y0 >= y1 or x0 >= x1:
+        return None
+    return y0, y1, x0, x1
+
+def brush_falloff(region, row, col, radius):
+    """
+    Smooth radial weights in [0, 1] for the cells of `region`, 1 at the center and 0 at `radius`.
+    """
+    y0, y1, x0, x1 = region
+    yy = np.arange(y0, y1)[:, None] - row
+    xx = np.arange(x0, x1)[None, :] - col
+    weight = 1.0 - (yy * yy + xx * xx) / float(max(radius, 1) ** 2)
+    np.clip(weight, 0.0, 1.0, out=weight)
+    return weight * weight
+
+def box_blur(array):
+    """3x3 mean filter with edge padding."""
+    p = np.pad(array, 1, mode='edge')
+    return (
+        p[:-2, :-2] + p[:-2, 1:-1] + p[:-2, 2:] +
+        p[1:-1, :-2] + p[1:-1, 1:-1] + p[1:-1, 2:] +
+        p[2:, :-2] + p[2:, 1:-1] + p[2:, 2:]
+    ) / 9.0
+
+def apply_brush(heightmap, tool, row, col, radius=16, strength=0.5, target=None, erosion_iterations=3):
+    """
+    Apply one brush dab to `heightmap` in place, touching only the window around (row, col).
+
+    :param heightmap: 2D numpy array, modified in place.
+    :param tool: One of BRUSHES.
+    :param row: Row of the brush center in heightmap coordinates.
+    :param col: Column of the brush center in heightmap coordinates.
+    :param radius: Brush radius in cells.
+    :param strength: 0 to 1. Height delta (x0.1) for raise/lower, blend factor for smooth/flatten/erode.
+    :param target: Height that 'flatten' pulls towards, defaults to the height under the brush.
+    :param erosion_iterations: Hydraulic iterations per 'erode' dab.
+    :return: Dirty region (y0, y1, x0, x1), or None if nothing changed.
+    """
+    if tool in (None, False, 'off'):
+        return None
+    if tool not in BRUSHES:
+        raise ValueError(f"Unsupported brush: {tool}")
+
+    region = brush_window(heightmap.shape, row, col, radius)
+    if region is None:
+        return None
+    y0, y1, x0, x1 = region
+    window = heightmap[y0:y1, x0:x1]
+    weight = brush_falloff(region, row, col, radius)
+
+    if tool == 'raise':
+        window += weight * (0.1 * strength)
+    elif tool == 'lower':
+        window -= weight * (0.1 * strength)
+    elif tool == 'smooth':
+        window += weight * strength * (box_blur(window) - window)
+    elif tool == 'flatten':
+        if target is None:
+            target = heightmap[min(max(row, 0), heightmap.shape[0] - 1), min(max(col, 0), heightmap.shape[1] - 1)]
+        window += weight * strength * (target - window)
+    elif tool == 'erode':
+        # Run the erosion on window + halo so flow across the window edge stays plausible
+        halo = max(4, int(radius) // 2)
+        hy0, hy1, hx0, hx1 = brush_window(heightmap.shape, row, col, radius, halo=halo)
+        eroded = hydraulic_erosion(heightmap[hy0:hy1, hx0:hx1], iterations=erosion_iterations)
+        eroded = eroded[y0 - hy0:y1 - hy0, x0 - hx0:x1 - hx0]
+        window += weight * strength * (eroded - window)
+
+    return region
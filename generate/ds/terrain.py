@@ -1,27 +1,54 @@
-import random
 import math
+import secrets
 import numpy as np
 import opensimplex
 
 from generate.ds.terrain_edges  import *
 from PIL            import Image, ImageFilter
 
-from generate.erosion.hydraulic_fast import hydraulic_erosion
-from generate.erosion.thermal_legacy import thermal_erosion
+from generate.erosion.batched        import run_hydraulic_batch, run_thermal_batch
+from generate.erosion.state          import ErosionState
+from generate.erosion.hydraulic_fast import run_hydraulic
+from generate.erosion.multigrid      import run_multigrid
+from generate.erosion.thermal_fast   import run_thermal
+from generate.rng                    import SeedBatch, SeedTree
+from store.workspace                 import workspace
+from utils.profiling                 import profiler
 
-def add_noise(heightmap, ttype='simplex', scale=0.01, strength=0.4, seed=0):
-    new_map = np.copy(heightmap)
+def add_noise(heightmap, ttype='simplex', scale=0.01, strength=0.4, seeds=None, out=None):
+    """
+    :param heightmap: Map, or a (B, H, W) batch of maps drawing from a SeedBatch.
+    :param seeds: SeedTree node of this noise layer (default: seed 0), or SeedBatch.
+    :param out: Array to add the noise to in place (may be `heightmap`); default a copy.
+    """
+    seeds = seeds if seeds is not None else SeedTree(0)
+    trees = list(seeds) if isinstance(seeds, SeedBatch) else [seeds]
+    new_map = np.copy(heightmap) if out is None else out
+    if out is not None and out is not heightmap:
+        out[...] = heightmap
+    shape = new_map.shape[-2:]
+    stack = lambda maps: maps[0] if len(maps) == 1 else np.stack(maps)
     if ttype == 'perlin':
-        np.random.seed(seed)
-        noise_map = np.random.normal(0, 1, new_map.shape)
-        new_map += noise_map * scale
+        noise_map = stack([tree.generator().normal(0, 1, shape) for tree in trees]).reshape(new_map.shape)
+        noise_map *= scale
+        new_map += noise_map
     elif ttype == 'simplex':
-        noise_gen = opensimplex.OpenSimplex(seed)
-        for i in range(new_map.shape[0]):
-            for j in range(new_map.shape[1]):
-                new_map[i][j] += strength * noise_gen.noise2(i * scale, j * scale)
+        rows = np.arange(shape[0]) * scale
+        cols = np.arange(shape[1]) * scale
+        # own instance per job: opensimplex.seed() would change it for every thread;
+        # noise2array(x, y) is indexed [y, x]; x runs along rows here
+        noise_map = stack([opensimplex.OpenSimplex(tree.integer()).noise2array(rows, cols).T for tree in trees])
+        noise_map = noise_map.reshape(new_map.shape)
+        noise_map *= strength
+        new_map += noise_map
     return new_map
 
+def _per_map(function, array, **kwargs):
+    """Apply a single-map `function` to each map of a (B, H, W) batch (or to a single map)."""
+    if array.ndim == 2:
+        return function(array, **kwargs)
+    return np.stack([function(m, **kwargs) for m in array])
+
 def gaussian_smoothing(array, sigma=2, scale=4):
     # Convert array to PIL Image
     image = Image.fromarray(np.uint8(array * 255 / np.max(array)))  # Normalize array for image conversion
@@ -31,36 +58,91 @@ def gaussian_smoothing(array, sigma=2, scale=4):
     array = array.astype(float) / 255.0  # Normalize back to [0, 1]
     return array
 
-def single_diamond_square_step(d, w, s, avg, step=0, steps=0):
-    n = d.shape[0]
-    v = w // 2
+def _neighbours(p, r0, c0, shape, offsets):
+    """Padded lattice `p` shifted by each offset, at the cells (r0::2, c0::2) of the unpadded lattice."""
+    rows, cols = shape
+    return [
+        p[..., 1 + r0 + dr:1 + r0 + dr + 2 * rows - 1:2, 1 + c0 + dc:1 + c0 + dc + 2 * cols - 1:2]
+        for dr, dc in offsets
+    ]
 
-    diamond = [(-1, -1), (-1, 1), (1, 1), (1, -1)]
-    square = [(-1, 0), (0, -1), (1, 0), (0, 1)]
+def single_diamond_square_step(d, s, pad, seeds, step=0, steps=0):
+    """
+    One diamond-square level, vectorized. `d` is the lattice of the previous
+    level; the result is the lattice of this one, (2r-1) x (2c-1), with the
+    square centers and then the edge midpoints set to the average of their
+    neighbours plus a displacement of up to ±s.
 
-    for i in range(v, n, w):
-        for j in range(v, n, w):
-            d[i, j] = avg(d, i, j, v, diamond) + random.uniform(-s, s)
-        print(f"[INFO] diamond_square: [{step}/{steps}] diamond [{i}/{n+1}]                ", end='\r')
+    :param pad: Boundary condition from terrain_edges.
+    :param seeds: SeedTree node of this level; displacements are drawn per
+                  lattice position, so they do not depend on the lattice extent.
+                  With a SeedBatch, `d` is a (B, r, c) stack of lattices.
+    """
+    rows, cols = d.shape[-2:]
+    a = workspace.zeros(d.shape[:-2] + (2 * rows - 1, 2 * cols - 1))
+    a[..., ::2, ::2] = d
+    i = np.arange(a.shape[-2])[:, None]
+    j = np.arange(a.shape[-1])[None, :]
+    padded = lambda x: workspace.take(x.shape[:-2] + (x.shape[-2] + 2, x.shape[-1] + 2))
 
-    for i in range(v, n, w):
-        for j in range(0, n, w):
-            d[i, j] = avg(d, i, j, v, square) + random.uniform(-s, s)
-        print(f"[INFO] diamond_square: [{step}/{steps}] square1 [{i}/{n+1}]                ", end='\r')
+    # Diamond: square centers, from the 4 corners (never outside the lattice)
+    q_pad = pad(d, out=padded(d))
+    q = q_pad[..., 1:-1, 1:-1]
+    tl, tr, br, bl = q[..., :-1, :-1], q[..., :-1, 1:], q[..., 1:, 1:], q[..., 1:, :-1]
+    centers = np.add(tl, tr, out=a[..., 1::2, 1::2])
+    centers += br
+    centers += bl
+    centers /= 4.0
+    centers += seeds.uniform_at(i[1::2], j[:, 1::2], -s, s)
+    workspace.give(q_pad)
+    print(f"[INFO] diamond_square: [{step}/{steps}] diamond                ", end='\r')
 
-    for i in range(0, n, w):
-        for j in range(v, n, w):
-            d[i, j] = avg(d, i, j, v, square) + random.uniform(-s, s)
-        print(f"[INFO] diamond_square: [{step}/{steps}] square0 [{i}/{n+1}]                ", end='\r')
+    # Square: edge midpoints, from 2 corners and 2 square centers. The two
+    # passes read only cells set above, never each other's. Missing (NaN)
+    # neighbours count neither in the total nor in the count.
+    p = pad(a, out=padded(a))
+    square = [(-1, 0), (0, -1), (1, 0), (0, 1)]
+    for name, r0, c0 in (('square1', 1, 0), ('square0', 0, 1)):
+        target = a[..., r0::2, c0::2]
+        values = _neighbours(p, r0, c0, target.shape[-2:], square)
+        with workspace.borrow(target.shape, target.shape, target.shape, (target.shape, bool)) as (total, count, value, missing):
+            for k, v in enumerate(values):
+                np.isnan(v, out=missing)
+                np.copyto(value, v)
+                np.copyto(value, 0.0, where=missing)
+                np.logical_not(missing, out=missing)
+                if k == 0:
+                    np.copyto(total, value)
+                    np.copyto(count, missing)
+                else:
+                    total += value
+                    count += missing
+            np.divide(total, count, out=target)
+        target += seeds.uniform_at(i[r0::2], j[:, c0::2], -s, s)
+        print(f"[INFO] diamond_square: [{step}/{steps}] {name}                ", end='\r')
+    workspace.give(p)
+    return a
+
+def make_diamond_square(corner_values, steps, boundary_type, roughness, seeds=None, width=None, height=None):
+    """
+    Diamond-square on a (steps x steps) lattice, steps = 2^k+1, generating
+    only its top-left `height` x `width` window (default: all of it).
 
-def make_diamond_square(corner_values, steps, boundary_type, roughness):
-    array = np.zeros((steps, steps))
+    Each level is computed on the window plus the margin the next level
+    needs and cropped to it, so the work and memory follow the window, not
+    the square; the values equal the same window of the full square.
+    Periodic boundaries wrap onto the far edges and need the full square.
 
-    # Set initial corner values
-    array[ 0,  0] = corner_values[0][0]
-    array[ 0, -1] = corner_values[0][1]
-    array[-1,  0] = corner_values[1][0]
-    array[-1, -1] = corner_values[1][1]
+    :param seeds: SeedTree node of the terrain stage; level k draws from seeds.child(k).
+                  A SeedBatch of B nodes generates a (B, height, width) stack.
+    """
+    seeds = seeds if seeds is not None else SeedTree(0)
+    n = steps
+    width, height = width or n, height or n
+    if n < 3 or (n - 1) & (n - 2):
+        raise ValueError(f"Diamond-square needs a 2^k+1 lattice, got {n}.")
+    if not (1 <= width <= n and 1 <= height <= n):
+        raise ValueError(f"Window {width}x{height} does not fit the {n}x{n} lattice.")
 
     # Translate Boundaries
     boundary_functions = {
@@ -71,19 +153,38 @@ def make_diamond_square(corner_values, steps, boundary_type, roughness):
         'reflective'    : reflective,
         'wrap_around'   : wrap_around,
     }
+    pad = boundary_functions.get(boundary_type)
+    if pad is None:
+        raise NotImplementedError(f"Unknown boundary type: {boundary_type}")
+
+    levels = int(math.log2(n - 1))
 
-    function = boundary_functions.get(boundary_type, NotImplementedError)
-    # print(function)
+    # Last row and column each level must cover, from the finest level up:
+    # a level loses its outermost half-step to edge midpoints that lack the
+    # square center beyond, so the coarser level reaches that much further.
+    extents = [(height - 1, width - 1)]
+    for level in range(levels - 1, 0, -1):
+        v = (n - 1) >> (level + 1)
+        extents.append(tuple(min(n - 1, -(-(e + v) // (2 * v)) * 2 * v) for e in extents[-1]))
+    extents.reverse()
+    if boundary_type in WRAPPING:
+        extents = [(n - 1, n - 1)] * levels
 
-    w, s = steps - 1, 1.0
-    steps-=1; steps=int(math.log2(steps)); step = 0 # print logic
-    while w > 1:
-        single_diamond_square_step(array, w, s, function, step=step, steps=steps)
-        w //= 2
+    array = np.array(corner_values, dtype=float)
+    if isinstance(seeds, SeedBatch):
+        array = np.repeat(array[None], len(seeds), axis=0)
+    s = 1.0
+    level = None  # workspace buffer of the last level; `array` is its cropped view
+    for step in range(levels):
+        v = (n - 1) >> (step + 1)
+        finer = single_diamond_square_step(array, s, pad, seeds.child(step), step=step, steps=levels)
+        workspace.give(level)
+        level = finer
+        last_row, last_col = extents[step]
+        array = level[..., :last_row // v + 1, :last_col // v + 1]
         s *= roughness
-        step+=1 # print logic
     print(f"['diamond_square'] Done                             ")
-    return array
+    return array[..., :height, :width]
 
 def rescale_array(array, new_shape, order=3):
     """
@@ -100,28 +201,34 @@ def rescale_array(array, new_shape, order=3):
     resized_array = resized_array.astype(float) / 255.0  # Normalize back to [0, 1]
     return resized_array
 
-def make(
-        size=129, roughness=0.7, boundary='fixed', seed=None, scale=None,
-        corner_values   = [[2, 2], [2, 2]], 
-        erosion         = [['thermal'], ['hydraulic']], 
-        smoothing       = [[False]]
+def _pipeline(
+        seeds, size, roughness, boundary, scale, corner_values, noise, erosion, smoothing, stride, width, height,
     ):
+    """Stages of `make` on the seed tree node(s) `seeds`: a map per SeedTree, a (B, H, W) stack per SeedBatch."""
+    with profiler.stage('diamond_square'):
+        a = make_diamond_square(
+            corner_values, size, boundary, roughness, seeds=seeds.child('terrain'), width=width, height=height
+        )
 
-    # Set seed if not overwritten:
-    if seed is None:
-        seed = random.randint(0, 4294967295)
-
-    print(f"[INFO] set seed: {seed}")
-    random.seed(seed)
-    np.random.seed(seed)
-    opensimplex.seed(seed)
-
-    a = make_diamond_square(corner_values, size, boundary, roughness)
-
-    # Apply noise TODO stub
-    a = add_noise(a)
+    # Apply noise from settings-list
+    for layer, setting in enumerate(noise):
+        if setting == [False]:
+            break
+        elif isinstance(setting, list):
+            method, *params = setting
+            params_dict = {k: v for param in params if isinstance(param, dict) for k, v in param.items()}
+            if method == 'simplex':
+                params_dict['scale'] = params_dict.get('scale', 0.01) * stride
+            with profiler.stage(f"noise/{method}"):
+                add_noise(a, ttype=method, **params_dict, seeds=seeds.child('noise', layer), out=a)
+        else:
+            raise TypeError(f"Invalid noise setting type: {type(setting)}. Expected list.")
 
-    # Apply erosion from settings-list
+    # Apply erosion from settings-list; batches run the compiled engines, equal map by map
+    batch = isinstance(seeds, SeedBatch)
+    thermal, hydraulic = (run_thermal_batch, run_hydraulic_batch) if batch else (run_thermal, run_hydraulic)
+    # `a` is this run's own buffer (a window of the last lattice level): no copy unless it is not contiguous
+    state = ErosionState(np.ascontiguousarray(a, dtype=float))
     for setting in erosion:
         if setting == [False]:
             break
@@ -131,15 +238,25 @@ def make(
                 raise TypeError(f"Invalid parameter format in setting: {setting}. Expected list of dicts.")
 
             params_dict = {k: v for param in params for k, v in param.items()}
+            levels = params_dict.pop('multigrid', 0)
 
             if method == 'thermal':
-                a = thermal_erosion(a, **params_dict)
+                if stride != 1:
+                    params_dict['talus_angle'] = params_dict.get('talus_angle', 0.06) * stride
+                run = thermal
             elif method == 'hydraulic':
-                a = hydraulic_erosion(a, **params_dict)
+                run = hydraulic
             else:
                 raise ValueError(f"Unsupported erosion method: {method}")
+
+            with profiler.stage(f"erosion/{method}"):
+                if levels:
+                    run_multigrid(state, method, levels=levels, run=run, **params_dict)
+                else:
+                    run(state, **params_dict)
         else:
             raise TypeError(f"Invalid erosion setting type: {type(setting)}. Expected list.")
+    a = state.heightmap
 
     # Apply smoothing from settings-list
     smoothing = [smoothing] if isinstance(smoothing[0], str) else smoothing
@@ -151,7 +268,8 @@ def make(
             method, *params = setting
             params_dict = {k: v for param in params if isinstance(param, dict) for k, v in param.items()}
             if method == 'gauss' and isinstance(params, list):
-                a = gaussian_smoothing(a, **params_dict)
+                with profiler.stage(f"smoothing/{method}"):
+                    a = _per_map(gaussian_smoothing, a, **params_dict)
             else:
                 print(f'[WARN] in terrain.make sm: {method} not implemented or invalid params')
         print(f"{setting} Done                                          ", end='\r')
@@ -159,6 +277,96 @@ def make(
 
     # Rescale NumPy Array (optional)
     if scale is not None:
-        a = rescale_array(a, new_shape=(scale,scale,), order=1)
+        with profiler.stage('rescale'):
+            a = _per_map(rescale_array, a, new_shape=(scale,scale,), order=1)
+
+    return a, state
+
+def _workspace_usage(before):
+    """What the scratch-array pool allocated and reused since the stats `before`."""
+    after = workspace.stats()
+    return {key: after[key] - before[key] for key in ('allocated', 'allocations', 'reused')}
+
+def make(
+        size=129, roughness=0.7, boundary='fixed', seed=None, scale=None,
+        corner_values   = [[2, 2], [2, 2]], 
+        noise           = [['simplex', {'scale': 0.01, 'strength': 0.4}]],
+        erosion         = [['thermal'], ['hydraulic']], 
+        smoothing       = [[False]],
+        return_state    = False,
+        stride          = 1,
+        width           = None,
+        height          = None,
+    ):
+    """
+    Run the full pipeline: diamond-square, noise, erosion, smoothing, rescale.
+    `width` x `height` (default: size x size) is the top-left window of the
+    size x size diamond-square lattice that is generated; every later stage
+    runs on that window only.
+    With `return_state` the ErosionState after the erosion stages is returned
+    as well, so more iterations can be run on it later.
+    `stride` > 1 renders a low-resolution preview of the map that would be
+    generated at size (size - 1) * stride + 1 with the same seed: noise
+    frequency and talus angle are scaled so features stay in place.
+    :return: Heightmap, or (heightmap, ErosionState).
+    """
+
+    # Set seed if not overwritten:
+    if seed is None:
+        seed = secrets.randbits(32)
+
+    # Stages draw from their own branch of the seed tree (see generate.rng),
+    # never from process-global random state
+    print(f"[INFO] set seed: {seed}")
+    before = workspace.stats()
+    params = dict(
+        size=size, roughness=roughness, boundary=boundary, scale=scale, corner_values=corner_values,
+        noise=noise, erosion=erosion, smoothing=smoothing, stride=stride, width=width, height=height,
+    )
+    with profiler.run('make', params=params, seed=seed) as report:
+        a, state = _pipeline(SeedTree(seed), **params)
+        if report is not None:
+            report['workspace'] = _workspace_usage(before)
+
+    if return_state:
+        return a, state
+    return a
+
+def make_batch(
+        seeds, size=129, roughness=0.7, boundary='fixed', scale=None,
+        corner_values   = [[2, 2], [2, 2]],
+        noise           = [['simplex', {'scale': 0.01, 'strength': 0.4}]],
+        erosion         = [['thermal'], ['hydraulic']],
+        smoothing       = [[False]],
+        return_state    = False,
+        stride          = 1,
+        width           = None,
+        height          = None,
+    ):
+    """
+    `make` for several seeds at once. Every stage runs on a (B, H, W) stack,
+    so the per-call overhead (stage dispatch, prints, temporaries) is paid
+    once per batch instead of once per map; map k equals
+    make(seed=seeds[k]) with the same parameters.
+    Simplex noise, smoothing and rescaling still call their libraries once per map.
+    :param seeds: Sequence of B job seeds.
+    :return: (B, H, W) heightmaps, or (heightmaps, ErosionState of the stack).
+    """
+    seeds = list(seeds)
+    if not seeds:
+        raise ValueError("make_batch needs at least one seed.")
+
+    print(f"[INFO] set seeds: {seeds[0]}..{seeds[-1]} ({len(seeds)} maps)")
+    before = workspace.stats()
+    params = dict(
+        size=size, roughness=roughness, boundary=boundary, scale=scale, corner_values=corner_values,
+        noise=noise, erosion=erosion, smoothing=smoothing, stride=stride, width=width, height=height,
+    )
+    with profiler.run('make_batch', params=params, seed=seeds) as report:
+        a, state = _pipeline(SeedBatch(seeds), **params)
+        if report is not None:
+            report['workspace'] = _workspace_usage(before)
 
+    if return_state:
+        return a, state
     return a
@@ -1,67 +1,60 @@
-# Function definitions for terrain generation
+# Boundary conditions of diamond-square, as padding of a level's lattice.
+# Each function returns the lattice `d` with one extra cell on every side,
+# holding the value a neighbour across the edge takes; NaN means there is
+# no neighbour and the average skips it. The inner part is what reads of
+# the lattice itself see. Interior lattice cells not computed yet hold 0.
+# Lattices are the last two axes; leading axes (a batch of maps) pass through.
+# With `out` (an array two cells larger than `d`) the padding is written there
+# instead of a new array, equal to what np.pad returns.
+import numpy as np
 
-def clamp(d, i, j, v, offsets):
-    n = d.shape[0]
-    res, k = 0, 0
-    for p, q in offsets:
-        pp, qq = i + p * v, j + q * v
-        # Clamp coordinates to the nearest edge
-        pp = max(0, min(n - 1, pp))
-        qq = max(0, min(n - 1, qq))
-        res += d[pp, qq]
-        k += 1.0
-    return res / k
+def _pad(d, out=None, mode='constant', constant_values=0.0):
+    if out is None:
+        kwargs = {'constant_values': constant_values} if mode == 'constant' else {}
+        return np.pad(d, [(0, 0)] * (d.ndim - 2) + [(1, 1), (1, 1)], mode=mode, **kwargs)
 
-def fixed(d, i, j, v, offsets):
-    n = d.shape[0]
-    res, k = 0, 0
-    for p, q in offsets:
-        pp, qq = i + p * v, j + q * v
-        if 0 <= pp < n and 0 <= qq < n:
-            res += d[pp, qq]
-            k += 1.0
-    return res / k
+    out[..., 1:-1, 1:-1] = d
+    # rows first, then whole columns (corners included), as np.pad goes axis by axis
+    if mode == 'constant':
+        out[..., 0, 1:-1] = out[..., -1, 1:-1] = constant_values
+        out[..., :, 0] = out[..., :, -1] = constant_values
+    elif mode == 'edge':
+        out[..., 0, 1:-1], out[..., -1, 1:-1] = d[..., 0, :], d[..., -1, :]
+        out[..., :, 0], out[..., :, -1] = out[..., :, 1], out[..., :, -2]
+    elif mode == 'reflect':
+        out[..., 0, 1:-1], out[..., -1, 1:-1] = d[..., 1, :], d[..., -2, :]
+        out[..., :, 0], out[..., :, -1] = out[..., :, 2], out[..., :, -3]
+    else:
+        raise ValueError(f"Unsupported padding mode: {mode}")
+    return out
 
-def mirror(d, i, j, v, offsets):
-    n = d.shape[0]
-    res, k = 0, 0
-    for p, q in offsets:
-        pp, qq = i + p * v, j + q * v
-        if pp < 0 or pp >= n:
-            pp = abs(pp) if pp < 0 else 2 * (n - 1) - pp
-        if qq < 0 or qq >= n:
-            qq = abs(qq) if qq < 0 else 2 * (n - 1) - qq
-        res += d[pp, qq]
-        k += 1.0
-    return res / k
+def _take(d, rows, cols, out=None):
+    if out is None:
+        return d[..., rows[:, None], cols[None, :]]
+    return np.take(d[..., rows, :], cols, axis=-1, out=out)
 
-def periodic(d, i, j, v, offsets):
-    n = d.shape[0] - 1
-    res = 0
-    for p, q in offsets:
-        res += d[(i + p * v) % n, (j + q * v) % n]
-    return res / 4.0
+def clamp(d, out=None):
+    # The nearest edge cell across the edge is the cell being computed, still 0
+    return _pad(d, out, mode='edge')
 
-def reflective(d, i, j, v, offsets):
-    n = d.shape[0]
-    res, k = 0, 0
-    for p, q in offsets:
-        pp, qq = i + p * v, j + q * v
-        if pp < 0:
-            pp = -pp
-        elif pp >= n:
-            pp = 2 * (n - 1) - pp
-        if qq < 0:
-            qq = -qq
-        elif qq >= n:
-            qq = 2 * (n - 1) - qq
-        res += d[pp, qq]
-        k += 1.0
-    return res / k
+def fixed(d, out=None):
+    return _pad(d, out, mode='constant', constant_values=np.nan)
 
-def wrap_around(d, i, j, v, offsets):
-    n = d.shape[0]
-    res = 0
-    for p, q in offsets:
-        res += d[(i + p * v) % n, (j + q * v) % n]
-    return res / len(offsets)
+def mirror(d, out=None):
+    return _pad(d, out, mode='reflect')
+
+def periodic(d, out=None):
+    # Every index modulo (n - 1): reads of the last row/column see the first
+    rows, cols = d.shape[-2:]
+    return _take(d, np.arange(-1, rows + 1) % (rows - 1), np.arange(-1, cols + 1) % (cols - 1), out)
+
+def reflective(d, out=None):
+    return _pad(d, out, mode='reflect')
+
+def wrap_around(d, out=None):
+    # Index modulo n lands between lattice points on coarse levels and on edge
+    # midpoints of the same pass on the finest; neither holds a value yet
+    return _pad(d, out, mode='constant', constant_values=0.0)
+
+# Boundaries whose neighbours come from the far side of the whole square
+WRAPPING = {'periodic'}
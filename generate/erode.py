@@ -0,0 +1,48 @@
+"""
+Run (more) erosion on a saved heightmap or resume a checkpoint.
+
+    python -m generate.erode terrain.npy --method hydraulic --iterations 200 --checkpoint run.npz --every 20
+    python -m generate.erode run.npz --method hydraulic --iterations 50
+"""
+import argparse
+
+import numpy as np
+
+from generate.erosion.state import ErosionState
+from generate.erosion.hydraulic_fast import run_hydraulic
+from generate.erosion.thermal_fast import run_thermal
+
+ENGINES = {
+    'hydraulic': run_hydraulic,
+    'thermal': run_thermal,
+}
+
+def load_state(path):
+    """A .npz is treated as an ErosionState checkpoint, anything else as a plain .npy heightmap."""
+    if path.endswith('.npz'):
+        return ErosionState.load(path)
+    return ErosionState.from_heightmap(np.load(path))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', help="heightmap .npy or checkpoint .npz")
+    parser.add_argument('--method', choices=sorted(ENGINES), default='hydraulic')
+    parser.add_argument('--iterations', type=int, default=5)
+    parser.add_argument('--checkpoint', help="checkpoint .npz to write (defaults to the input if it is a checkpoint)")
+    parser.add_argument('--every', type=int, default=0, help="checkpoint every N iterations")
+    parser.add_argument('--output', help="write the final heightmap as .npy")
+    args = parser.parse_args(argv)
+
+    state = load_state(args.input)
+    checkpoint = args.checkpoint or (args.input if args.input.endswith('.npz') else None)
+    print(f"[INFO] resuming {state}")
+
+    ENGINES[args.method](state, iterations=args.iterations, checkpoint=checkpoint, checkpoint_every=args.every)
+    print(f"\n[INFO] done {state}")
+
+    if args.output:
+        np.save(args.output, state.heightmap)
+    return state
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+"""
+Erosion of a whole batch of maps, (B, H, W), for batched generation
+(generate.ds.terrain.make_batch).
+
+Each iteration is one compiled loop over the cells instead of the few dozen
+full-size NumPy temporaries of `thermal_step` / `hydraulic_step`, which is
+where small maps spend their time (the sequential thermal rule is compiled
+in both engines and shared). The loops repeat the arithmetic of those
+steps operation for operation (same order, same edge handling), so map k of
+the batch is bit-identical to running the NumPy engines on it alone,
+including where `tol` stops it early. Batches keep no convergence history.
+"""
+import numpy as np
+
+from generate.erosion.state        import ErosionState
+from generate.erosion.thermal_fast import RULES, _sequential_sweep
+from utils.jit                     import njit
+
+@njit(cache=True)
+def _thermal_sequential_map(h, iterations, talus_angle, thermal_coefficient, tol):
+    h = h.copy()
+    before = np.empty_like(h)
+    done = 0
+    previous = -1.0  # no previous change: the first iteration never stops a run
+    while done < iterations:
+        before[:, :] = h
+        _sequential_sweep(h, talus_angle, thermal_coefficient)
+        change = np.max(np.abs(h - before))
+        done += 1
+        if change < tol and change < previous:
+            break
+        previous = change
+    return h, done
+
+@njit(cache=True, error_model='numpy')
+def _thermal_map(h, iterations, talus_angle, thermal_coefficient, tol):
+    rows, cols = h.shape
+    src = h.copy()
+    dst = np.empty_like(src)
+    move = np.zeros((4, rows, cols))
+    done = 0
+    previous = -1.0  # no previous change: the first iteration never stops a run
+    while done < iterations:
+        for r in range(rows):
+            for c in range(cols):
+                z = src[r, c]
+                # up, down, left, right; edge cells are their own neighbour
+                e0 = max(z - src[max(r - 1, 0), c] - talus_angle, 0.0)
+                e1 = max(z - src[min(r + 1, rows - 1), c] - talus_angle, 0.0)
+                e2 = max(z - src[r, max(c - 1, 0)] - talus_angle, 0.0)
+                e3 = max(z - src[r, min(c + 1, cols - 1)] - talus_angle, 0.0)
+                total = e0 + e1 + e2 + e3
+                scale = thermal_coefficient * max(max(e0, e1), max(e2, e3)) / total if total > 0 else 0.0
+                move[0, r, c] = e0 * scale
+                move[1, r, c] = e1 * scale
+                move[2, r, c] = e2 * scale
+                move[3, r, c] = e3 * scale
+        change = 0.0
+        for r in range(rows):
+            for c in range(cols):
+                out = src[r, c] - (move[0, r, c] + move[1, r, c] + move[2, r, c] + move[3, r, c])
+                out += move[1, r - 1, c] if r > 0 else 0.0
+                out += move[0, r + 1, c] if r < rows - 1 else 0.0
+                out += move[3, r, c - 1] if c > 0 else 0.0
+                out += move[2, r, c + 1] if c < cols - 1 else 0.0
+                dst[r, c] = out
+                change = max(change, abs(out - src[r, c]))
+        src, dst = dst, src
+        done += 1
+        if change < tol and change < previous:
+            break
+        previous = change
+    return src, done
+
+@njit(cache=True, error_model='numpy')
+def _hydraulic_map(
+        h, water, sediment, iterations,
+        rain_amount, evaporation_rate, erosion_rate, sediment_capacity_factor, tol,
+    ):
+    rows, cols = h.shape
+    h, water, sediment = h.copy(), water.copy(), sediment.copy()
+    frac = np.zeros((4, rows, cols))
+    rained = np.empty((rows, cols))
+    moveable = np.empty((rows, cols))
+    before = np.empty((rows, cols))
+    keep = 1 - evaporation_rate
+    done = 0
+    previous = -1.0  # no previous change: the first iteration never stops a run
+    while done < iterations:
+        # flow fractions from the heights at the start of the iteration
+        for r in range(rows):
+            for c in range(cols):
+                before[r, c] = h[r, c]
+                rained[r, c] = water[r, c] + rain_amount
+                z = h[r, c]
+                p0 = max(z - h[max(r - 1, 0), c], 0.0)
+                p1 = max(z - h[min(r + 1, rows - 1), c], 0.0)
+                p2 = max(z - h[r, max(c - 1, 0)], 0.0)
+                p3 = max(z - h[r, min(c + 1, cols - 1)], 0.0)
+                total = p0 + p1 + p2 + p3
+                if total > 0:
+                    frac[0, r, c] = erosion_rate * p0 / total
+                    frac[1, r, c] = erosion_rate * p1 / total
+                    frac[2, r, c] = erosion_rate * p2 / total
+                    frac[3, r, c] = erosion_rate * p3 / total
+                else:
+                    frac[0, r, c] = frac[1, r, c] = frac[2, r, c] = frac[3, r, c] = 0.0
+        # water flow, erosion and the sediment that can move
+        for r in range(rows):
+            for c in range(cols):
+                w = rained[r, c]
+                outflow = frac[0, r, c] * w + frac[1, r, c] * w + frac[2, r, c] * w + frac[3, r, c] * w
+                water[r, c] = (
+                    w - outflow
+                    + (frac[1, r - 1, c] * rained[r - 1, c] if r > 0 else 0.0)
+                    + (frac[0, r + 1, c] * rained[r + 1, c] if r < rows - 1 else 0.0)
+                    + (frac[3, r, c - 1] * rained[r, c - 1] if c > 0 else 0.0)
+                    + (frac[2, r, c + 1] * rained[r, c + 1] if c < cols - 1 else 0.0)
+                )
+                eroded = min(erosion_rate * outflow, h[r, c])
+                h[r, c] = h[r, c] - eroded
+                s = sediment[r, c] + eroded
+                moveable[r, c] = min(s, outflow * sediment_capacity_factor)
+                sediment[r, c] = s - moveable[r, c]
+        # sediment transport along the water, evaporation, deposition
+        change = 0.0
+        for r in range(rows):
+            for c in range(cols):
+                m = moveable[r, c]
+                carried = (
+                    m * (frac[0, r, c] / erosion_rate) + m * (frac[1, r, c] / erosion_rate)
+                    + m * (frac[2, r, c] / erosion_rate) + m * (frac[3, r, c] / erosion_rate)
+                )
+                s = (
+                    sediment[r, c] - carried
+                    + (moveable[r - 1, c] * (frac[1, r - 1, c] / erosion_rate) if r > 0 else 0.0)
+                    + (moveable[r + 1, c] * (frac[0, r + 1, c] / erosion_rate) if r < rows - 1 else 0.0)
+                    + (moveable[r, c - 1] * (frac[3, r, c - 1] / erosion_rate) if c > 0 else 0.0)
+                    + (moveable[r, c + 1] * (frac[2, r, c + 1] / erosion_rate) if c < cols - 1 else 0.0)
+                )
+                w = water[r, c] * keep
+                depos = min(s, w)
+                water[r, c] = w
+                h[r, c] = h[r, c] + depos
+                sediment[r, c] = s - depos
+                change = max(change, abs(h[r, c] - before[r, c]))
+        done += 1
+        if change < tol and change < previous:
+            break
+        previous = change
+    return h, water, sediment, done
+
+def _tol(tol):
+    # the kernels stop as state.converged says (never on the first iteration, whose
+    # previous change is -1); never for a tolerance of -1
+    return -1.0 if tol is None else float(tol)
+
+def _stack(array):
+    array = np.ascontiguousarray(array, dtype=np.float64)
+    if array.ndim != 3:
+        raise ValueError(f"Batched erosion needs a (B, H, W) stack, got shape {array.shape}.")
+    return array
+
+def run_thermal_batch(
+    state:               ErosionState,
+    iterations:          int = 12,
+    talus_angle:         float = 0.06,
+    thermal_coefficient: float = 0.5,
+    tol:                 float = None,
+    rule:                str = 'sequential',
+) -> ErosionState:
+    """
+    `run_thermal` on a state whose fields are (B, H, W) stacks.
+    With `tol` every map stops on its own; the state counts the most iterations any map ran.
+    :return: The same state object, advanced.
+    """
+    if rule not in RULES:
+        raise ValueError(f"Unknown thermal rule '{rule}', expected one of {RULES}.")
+    kernel = _thermal_sequential_map if rule == 'sequential' else _thermal_map
+    h = _stack(state.heightmap)
+    results = [
+        kernel(m, iterations, float(talus_angle), float(thermal_coefficient), _tol(tol)) for m in h
+    ]
+    state.heightmap = np.stack([m for m, _ in results])
+    state.advance('thermal', max(done for _, done in results))
+    return state
+
+def run_hydraulic_batch(
+    state:                    ErosionState,
+    iterations:               int = 5,
+    rain_amount:              float = 0.05,
+    evaporation_rate:         float = 0.01,
+    erosion_rate:             float = 0.5,
+    sediment_capacity_factor: float = 0.05,
+    tol:                      float = None,
+) -> ErosionState:
+    """
+    `run_hydraulic` on a state whose fields are (B, H, W) stacks.
+    With `tol` every map stops on its own; the state counts the most iterations any map ran.
+    :return: The same state object, advanced.
+    """
+    fields = [_stack(state.heightmap), _stack(state.water), _stack(state.sediment)]
+    params = (float(rain_amount), float(evaporation_rate), float(erosion_rate), float(sediment_capacity_factor))
+    results = [_hydraulic_map(h, w, s, iterations, *params, _tol(tol)) for h, w, s in zip(*fields)]
+    heightmaps, waters, sediments, done = zip(*results)
+    state.heightmap, state.water, state.sediment = np.stack(heightmaps), np.stack(waters), np.stack(sediments)
+    state.advance('hydraulic', max(done))
+    return state
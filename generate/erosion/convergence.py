@@ -0,0 +1,87 @@
+"""
+Convergence curves of the erosion engines, for tuning iteration counts.
+
+Generates maps without erosion for a few seeds, runs the methods in order
+(as `make` does) for up to --iterations steps each and reports, per method,
+after how many iterations a run with each tolerance would stop (see
+generate.erosion.state.converged). --csv writes the full curves
+(seed, method, iteration, max_dh, mean_dh, moved; see ErosionState.record).
+
+    python -m generate.erosion.convergence --size 257 --seeds 8 --iterations 200 --tol 1e-2 1e-3 1e-4
+"""
+import argparse
+import contextlib
+import csv
+import io
+
+import numpy as np
+
+from generate.erosion.hydraulic_fast import run_hydraulic
+from generate.erosion.state          import METRICS, ErosionState, converged
+from generate.erosion.thermal_fast   import run_thermal
+
+RUNNERS = {'thermal': run_thermal, 'hydraulic': run_hydraulic}
+
+def curves(seeds, size=257, methods=('thermal', 'hydraulic'), iterations=100):
+    """
+    :return: {seed: {method: (iterations, len(METRICS)) array}}
+    """
+    from generate.ds.terrain import make_batch
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        maps = make_batch(seeds, size=size, erosion=[[False]])
+        result = {}
+        for seed, heightmap in zip(seeds, maps):
+            state = ErosionState.from_heightmap(heightmap)
+            for method in methods:
+                RUNNERS[method](state, iterations=iterations)
+            result[seed] = {method: state.convergence(method) for method in methods}
+    return result
+
+def iterations_to(curve, tol):
+    """Iterations a run with `tol` stops after, or None if it runs the whole curve without converging."""
+    for i in range(1, len(curve)):
+        if converged(curve[i - 1, 0], curve[i, 0], tol):
+            return i + 1
+    return None
+
+def report(result, tols):
+    """Print, per method and tolerance, the iterations each seed needed and their median."""
+    methods = next(iter(result.values())).keys()
+    for method in methods:
+        print(f"[INFO] {method}:")
+        for tol in tols:
+            counts = [iterations_to(result[seed][method], tol) for seed in result]
+            reached = [n for n in counts if n is not None]
+            median = f"median {int(np.median(reached))}" if reached else "never"
+            shown = ', '.join('-' if n is None else str(n) for n in counts)
+            print(f"[INFO]   max |dh| < {tol:<8g} {median:>12}  ({len(reached)}/{len(counts)} seeds: {shown})")
+
+def write_csv(result, path):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['seed', 'method', 'iteration', *METRICS])
+        for seed, by_method in result.items():
+            for method, curve in by_method.items():
+                for i, row in enumerate(curve, 1):
+                    writer.writerow([seed, method, i, *(f"{v:.6g}" for v in row)])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=257)
+    parser.add_argument('--seeds', type=int, default=4)
+    parser.add_argument('--method', choices=sorted(RUNNERS), nargs='+', default=['thermal', 'hydraulic'])
+    parser.add_argument('--iterations', type=int, default=100, help="maximum per method")
+    parser.add_argument('--tol', type=float, nargs='+', default=[1e-2, 1e-3, 1e-4])
+    parser.add_argument('--csv', default=None)
+    args = parser.parse_args(argv)
+
+    result = curves(list(range(args.seeds)), args.size, args.method, args.iterations)
+    print(f"[INFO] erosion convergence: {args.seeds} seeds at {args.size}x{args.size}, up to {args.iterations} iterations")
+    report(result, args.tol)
+    if args.csv:
+        write_csv(result, args.csv)
+        print(f"[INFO] curves -> {args.csv}")
+
+if __name__ == '__main__':
+    main()
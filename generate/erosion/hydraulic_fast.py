@@ -1,108 +1,168 @@
 import numpy as np
 
-def hydraulic_erosion(
-    heightmap:                np.ndarray,
+from generate.erosion.state import ErosionState, converged, edge_pad, sum_directions
+from store.workspace         import workspace
+
+def hydraulic_step(
+    h:                        np.ndarray,
+    water:                    np.ndarray,
+    sediment:                 np.ndarray,
+    rain_amount:              float = 0.05,
+    evaporation_rate:         float = 0.01,
+    erosion_rate:             float = 0.5,
+    sediment_capacity_factor: float = 0.05,
+    out:                      tuple = None,
+):
+    """
+    One fully-vectorized hydraulic erosion iteration.
+    Leading axes of the fields are a batch of independent maps.
+    Temporaries are borrowed from the workspace (store.workspace).
+    :param out: (h, water, sediment) arrays the results are written to; each
+                may be the matching input itself. Default: new arrays.
+    :return: Updated (h, water, sediment).
+    """
+    H, W = h.shape[-2:]
+    h_out, water_out, sediment_out = out or (np.empty(h.shape), np.empty(h.shape), np.empty(h.shape))
+    take = lambda shape=h.shape, dtype=float: workspace.take(shape, dtype)
+
+    # 1) Rain
+    w = np.add(water, rain_amount, out=take())
+
+    # 2) Compute height diffs to neighbors
+    #    pad edges so everything stays same shape
+    pad_h = edge_pad(h, take(h.shape[:-2] + (H + 2, W + 2)))
+    cen = pad_h[...,1:-1,1:-1]
+    frac = take((4,) + h.shape)
+    np.subtract(cen, pad_h[...,0:-2,1:-1], out=frac[0])  # up
+    np.subtract(cen, pad_h[...,2:  ,1:-1], out=frac[1])  # down
+    np.subtract(cen, pad_h[...,1:-1,0:-2], out=frac[2])  # left
+    np.subtract(cen, pad_h[...,1:-1,2:  ], out=frac[3])  # right
+
+    # only downhill slopes
+    np.maximum(frac, 0.0, out=frac)
+
+    total_dh = sum_directions(frac, take())
+    mask = np.greater(total_dh, 0, out=take(dtype=bool))
+
+    # flow fraction per direction; flat cells keep erosion_rate * 0
+    np.multiply(frac, erosion_rate, out=frac)
+    np.divide(frac, total_dh, out=frac, where=mask)
+
+    # compute flow amounts
+    amt = np.multiply(frac, w, out=take((4,) + h.shape))
+    outflow = sum_directions(amt, total_dh)
+
+    # update water by sending out and receiving flows
+    np.subtract(w, outflow, out=water_out)
+    _receive(water_out, amt)
+
+    # erosion: remove terrain into sediment
+    eroded = np.multiply(outflow, erosion_rate, out=take())
+    np.minimum(eroded, h, out=eroded)
+    np.subtract(h, eroded, out=h_out)
+    np.add(sediment, eroded, out=sediment_out)
+
+    # sediment transport: carry only up to capacity
+    moveable = np.multiply(outflow, sediment_capacity_factor, out=outflow)
+    np.minimum(sediment_out, moveable, out=moveable)
+    sediment_out -= moveable
+
+    # distribute moved sediment same way as water flows
+    carried = np.divide(frac, erosion_rate, out=frac)
+    np.multiply(carried, moveable, out=carried)
+    np.subtract(sediment_out, sum_directions(carried, eroded), out=sediment_out)
+    _receive(sediment_out, carried)
+
+    # 3) Evaporation
+    water_out *= (1 - evaporation_rate)
+
+    # 4) Deposition
+    depos = np.minimum(sediment_out, water_out, out=eroded)
+    h_out += depos
+    sediment_out -= depos
+
+    workspace.give(w, pad_h, frac, total_dh, mask, amt, eroded)
+    return h_out, water_out, sediment_out
+
+def _receive(field, flows):
+    """Add to `field` what its neighbours send along the (up, down, left, right) `flows`."""
+    field[..., 1:, :]  += flows[1][..., :-1, :]  # from above, moving down
+    field[..., :-1, :] += flows[0][..., 1:, :]   # from below, moving up
+    field[..., :, 1:]  += flows[3][..., :, :-1]  # from the left, moving right
+    field[..., :, :-1] += flows[2][..., :, 1:]   # from the right, moving left
+
+def run_hydraulic(
+    state:                    ErosionState,
     iterations:               int = 5,
     rain_amount:              float = 0.05,
     evaporation_rate:         float = 0.01,
     erosion_rate:             float = 0.5,
     sediment_capacity_factor: float = 0.05,
-) -> np.ndarray:
+    checkpoint:               str = None,
+    checkpoint_every:         int = 0,
+    tol:                      float = None,
+) -> ErosionState:
     """
-    A fully-vectorized hydraulic erosion on a 2D heightmap.
-    Uses only NumPy (or swap in CuPy by setting xp = cupy).
+    Continue hydraulic erosion on `state` for `iterations` more steps.
+    Water and sediment carry over, so two runs of N equal one run of 2N.
+    The change of every iteration is recorded in `state.history` (see ErosionState.record).
+
+    :param checkpoint: Optional .npz path the state is saved to every `checkpoint_every` iterations and at the end.
+    :param tol: Stop early once no cell changes by `tol` or more in an iteration and the change is
+                shrinking (see state.converged); `iterations` is then the maximum.
+    :return: The same state object, advanced.
     """
+    done = state.iterations.get('hydraulic', 0)
+    previous = None
+    spare = None  # the heightmap before the last iteration, once it is one of ours
 
-    # You can replace xp = np with:
-    try: import cupy as xp
-    except ImportError: xp = np
-    xp = np
-
-    h = heightmap.copy().astype(float)
-    water    = xp.zeros_like(h)
-    sediment = xp.zeros_like(h)
-    H, W = h.shape
-
-    # pre-allocate shifts
     for it in range(iterations):
-        # 1) Rain
-        water += rain_amount
-
-        # 2) Compute height diffs to neighbors
-        #    pad edges with zeros so everything stays same shape
-        pad_h = xp.pad(h, 1, mode='edge')
-        cen = pad_h[1:-1,1:-1]
-        up    = cen - pad_h[0:-2,1:-1]
-        down  = cen - pad_h[2:  ,1:-1]
-        left  = cen - pad_h[1:-1,0:-2]
-        right = cen - pad_h[1:-1,2:  :]
-
-        # only downhill slopes
-        pos_up    = xp.maximum(up,    0.0)
-        pos_down  = xp.maximum(down,  0.0)
-        pos_left  = xp.maximum(left,  0.0)
-        pos_right = xp.maximum(right, 0.0)
-
-        total_dh = pos_up + pos_down + pos_left + pos_right
-        mask = total_dh > 0
-
-        # flow fraction per direction
-        frac = xp.zeros((4, H, W), dtype=float)
-        frac[0][mask] = erosion_rate * pos_up[mask]    / total_dh[mask]
-        frac[1][mask] = erosion_rate * pos_down[mask]  / total_dh[mask]
-        frac[2][mask] = erosion_rate * pos_left[mask]  / total_dh[mask]
-        frac[3][mask] = erosion_rate * pos_right[mask] / total_dh[mask]
-
-        # compute flow amounts
-        w = water
-        amt_up    = frac[0] * w
-        amt_down  = frac[1] * w
-        amt_left  = frac[2] * w
-        amt_right = frac[3] * w
-
-        # update water by sending out and receiving flows
-        water = (
-            w
-            - (amt_up + amt_down + amt_left + amt_right)
-            + xp.pad(amt_down,  ((1,0),(0,0)), mode='constant')[0:H, :]
-            + xp.pad(amt_up,    ((0,1),(0,0)), mode='constant')[1:H+1, :]
-            + xp.pad(amt_right, ((0,0),(1,0)), mode='constant')[:, 0:W]
-            + xp.pad(amt_left,  ((0,0),(0,1)), mode='constant')[:, 1:W+1]
+        before = state.heightmap
+        # the fields passed in may be shared (e.g. the heightmap on screen), so the first
+        # iteration writes into workspace buffers; water and sediment then update in place
+        if it == 0:
+            out = tuple(workspace.take(before.shape) for _ in range(3))
+        else:
+            out = (spare if spare is not None else workspace.take(before.shape), state.water, state.sediment)
+        state.heightmap, state.water, state.sediment = hydraulic_step(
+            before, state.water, state.sediment,
+            rain_amount, evaporation_rate, erosion_rate, sediment_capacity_factor, out=out,
         )
+        spare = before if it > 0 else None
+        state.advance('hydraulic')
+        max_dh, _, _ = state.record('hydraulic', before, state.heightmap)
 
-        # erosion: remove terrain into sediment
-        eroded = xp.minimum(erosion_rate * (amt_up+amt_down+amt_left+amt_right), h)
-        h       = h - eroded
-        sediment += eroded
-
-        # sediment transport: carry only up to capacity
-        capacity = (amt_up+amt_down+amt_left+amt_right) * sediment_capacity_factor
-        moveable = xp.minimum(sediment, capacity)
-        sediment -= moveable
-
-        # distribute moved sediment same way as water flows
-        s_up    = moveable * (frac[0] / erosion_rate)
-        s_down  = moveable * (frac[1] / erosion_rate)
-        s_left  = moveable * (frac[2] / erosion_rate)
-        s_right = moveable * (frac[3] / erosion_rate)
-        sediment = (
-            sediment
-            - (s_up + s_down + s_left + s_right)
-            + xp.pad(s_down,  ((1,0),(0,0)), mode='constant')[0:H, :]
-            + xp.pad(s_up,    ((0,1),(0,0)), mode='constant')[1:H+1, :]
-            + xp.pad(s_right, ((0,0),(1,0)), mode='constant')[:, 0:W]
-            + xp.pad(s_left,  ((0,0),(0,1)), mode='constant')[:, 1:W+1]
-        )
+        if checkpoint and checkpoint_every and (it + 1) % checkpoint_every == 0:
+            state.save(checkpoint)
 
-        # 3) Evaporation
-        water *= (1 - evaporation_rate)
+        # optional progress
+        print(f"Erosion iter {done+it+1}/{done+iterations}", end='\r')
 
-        # 4) Deposition
-        depos = xp.minimum(sediment, water)
-        h += depos
-        sediment -= depos
+        if converged(previous, max_dh, tol):
+            print(f"[INFO] hydraulic_erosion: converged after {it+1} iterations, max |dh| {max_dh:.3g} < {tol:g}")
+            break
+        previous = max_dh
 
-        # optional progress  
-        print(f"Erosion iter {it+1}/{iterations}", end='\r')
+    workspace.give(spare)
+    if checkpoint:
+        state.save(checkpoint)
+    return state
 
-    return h
+def hydraulic_erosion(
+    heightmap:                np.ndarray,
+    iterations:               int = 5,
+    rain_amount:              float = 0.05,
+    evaporation_rate:         float = 0.01,
+    erosion_rate:             float = 0.5,
+    sediment_capacity_factor: float = 0.05,
+) -> np.ndarray:
+    """
+    A fully-vectorized hydraulic erosion on a 2D heightmap.
+    Uses only NumPy.
+    Stateless wrapper around `run_hydraulic`.
+    """
+    state = run_hydraulic(
+        ErosionState.from_heightmap(heightmap), iterations,
+        rain_amount, evaporation_rate, erosion_rate, sediment_capacity_factor,
+    )
+    return state.heightmap
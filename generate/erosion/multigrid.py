@@ -0,0 +1,209 @@
+"""
+Coarse-to-fine (multigrid) erosion.
+
+The bulk of the iterations runs on a copy of the map sampled every 2^levels
+cells: for 2^k+1 maps these are the lattice points of a coarser
+diamond-square level, so the coarse grid is the terrain hierarchy the
+map was built from. Going back up, each level adds the erosion the coarser
+one computed (its change in height, interpolated) to its own heights, so its
+detail survives; water and sediment carry over interpolated. A few
+refinement iterations per level then fix what only shows at that resolution.
+Drainage structure forms at the coarse level where an iteration is
+4^levels times cheaper and moves material 2^levels cells at a time.
+
+Thermal talus angles scale with the grid spacing, as for strided previews
+(see make's `stride`); coarse hydraulic steps get the rain and evaporation of
+as many fine steps. In `make`, `['thermal', {'iterations': 50, 'multigrid': 2}]`
+runs a stage this way.
+
+Thermal erosion keeps its structure when it has far to go: at 1025x1025 with
+talus_angle 0.005 and 200 reference iterations, one level gives correlation
+~0.98 at 5-7x, where the same time at full resolution reaches ~0.89. At the
+default talus angle the sequential rule settles within ~20 iterations, so
+there is nothing to gain. Hydraulic erosion is chaotic at the cell scale, so
+the coarse run only reproduces its large-scale pattern.
+
+    python -m generate.erosion.multigrid --size 1025 --method thermal --iterations 200 --levels 1 2 3 --param talus_angle=0.005
+"""
+import argparse
+import time
+
+import numpy as np
+
+from generate.erosion.hydraulic_fast import run_hydraulic
+from generate.erosion.state          import ErosionState
+from generate.erosion.thermal_fast   import run_thermal
+
+RUNNERS = {'thermal': run_thermal, 'hydraulic': run_hydraulic}
+
+def downsample(array, factor=2):
+    """Every `factor`-th cell of the last two axes, lattice-aligned (first row and column kept)."""
+    return np.ascontiguousarray(array[..., ::factor, ::factor])
+
+def upsample(coarse, shape, factor=2):
+    """
+    Bilinear interpolation of a grid sampled every `factor` cells back to
+    `shape` (last two axes); exact at the coarse points.
+    """
+    def axis(n, m):
+        position = np.arange(n) / factor
+        lo = np.minimum(position.astype(int), m - 1)
+        hi = np.minimum(lo + 1, m - 1)
+        return lo, hi, position - lo
+
+    r0, r1, wr = axis(shape[-2], coarse.shape[-2])
+    c0, c1, wc = axis(shape[-1], coarse.shape[-1])
+    top = coarse[..., r0, :]
+    bottom = coarse[..., r1, :]
+    rows = top + (bottom - top) * wr[:, None]
+    return rows[..., c0] + (rows[..., c1] - rows[..., c0]) * wc
+
+def _level_params(method, params, stride):
+    """
+    Step parameters at grid spacing `stride`. Talus angles are height per
+    cell. A coarse hydraulic step moves water `stride` cells, as far as
+    `stride` fine steps, so it gets their rain and evaporation.
+    """
+    params = dict(params)
+    if stride == 1:
+        return params
+    if method == 'thermal':
+        params['talus_angle'] = params.get('talus_angle', 0.06) * stride
+    elif method == 'hydraulic':
+        params['rain_amount'] = params.get('rain_amount', 0.05) * stride
+        params['evaporation_rate'] = 1 - (1 - params.get('evaporation_rate', 0.01)) ** stride
+    return params
+
+def run_multigrid(state, method='thermal', iterations=None, levels=2, refine_iterations=3, run=None, **params):
+    """
+    Erode `state` coarse to fine: `iterations` steps of `method` at 1/2^levels
+    resolution, then `refine_iterations` steps at every finer level up to
+    the full one. `params` are the step parameters of the method's engine
+    (including `tol`, which applies at every level).
+
+    :param iterations: Coarse iterations (default: the engine's default).
+    :param run: Engine to use instead of run_thermal / run_hydraulic (e.g. a batched one).
+    :return: The same state object, advanced; coarse iterations are counted as
+             '<method>/<stride>' in state.iterations.
+    """
+    if method not in RUNNERS:
+        raise ValueError(f"Unsupported erosion method: {method}")
+    run = run or RUNNERS[method]
+    if iterations is not None:
+        params['iterations'] = iterations
+    if levels <= 0:
+        return run(state, **params)
+
+    # Pyramid of the state fields, full resolution first
+    names = ('heightmap', 'water', 'sediment')
+    pyramid = [[np.asarray(getattr(state, name), dtype=float) for name in names]]
+    for _ in range(levels):
+        if min(pyramid[-1][0].shape[-2:]) < 3:
+            break
+        pyramid.append([downsample(field) for field in pyramid[-1]])
+    levels = len(pyramid) - 1
+
+    coarse = ErosionState(*(field.copy() for field in pyramid[-1]))
+    run(coarse, **_level_params(method, params, 2 ** levels))
+    state.advance(f"{method}/{2 ** levels}", coarse.iterations.get(method, 0))
+    params['iterations'] = refine_iterations
+
+    for level in range(levels - 1, -1, -1):
+        heightmap, _, _ = pyramid[level]
+        shape = heightmap.shape
+        change = coarse.heightmap - pyramid[level + 1][0]
+        fields = (heightmap + upsample(change, shape), upsample(coarse.water, shape), upsample(coarse.sediment, shape))
+        if level == 0:
+            state.heightmap, state.water, state.sediment = fields
+            run(state, **params)
+        else:
+            coarse = ErosionState(*fields)
+            run(coarse, **_level_params(method, params, 2 ** level))
+            state.advance(f"{method}/{2 ** level}", coarse.iterations.get(method, 0))
+    return state
+
+def compare(reference, result, initial):
+    """
+    How close `result` is to the full-resolution `reference`, both eroded from `initial`:
+    RMS height difference relative to the RMS erosion of the reference, and
+    the correlation of the two erosion patterns (change from `initial`).
+    """
+    erosion_ref = reference - initial
+    erosion = result - initial
+    scale = np.sqrt(np.mean(erosion_ref ** 2)) or 1.0
+    rel_rms = float(np.sqrt(np.mean((result - reference) ** 2)) / scale)
+    correlation = float(np.corrcoef(erosion_ref.ravel(), erosion.ravel())[0, 1])
+    return rel_rms, correlation
+
+def benchmark(size=1025, method='thermal', iterations=200, levels=(1, 2, 3), refine_iterations=None, seed=0, **params):
+    """
+    Time full-resolution erosion against multigrid runs whose coarse
+    iteration count is `iterations` / 2^levels (each coarse step moves
+    material 2^levels cells). Each multigrid run is also compared with simply
+    running fewer full-resolution iterations in the same time.
+    :return: List of (levels, coarse iterations, seconds, speedup, relative RMS, correlation,
+             relative RMS and correlation of the equal-cost full-resolution run).
+    """
+    from generate.sweep import render_heightmap
+
+    initial = render_heightmap({'erosion': [[False]]}, seed, size)
+    run = RUNNERS[method]
+    shown = ', '.join(f"{k}={v}" for k, v in params.items())
+    print(f"[INFO] erosion.multigrid: {method} {size}x{size}, {iterations} iterations at full resolution {shown}")
+
+    start = time.perf_counter()
+    reference = _quiet(run, ErosionState.from_heightmap(initial), iterations, **params).heightmap
+    serial = time.perf_counter() - start
+    print(f"[INFO]   full resolution  {serial:8.2f}s")
+
+    rows = []
+    refine = refine_iterations if refine_iterations is not None else max(1, iterations // 50)
+    for count in levels:
+        coarse_iterations = max(1, round(iterations / 2 ** count))
+        start = time.perf_counter()
+        state = _quiet(
+            run_multigrid, ErosionState.from_heightmap(initial), method, coarse_iterations, count, refine, **params
+        )
+        seconds = time.perf_counter() - start
+        rel_rms, correlation = compare(reference, state.heightmap, initial)
+
+        budget = max(1, round(iterations * seconds / serial))
+        fewer = _quiet(run, ErosionState.from_heightmap(initial), budget, **params).heightmap
+        fewer_rms, fewer_correlation = compare(reference, fewer, initial)
+
+        rows.append((count, coarse_iterations, seconds, serial / seconds, rel_rms, correlation, fewer_rms, fewer_correlation))
+        print(f"[INFO]   levels {count}: {coarse_iterations:4d} coarse + {refine} refine/level  {seconds:8.2f}s  "
+              f"speedup {serial / seconds:6.1f}  rms {rel_rms:6.1%} of erosion  correlation {correlation:.3f}  "
+              f"(same time at full resolution, {budget} iterations: rms {fewer_rms:6.1%}  correlation {fewer_correlation:.3f})")
+    return rows
+
+def _quiet(function, *args, **kwargs):
+    import contextlib
+    import io
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function(*args, **kwargs)
+
+def _number(text):
+    """--param value: a float if it reads as one, else the string (e.g. rule=jacobi)."""
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=1025)
+    parser.add_argument('--method', choices=sorted(RUNNERS), default='thermal')
+    parser.add_argument('--iterations', type=int, default=200, help="full-resolution iterations of the reference")
+    parser.add_argument('--levels', type=int, nargs='+', default=[1, 2, 3])
+    parser.add_argument('--refine', type=int, default=None, help="refinement iterations per level")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--param', nargs='*', default=[], metavar='KEY=VALUE', help="engine parameters, e.g. talus_angle=0.01 rule=jacobi")
+    args = parser.parse_args(argv)
+
+    params = {key: _number(value) for key, value in (param.split('=', 1) for param in args.param)}
+    benchmark(args.size, args.method, args.iterations, args.levels, args.refine, args.seed, **params)
+
+if __name__ == '__main__':
+    main()
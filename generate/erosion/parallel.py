@@ -0,0 +1,225 @@
+"""
+Band-parallel erosion: the grid is split into horizontal bands, one per
+worker, and every iteration each worker steps its band plus a halo of
+neighbouring rows read from the shared source buffers, then writes its own
+rows to the destination buffers. A barrier ends the iteration and the
+buffers swap, so the halo exchange is the read of the neighbours' rows
+from the previous iteration. Results are bit-identical to the single-threaded
+engines (`run_thermal` with rule='jacobi', `run_hydraulic`). The default,
+sequential thermal rule lets every cell see the moves of the cells before it
+in the same iteration, so it cannot be split into bands.
+
+Backends: 'thread' (shared numpy arrays; the kernels spend their time in
+NumPy ufunc loops, which release the GIL) and 'process' (spawned workers
+over shared memory segments, see store.shared).
+
+    python -m generate.erosion.parallel --size 2049 --method hydraulic --workers 1 2 4
+"""
+import argparse
+import multiprocessing
+import multiprocessing.connection
+import threading
+import time
+
+import numpy as np
+
+from generate.erosion.hydraulic_fast import hydraulic_step, run_hydraulic
+from generate.erosion.state          import ErosionState
+from generate.erosion.thermal_fast   import thermal_step, run_thermal
+from store.shared                    import shared_pool
+
+# Rows of the neighbouring bands a band needs to step once: both kernels move
+# material to 4-neighbours in proportions set by *their* neighbours, so the
+# value at a cell depends on heights up to two cells away.
+HALO = 2
+
+def _thermal(h, **params):
+    return (thermal_step(h, **params),)
+
+# method -> (state fields it evolves, step(*fields, **params) -> new fields)
+KERNELS = {
+    'thermal':   (('heightmap',), _thermal),
+    'hydraulic': (('heightmap', 'water', 'sediment'), hydraulic_step),
+}
+
+BACKENDS = ['thread', 'process']
+
+def bands(rows, workers):
+    """Split `rows` into at most `workers` contiguous (start, stop) bands of near-equal height."""
+    edges = np.linspace(0, rows, min(workers, rows) + 1).round().astype(int)
+    return list(zip(edges[:-1].tolist(), edges[1:].tolist()))
+
+def _step_band(method, buffers, band, iterations, barrier, params):
+    """
+    Worker loop over one band. `buffers` is a pair (source, destination),
+    each a list of full-size arrays, one per field of the method.
+    """
+    _, step = KERNELS[method]
+    start, stop = band
+    rows = buffers[0][0].shape[0]
+    lo, hi = max(0, start - HALO), min(rows, stop + HALO)
+    src, dst = buffers
+
+    try:
+        for _ in range(iterations):
+            out = step(*(field[lo:hi] for field in src), **params)
+            for target, result in zip(dst, out):
+                target[start:stop] = result[start - lo:stop - lo]
+            barrier.wait()
+            src, dst = dst, src
+    except threading.BrokenBarrierError:
+        return  # another band failed, it reports the error
+    except BaseException:
+        barrier.abort()
+        raise
+
+def _process_band(method, handles, band, iterations, barrier, params):
+    """Process entry point: map the pool segments (source fields, then destination fields) and run the band."""
+    arrays = [handle.open('r+') for handle in handles]
+    half = len(arrays) // 2
+    _step_band(method, (arrays[:half], arrays[half:]), band, iterations, barrier, params)
+
+def _run_threads(method, buffers, band_list, iterations, params):
+    barrier = threading.Barrier(len(band_list))
+    errors = []
+
+    def work(band):
+        try:
+            _step_band(method, buffers, band, iterations, barrier, params)
+        except BaseException as e:
+            errors.append(e)
+
+    threads = [
+        threading.Thread(target=work, args=(band,), name=f"ErosionBand{i}", daemon=True)
+        for i, band in enumerate(band_list)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+def _run_processes(method, fields, band_list, iterations, params):
+    """Copy `fields` into shared pool segments, step them in spawned workers and map the result back."""
+    # spawn: workers must not inherit the UI process (and its GL context)
+    ctx = multiprocessing.get_context('spawn')
+    handles = [shared_pool.share(field) for field in fields]
+    handles += [shared_pool.allocate(field.shape) for field in fields]
+    try:
+        barrier = ctx.Barrier(len(band_list))
+        workers = [
+            ctx.Process(
+                target=_process_band, name=f"ErosionBand{i}", daemon=True,
+                args=(method, handles, band, iterations, barrier, params),
+            )
+            for i, band in enumerate(band_list)
+        ]
+        for worker in workers:
+            worker.start()
+        # a worker that dies hard (killed, out of memory) never reaches the barrier
+        # again: abort it so the other bands stop instead of waiting forever
+        running = {worker.sentinel: worker for worker in workers}
+        while running:
+            for sentinel in multiprocessing.connection.wait(list(running)):
+                worker = running.pop(sentinel)
+                worker.join()
+                if worker.exitcode != 0:
+                    barrier.abort()
+        failed = [f"{worker.name} (exit code {worker.exitcode})" for worker in workers if worker.exitcode != 0]
+        if failed:
+            raise RuntimeError(f"Erosion workers failed: {', '.join(failed)}.")
+
+        half = len(fields)
+        result = handles[half:] if iterations % 2 else handles[:half]
+        return [handle.take() for handle in result]
+    finally:
+        for handle in handles:
+            handle.unlink()
+
+def run_parallel(state, method='hydraulic', iterations=5, workers=None, backend='thread', **params):
+    """
+    Continue erosion on `state` for `iterations` steps of `method`, split
+    into horizontal bands over `workers` threads or processes.
+
+    :param method: 'thermal' or 'hydraulic'; `params` are the step parameters of its engine.
+                   Thermal erosion runs the 'jacobi' rule (see thermal_fast.RULES).
+    :param workers: Number of bands (default: CPU count).
+    :param backend: 'thread' or 'process'.
+    :return: The same state object, advanced; equal to run_thermal(rule='jacobi') / run_hydraulic.
+    """
+    if method not in KERNELS:
+        raise ValueError(f"Unsupported erosion method: {method}")
+    if params.pop('rule', 'jacobi') != 'jacobi':
+        raise ValueError("Row bands need an update rule that reads only the previous iteration: rule='jacobi'.")
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend '{backend}', expected one of {BACKENDS}.")
+    if iterations <= 0:
+        return state
+
+    names, _ = KERNELS[method]
+    fields = [np.ascontiguousarray(getattr(state, name), dtype=np.float64) for name in names]
+    band_list = bands(fields[0].shape[0], workers or multiprocessing.cpu_count())
+
+    if backend == 'thread':
+        buffers = ([field.copy() for field in fields], [np.empty_like(field) for field in fields])
+        _run_threads(method, buffers, band_list, iterations, params)
+        result = buffers[iterations % 2]
+    else:
+        result = _run_processes(method, fields, band_list, iterations, params)
+
+    for name, array in zip(names, result):
+        setattr(state, name, array)
+    state.advance(method, iterations)
+    return state
+
+def _serial(state, method, iterations, params):
+    if method == 'thermal':
+        return run_thermal(state, iterations, rule='jacobi', **params)
+    return run_hydraulic(state, iterations, **params)
+
+def benchmark(size=1025, method='hydraulic', iterations=20, workers=(1, 2, 4), backend='process', seed=0):
+    """
+    Time `run_parallel` for each worker count against the single-threaded engine.
+    Speedup is T(serial) / T(n workers), efficiency is speedup / n.
+    :return: List of (workers, seconds, speedup, efficiency, matches serial).
+    """
+    from generate.sweep import render_heightmap
+
+    heightmap = render_heightmap({'noise': [[False]], 'erosion': [[False]]}, seed, size)
+    start = time.perf_counter()
+    reference = _serial(ErosionState.from_heightmap(heightmap), method, iterations, {})
+    serial = time.perf_counter() - start
+    print()
+    print(f"[INFO] erosion.parallel: {method} {size}x{size}, {iterations} iterations, serial {serial:.2f}s")
+
+    rows = []
+    for count in workers:
+        start = time.perf_counter()
+        state = run_parallel(ErosionState.from_heightmap(heightmap), method, iterations, count, backend)
+        seconds = time.perf_counter() - start
+        speedup = serial / seconds
+        efficiency = speedup / count
+        matches = all(
+            np.array_equal(getattr(state, name), getattr(reference, name)) for name in KERNELS[method][0]
+        )
+        rows.append((count, seconds, speedup, efficiency, matches))
+        print(f"[INFO] {backend:>7} x{count:<3} {seconds:8.2f}s  speedup {speedup:5.2f}  "
+              f"efficiency {efficiency:6.1%}  {'matches' if matches else 'DIFFERS from'} serial")
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=1025)
+    parser.add_argument('--method', choices=sorted(KERNELS), default='hydraulic')
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--backend', choices=BACKENDS, default='process')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    print(f"[INFO] {multiprocessing.cpu_count()} CPUs available")
+    benchmark(args.size, args.method, args.iterations, args.workers, args.backend, args.seed)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+import json
+import os
+
+import numpy as np
+
+from store.workspace import workspace
+
+# Per-iteration convergence metrics, in the order they are recorded
+METRICS = ('max_dh', 'mean_dh', 'moved')
+
+def change_metrics(before, after):
+    """
+    How much one iteration changed the terrain: the largest and the mean
+    |Δh| over all cells, and the height that left the cells that lost any
+    (sum of max(-Δh, 0)), i.e. the mass moved net of what came back.
+    :return: (max_dh, mean_dh, moved)
+    """
+    with workspace.borrow(np.shape(after), (np.shape(after), bool)) as (dh, lost):
+        np.subtract(after, before, out=dh)
+        moved = -float(np.sum(dh, where=np.less(dh, 0, out=lost)))
+        np.abs(dh, out=dh)
+        return float(dh.max()), float(dh.mean()), moved
+
+# In-place building blocks of the NumPy engines, writing into workspace buffers
+
+def edge_pad(array, out):
+    """np.pad(array, 1, mode='edge') over the last two axes, written into `out` (two cells larger)."""
+    out[..., 1:-1, 1:-1] = array
+    out[..., 0, 1:-1] = array[..., 0, :]
+    out[..., -1, 1:-1] = array[..., -1, :]
+    out[..., :, 0] = out[..., :, 1]
+    out[..., :, -1] = out[..., :, -2]
+    return out
+
+def sum_directions(stack, out):
+    """stack.sum(axis=0) of a (4, ...) stack into `out`, added in the same order as NumPy does."""
+    np.add(stack[0], stack[1], out=out)
+    out += stack[2]
+    out += stack[3]
+    return out
+
+def converged(previous, current, tol):
+    """
+    Early-stop rule of the engines: the largest change of this iteration is
+    below `tol` and smaller than that of the previous one, so a run whose
+    changes still grow (hydraulic erosion while the water builds up) goes on.
+    """
+    return tol is not None and previous is not None and current < tol and current < previous
+
+class ErosionState:
+    """
+    Everything an erosion engine needs to continue where it stopped:
+    the heightmap, the hydraulic water and sediment fields, the number
+    of iterations each method has already run and their convergence history.
+    """
+
+    def __init__(self, heightmap, water=None, sediment=None, iterations=None, history=None):
+        self.heightmap = heightmap
+        self.water = water if water is not None else np.zeros_like(heightmap)
+        self.sediment = sediment if sediment is not None else np.zeros_like(heightmap)
+        self.iterations = dict(iterations or {})  # method -> completed iterations
+        # method -> one [max_dh, mean_dh, moved] per completed iteration (see METRICS)
+        self.history = {method: [list(row) for row in rows] for method, rows in (history or {}).items()}
+
+    @classmethod
+    def from_heightmap(cls, heightmap):
+        """Start a fresh state from a copy of `heightmap`."""
+        return cls(np.array(heightmap, dtype=float))
+
+    def copy(self):
+        return ErosionState(
+            self.heightmap.copy(), self.water.copy(), self.sediment.copy(), self.iterations, self.history
+        )
+
+    def total_iterations(self):
+        return sum(self.iterations.values())
+
+    def advance(self, method, count=1):
+        self.iterations[method] = self.iterations.get(method, 0) + count
+
+    def record(self, method, before, after):
+        """Append the change metrics of one `method` iteration (before -> after heightmap). :return: them."""
+        metrics = change_metrics(before, after)
+        self.history.setdefault(method, []).append(list(metrics))
+        return metrics
+
+    def convergence(self, method):
+        """Convergence curve of `method`: (iterations, len(METRICS)) array, one row per recorded iteration."""
+        return np.array(self.history.get(method, []), dtype=float).reshape(-1, len(METRICS))
+
+    def save(self, path):
+        """
+        Checkpoint the state to a compressed .npz file.
+        Writes to a temporary file first so a crash never leaves a truncated checkpoint.
+        """
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(
+                f,
+                heightmap=self.heightmap,
+                water=self.water,
+                sediment=self.sediment,
+                iterations=np.array(json.dumps(self.iterations)),
+                history=np.array(json.dumps(self.history)),
+            )
+        os.replace(tmp_path, path)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        """Load a checkpoint written by `save`."""
+        with np.load(path) as data:
+            return cls(
+                data['heightmap'].astype(float),
+                data['water'].astype(float),
+                data['sediment'].astype(float),
+                json.loads(str(data['iterations'])),
+                json.loads(str(data['history'])) if 'history' in data else None,
+            )
+
+    def __repr__(self):
+        return f"ErosionState(shape={self.heightmap.shape}, iterations={self.iterations})"
@@ -0,0 +1,165 @@
+import numpy as np
+
+from generate.erosion.state import ErosionState, converged, edge_pad, sum_directions
+from store.workspace         import workspace
+from utils.jit               import njit
+
+# Update rules of run_thermal:
+# 'sequential' is the rule of thermal_legacy (cells in row order, each moving
+#              thermal_coefficient * (diff - talus) to every lower neighbour in turn,
+#              later cells seeing the earlier moves); the default, as make() always did.
+# 'jacobi'     moves the steepest excess from the heights at the start of the
+#              iteration (thermal_step); what the row-band parallel engine splits.
+RULES = ['sequential', 'jacobi']
+
+@njit(cache=True)
+def _sequential_sweep(h, talus_angle, thermal_coefficient):
+    """One iteration of thermal_legacy.thermal_erosion on the 2D map `h`, in place."""
+    rows, cols = h.shape
+    for y in range(1, rows - 1):
+        for x in range(1, cols - 1):
+            center = h[y, x]
+            # neighbour heights are read before any of the cell's moves, as in the legacy loop
+            up, down, left, right = h[y - 1, x], h[y + 1, x], h[y, x - 1], h[y, x + 1]
+            diff = center - up
+            if diff > talus_angle:
+                amount = thermal_coefficient * (diff - talus_angle)
+                h[y, x] -= amount
+                h[y - 1, x] += amount
+            diff = center - down
+            if diff > talus_angle:
+                amount = thermal_coefficient * (diff - talus_angle)
+                h[y, x] -= amount
+                h[y + 1, x] += amount
+            diff = center - left
+            if diff > talus_angle:
+                amount = thermal_coefficient * (diff - talus_angle)
+                h[y, x] -= amount
+                h[y, x - 1] += amount
+            diff = center - right
+            if diff > talus_angle:
+                amount = thermal_coefficient * (diff - talus_angle)
+                h[y, x] -= amount
+                h[y, x + 1] += amount
+
+def thermal_step_sequential(h, talus_angle=0.06, thermal_coefficient=0.5, out=None):
+    """
+    One thermal erosion iteration with the update rule of thermal_legacy
+    (bit-identical to it), compiled. Leading axes of `h` are a batch of independent maps.
+    :param out: Array the result is written to (may be `h` itself); default: a new one.
+    :return: Updated heightmap.
+    """
+    out = np.array(h, dtype=np.float64) if out is None else out
+    if out is not h:
+        out[...] = h
+    for m in out.reshape((-1,) + out.shape[-2:]):
+        _sequential_sweep(m, float(talus_angle), float(thermal_coefficient))
+    return out
+
+def thermal_step(h, talus_angle=0.06, thermal_coefficient=0.5, out=None):
+    """
+    One vectorized thermal erosion iteration ('jacobi' rule).
+    Every cell sheds thermal_coefficient * (steepest excess slope) to its lower
+    4-neighbors, split in proportion to how far each one exceeds the talus angle.
+    All transfers are computed from the same input heights (Jacobi update).
+    Leading axes of `h` are a batch of independent maps.
+    Temporaries are borrowed from the workspace (store.workspace).
+    :param out: Array the result is written to (may be `h` itself); default: a new one.
+    :return: Updated heightmap.
+    """
+    H, W = h.shape[-2:]
+    out = np.empty(h.shape) if out is None else out
+
+    pad_h = edge_pad(h, workspace.take(h.shape[:-2] + (H + 2, W + 2)))
+    cen = pad_h[...,1:-1,1:-1]
+    excess = workspace.take((4,) + h.shape)
+    np.subtract(cen, pad_h[...,0:-2,1:-1], out=excess[0])  # up
+    np.subtract(cen, pad_h[...,2:  ,1:-1], out=excess[1])  # down
+    np.subtract(cen, pad_h[...,1:-1,0:-2], out=excess[2])  # left
+    np.subtract(cen, pad_h[...,1:-1,2:  ], out=excess[3])  # right
+    excess -= talus_angle
+    np.maximum(excess, 0.0, out=excess)
+
+    total = sum_directions(excess, workspace.take(h.shape))
+    scale = np.maximum(excess[0], excess[1], out=workspace.take(h.shape))  # steepest excess
+    np.maximum(scale, excess[2], out=scale)
+    np.maximum(scale, excess[3], out=scale)
+    mask = np.greater(total, 0, out=workspace.take(h.shape, bool))
+
+    # material moved per direction; cells without excess keep scale = coefficient * 0
+    scale *= thermal_coefficient
+    np.divide(scale, total, out=scale, where=mask)
+    move = np.multiply(excess, scale, out=excess)
+
+    np.subtract(h, sum_directions(move, total), out=out)
+    out[..., 1:, :]  += move[1][..., :-1, :]  # from above, moving down
+    out[..., :-1, :] += move[0][..., 1:, :]   # from below, moving up
+    out[..., :, 1:]  += move[3][..., :, :-1]  # from the left, moving right
+    out[..., :, :-1] += move[2][..., :, 1:]   # from the right, moving left
+    workspace.give(pad_h, excess, total, scale, mask)
+    return out
+
+def run_thermal(
+    state:               ErosionState,
+    iterations:          int = 12,
+    talus_angle:         float = 0.06,
+    thermal_coefficient: float = 0.5,
+    checkpoint:          str = None,
+    checkpoint_every:    int = 0,
+    tol:                 float = None,
+    rule:                str = 'sequential',
+) -> ErosionState:
+    """
+    Continue thermal erosion on `state` for `iterations` more steps.
+    The change of every iteration is recorded in `state.history` (see ErosionState.record).
+
+    :param rule: Update rule, one of RULES.
+
+    :param checkpoint: Optional .npz path the state is saved to every `checkpoint_every` iterations and at the end.
+    :param tol: Stop early once no cell changes by `tol` or more in an iteration and the change is
+                shrinking (see state.converged); `iterations` is then the maximum.
+    :return: The same state object, advanced.
+    """
+    if rule not in RULES:
+        raise ValueError(f"Unknown thermal rule '{rule}', expected one of {RULES}.")
+    step = thermal_step_sequential if rule == 'sequential' else thermal_step
+    done = state.iterations.get('thermal', 0)
+    previous = None
+    spare = None  # the heightmap before the last iteration, once it is one of ours
+
+    for it in range(iterations):
+        before = state.heightmap
+        after = spare if spare is not None else workspace.take(before.shape)
+        state.heightmap = step(before, talus_angle, thermal_coefficient, out=after)
+        # the heightmap passed in may be shared (e.g. shown on screen), later ones are ours
+        spare = before if it > 0 else None
+        state.advance('thermal')
+        max_dh, _, _ = state.record('thermal', before, state.heightmap)
+
+        if checkpoint and checkpoint_every and (it + 1) % checkpoint_every == 0:
+            state.save(checkpoint)
+
+        print(f"[INFO] thermal_erosion: [{done+it+1}/{done+iterations}]          ", end='\r')
+
+        if converged(previous, max_dh, tol):
+            print(f"[INFO] thermal_erosion: converged after {it+1} iterations, max |dh| {max_dh:.3g} < {tol:g}")
+            break
+        previous = max_dh
+
+    workspace.give(spare)
+    if checkpoint:
+        state.save(checkpoint)
+    return state
+
+def thermal_erosion(heightmap, iterations=12, talus_angle=0.06, thermal_coefficient=0.5):
+    """
+    Simulate thermal erosion on the heightmap to modify terrain features.
+    Compiled, stateless counterpart of thermal_legacy.thermal_erosion (same result).
+    :param heightmap: 2D numpy array representing the terrain.
+    :param iterations: Number of erosion iterations. Typical range is 5 to 50, where more iterations result in more pronounced erosion.
+    :param talus_angle: Critical slope angle above which material will be moved. Typical range is 0.01 to 1.0, where smaller values lead to more erosion.
+    :param thermal_coefficient: Proportion of height difference to move per iteration. Typical range is 0.1 to 1.0, where larger values cause more aggressive erosion.
+    :return: Modified heightmap after applying thermal erosion.
+    """
+    state = run_thermal(ErosionState.from_heightmap(heightmap), iterations, talus_angle, thermal_coefficient)
+    return state.heightmap
@@ -0,0 +1,237 @@
+import math
+
+import numpy as np
+
+from utils.jit import njit
+
+# Neighbors counter-clockwise from east: cardinals at even, diagonals at odd indices
+DY = np.array([0, -1, -1, -1, 0, 1, 1, 1], dtype=np.int64)
+DX = np.array([1, 1, 0, -1, -1, -1, 0, 1], dtype=np.int64)
+DIST = np.array([1.0, math.sqrt(2.0)] * 4)
+
+FLOW_METHODS = ['d8', 'dinf']
+
+@njit(cache=True)
+def _heap_push(keys, items, size, key, item):
+    i = size
+    while i > 0:
+        parent = (i - 1) // 2
+        if keys[parent] <= key:
+            break
+        keys[i] = keys[parent]
+        items[i] = items[parent]
+        i = parent
+    keys[i] = key
+    items[i] = item
+    return size + 1
+
+@njit(cache=True)
+def _heap_pop(keys, items, size):
+    key, item = keys[0], items[0]
+    size -= 1
+    last_key, last_item = keys[size], items[size]
+    i = 0
+    while True:
+        child = 2 * i + 1
+        if child >= size:
+            break
+        if child + 1 < size and keys[child + 1] < keys[child]:
+            child += 1
+        if keys[child] >= last_key:
+            break
+        keys[i] = keys[child]
+        items[i] = items[child]
+        i = child
+    keys[i] = last_key
+    items[i] = last_item
+    return key, item, size
+
+@njit(cache=True)
+def _priority_flood(h):
+    rows, cols = h.shape
+    filled = h.copy()
+    closed = np.zeros((rows, cols), dtype=np.bool_)
+    keys = np.empty(rows * cols, dtype=np.float64)
+    items = np.empty(rows * cols, dtype=np.int64)
+    size = 0
+    # Cells inside a depression are raised anyway, so they skip the heap (Barnes et al.)
+    pit = np.empty(rows * cols, dtype=np.int64)
+    pit_head = pit_tail = 0
+
+    # The map edge drains: every edge cell seeds the flood
+    for r in range(rows):
+        for c in range(cols):
+            if r == 0 or c == 0 or r == rows - 1 or c == cols - 1:
+                closed[r, c] = True
+                size = _heap_push(keys, items, size, filled[r, c], r * cols + c)
+
+    while size > 0 or pit_head < pit_tail:
+        if pit_head < pit_tail:
+            item = pit[pit_head]
+            pit_head += 1
+            r, c = item // cols, item % cols
+            key = filled[r, c]
+        else:
+            key, item, size = _heap_pop(keys, items, size)
+            r, c = item // cols, item % cols
+        # epsilon fill: neighbors end up strictly above the cell that reached them,
+        # so every cell keeps a downhill path to the edge (no flats)
+        raised = np.nextafter(key, np.inf)
+        for k in range(8):
+            rr, cc = r + DY[k], c + DX[k]
+            if rr < 0 or cc < 0 or rr >= rows or cc >= cols or closed[rr, cc]:
+                continue
+            closed[rr, cc] = True
+            if filled[rr, cc] <= raised:
+                filled[rr, cc] = raised
+                pit[pit_tail] = rr * cols + cc
+                pit_tail += 1
+            else:
+                size = _heap_push(keys, items, size, filled[rr, cc], rr * cols + cc)
+    return filled
+
+@njit(cache=True)
+def _d8(filled):
+    rows, cols = filled.shape
+    receivers = np.full((rows * cols, 2), -1, dtype=np.int64)
+    weights = np.zeros((rows * cols, 2), dtype=np.float64)
+    for r in range(1, rows - 1):
+        for c in range(1, cols - 1):
+            z = filled[r, c]
+            best, target = 0.0, -1
+            for k in range(8):
+                slope = (z - filled[r + DY[k], c + DX[k]]) / DIST[k]
+                if slope > best:
+                    best, target = slope, (r + DY[k]) * cols + c + DX[k]
+            if target >= 0:
+                receivers[r * cols + c, 0] = target
+                weights[r * cols + c, 0] = 1.0
+    return receivers, weights
+
+@njit(cache=True)
+def _dinf(filled):
+    """Tarboton's D-infinity: steepest of the 8 triangular facets, split between its two corners."""
+    rows, cols = filled.shape
+    receivers = np.full((rows * cols, 2), -1, dtype=np.int64)
+    weights = np.zeros((rows * cols, 2), dtype=np.float64)
+    quarter = math.pi / 4
+    for r in range(1, rows - 1):
+        for c in range(1, cols - 1):
+            z = filled[r, c]
+            best, best_a, best_b, best_s1, best_s2 = 0.0, -1, -1, 0.0, 0.0
+            for facet in range(8):
+                # facet spans a cardinal and the adjacent diagonal neighbor
+                a = (facet + (facet & 1)) % 8
+                b = facet | 1
+                za = filled[r + DY[a], c + DX[a]]
+                zb = filled[r + DY[b], c + DX[b]]
+                s1 = z - za
+                s2 = za - zb
+                # the flow angle atan2(s2, s1) is clamped to the facet [0, pi/4]
+                if s2 <= 0.0:
+                    slope = s1
+                elif s2 >= s1:
+                    slope = (z - zb) / DIST[1]
+                else:
+                    slope = math.sqrt(s1 * s1 + s2 * s2)
+                if slope > best:
+                    best, best_a, best_b, best_s1, best_s2 = slope, a, b, s1, s2
+            if best_a < 0:
+                continue
+            if best_s2 <= 0.0:
+                angle = 0.0
+            elif best_s2 >= best_s1:
+                angle = quarter
+            else:
+                angle = math.atan2(best_s2, best_s1)
+            index = r * cols + c
+            share = angle / quarter
+            if share < 1.0:
+                receivers[index, 0] = (r + DY[best_a]) * cols + c + DX[best_a]
+                weights[index, 0] = 1.0 - share
+            if share > 0.0:
+                receivers[index, 1] = (r + DY[best_b]) * cols + c + DX[best_b]
+                weights[index, 1] = share
+    return receivers, weights
+
+@njit(cache=True)
+def _accumulate(receivers, weights):
+    """Kahn's topological order over the donor graph: every cell is visited once."""
+    n = receivers.shape[0]
+    indegree = np.zeros(n, dtype=np.int32)
+    for i in range(n):
+        for j in range(2):
+            if receivers[i, j] >= 0:
+                indegree[receivers[i, j]] += 1
+
+    accumulation = np.ones(n, dtype=np.float64)
+    stack = np.empty(n, dtype=np.int64)
+    top = 0
+    for i in range(n):
+        if indegree[i] == 0:
+            stack[top] = i
+            top += 1
+
+    while top > 0:
+        top -= 1
+        i = stack[top]
+        for j in range(2):
+            target = receivers[i, j]
+            if target < 0:
+                continue
+            accumulation[target] += accumulation[i] * weights[i, j]
+            indegree[target] -= 1
+            if indegree[target] == 0:
+                stack[top] = target
+                top += 1
+    return accumulation
+
+def fill_depressions(heightmap):
+    """
+    Priority-flood (epsilon variant) from the map edge, O(N log N).
+    :return: float64 heightmap without pits; filled cells drain over a strictly
+             descending path, so flow directions are defined everywhere.
+    """
+    return _priority_flood(np.ascontiguousarray(heightmap, dtype=np.float64))
+
+def flow_directions(filled, method='d8'):
+    """
+    Flow receivers of every cell of a filled heightmap.
+    :param method: 'd8' (single steepest neighbor) or 'dinf' (Tarboton, split between two).
+    :return: (receivers, weights), both (H*W, 2); receiver -1 means none (edge cells are outlets).
+    """
+    if method == 'd8':
+        return _d8(filled)
+    if method == 'dinf':
+        return _dinf(filled)
+    raise ValueError(f"Unknown flow method '{method}', expected one of {FLOW_METHODS}.")
+
+def flow_accumulation(receivers, weights, shape):
+    """Upstream area of every cell in cells (itself included), linear time."""
+    return _accumulate(receivers, weights).reshape(shape)
+
+def analyze(heightmap, method='d8', river_area=0.001, lake_depth=1e-3):
+    """
+    Hydrology layers of a heightmap.
+
+    :param method: Flow routing, see `flow_directions`.
+    :param river_area: Minimum upstream area for a river, as a fraction of all cells.
+    :param lake_depth: Minimum fill depth for a lake, as a fraction of the height range.
+    :return: Dict of layers, all shaped like the heightmap: 'filled', 'accumulation'
+             (float32, in cells), 'river' and 'lake' (bool masks).
+    """
+    heightmap = np.asarray(heightmap)
+    filled = fill_depressions(heightmap)
+    receivers, weights = flow_directions(filled, method)
+    accumulation = flow_accumulation(receivers, weights, heightmap.shape)
+
+    relief = float(np.max(heightmap) - np.min(heightmap)) or 1.0
+    lake = (filled - heightmap) > lake_depth * relief
+    river = (accumulation >= max(2.0, river_area * heightmap.size)) & ~lake
+
+    return {
+        'filled': filled.astype(heightmap.dtype, copy=False),
+        'accumulation': accumulation.astype(np.float32),
+        'river': river,
+        'lake': lake,
+    }
@@ -0,0 +1,102 @@
+"""
+Load test for generate.serve: requests/second and latency percentiles.
+
+    python -m generate.serve --port 8765 &
+    python -m generate.loadtest --port 8765 --requests 2000 --concurrency 32 --size 1025 --seeds 2
+"""
+import argparse
+import asyncio
+import random
+import time
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return float('nan')
+    index = min(len(sorted_values) - 1, int(round(q / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def tile_urls(size, seeds, lods, tile_size=256):
+    """Every tile of every lod for `seeds` maps of `size`."""
+    urls = []
+    for seed in range(seeds):
+        for lod in lods:
+            cells = (size - 1) >> lod
+            if cells < 2:
+                continue
+            count = max(1, -(-cells // tile_size))
+            for y in range(count):
+                for x in range(count):
+                    urls.append(f"/tile/{lod}/{x}/{y}.png?seed={seed}&size={size}")
+    return urls
+
+async def fetch(reader, writer, host, url):
+    writer.write(f"GET {url} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode('latin-1'))
+    await writer.drain()
+
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    await reader.readexactly(length)
+    return status
+
+async def client(host, port, queue, latencies, statuses):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while True:
+            try:
+                url = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            start = time.perf_counter()
+            try:
+                status = await fetch(reader, writer, host, url)
+            except (ConnectionError, asyncio.IncompleteReadError, ValueError, IndexError):
+                status = 'error'
+                writer.close()
+                reader, writer = await asyncio.open_connection(host, port)
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+    finally:
+        writer.close()
+
+async def run(host, port, urls, requests, concurrency):
+    queue = asyncio.Queue()
+    for _ in range(requests):
+        queue.put_nowait(random.choice(urls))
+
+    latencies, statuses = [], {}
+    start = time.perf_counter()
+    await asyncio.gather(*(client(host, port, queue, latencies, statuses) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    ms = lambda seconds: f"{seconds * 1000:.1f} ms"
+    print(f"[LOAD] {len(latencies)} requests in {elapsed:.2f} s, {concurrency} connections")
+    print(f"[LOAD] throughput {len(latencies) / elapsed:.1f} req/s, status {statuses}")
+    print(f"[LOAD] latency p50 {ms(percentile(latencies, 50))}  p90 {ms(percentile(latencies, 90))}  "
+          f"p99 {ms(percentile(latencies, 99))}  max {ms(latencies[-1] if latencies else float('nan'))}")
+    return latencies, statuses
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--size', type=int, default=1025)
+    parser.add_argument('--seeds', type=int, default=2, help="distinct maps in the request mix")
+    parser.add_argument('--lods', default='0,1,2')
+    parser.add_argument('--url', action='append', help="request these paths instead of the tile mix")
+    args = parser.parse_args(argv)
+
+    urls = args.url or tile_urls(args.size, args.seeds, [int(l) for l in args.lods.split(',')])
+    asyncio.run(run(args.host, args.port, urls, args.requests, args.concurrency))
+
+if __name__ == '__main__':
+    main()
@@ -1,84 +1,259 @@
+import os
 import threading
-from kivy.clock import Clock
+import time
 
+from store.archive import EXTENSION, Archive, write as write_archive
 from store.buffer import data_buffer
+from store.history import entry_key, history
 from generate.ds.terrain import make
+from generate.params import at_stride, current_seed, new_seed, terrain_params
+from generate.brush import apply_brush
+from generate.erosion.hydraulic_fast import run_hydraulic
+from generate.erosion.state import ErosionState
+from generate.erosion.thermal_fast import run_thermal
+from generate.hydrology import analyze
+from export.contours import contours, contour_levels
 from settings.store import settings
-from texture.plot import plot
-from utils.update import update_widget
+from utils.profiling import profiler
 
 # Internal state
 _generate_lock = threading.Lock()
 _generate_thread = None
+_erosion_state = None  # ErosionState of the last run, continued by erode_more
+_contours = None       # Contours drawn over the texture, see update_contours
+_extra_erosion = {}    # Iterations erode_more ran on top of the generated map, part of its history key;
+                       # None when erosion would not continue the state `make` left (maps read back from
+                       # archives or the history lost their water and sediment, brushed maps were edited),
+                       # so its results are not recorded
+_generated = None      # (params, seed, stage settings) the map erode_more continues was generated with
 
-def generate_ds():
-    data_buffer.clear()  # clear old buffer before storing new data
+# Contours for the on-screen overlay are traced at most at this resolution
+CONTOUR_DISPLAY_SIZE = 1025
 
-    n = settings.get('initial_terrain')  # Terrain size
-    ds = settings.get('roughness_float')  # Roughness
-    boundary_type = settings.get('boundary_type')  # Boundary type
-
-    top_left = settings.get('initial_edges')[0][0]
-    top_right = settings.get('initial_edges')[0][1]
-    bottom_left = settings.get('initial_edges')[1][0]
-    bottom_right = settings.get('initial_edges')[1][1]
-
-    corner_values = [
-        [top_left, top_right],
-        [bottom_left, bottom_right]
-    ]
-
-    thermal = settings.get('thermal') or False
-    hydraulic = settings.get('hydraulic') or False
-
-    # TODO: UI IMPLEMENT, now: Adapter -------------------------
-    if thermal and hydraulic:
-        erosion = [['thermal', {}], ['hydraulic', {}]]
-    elif thermal:
-        erosion = [['thermal', {}]]
-    elif hydraulic:
-        erosion = [['hydraulic', {}]]
-    else:
-        erosion = [[False]]
-    # ----------------------------------------------------------
+def generate_ds(reseed=True):
+    data_buffer.clear()  # clear old buffer before storing new data
 
-    smoothing = settings.get('smoothing') or [False]
+    params = terrain_params()
+    seed = new_seed() if reseed else current_seed()
+    values = stage_settings()
 
-    print(f"[USER] generate_terrain @ {n}n {ds}ds with {boundary_type} [{corner_values}]")
+    print(f"[USER] generate_terrain @ {params['width']}x{params['height']} ({params['size']}n) {params['roughness']}ds with {params['boundary']} [{params['corner_values']}]")
 
-    terrain = make(
-        size=n,
-        roughness=ds,
-        boundary=boundary_type,
-        corner_values=corner_values,
-        erosion=erosion,
-        smoothing=smoothing,
-        seed=None
-    )
+    key = entry_key(params, seed)
+    if settings.get('history') and key in history:
+        # Generated before: a file read instead of the whole pipeline
+        with profiler.stage('history/load'):
+            terrain = history.load(key)
+        state = ErosionState.from_heightmap(terrain)
+        extra_erosion = None
+        print(f"[INFO] reopened {key} from the history")
+    else:
+        start = time.perf_counter()
+        terrain, state = make(**params, seed=seed, return_state=True)
+        extra_erosion = {}
+        with profiler.stage('history/record'):
+            record_history(terrain, params, seed, values, seconds=time.perf_counter() - start)
 
     # Store the full terrain numpy array directly (new buffer API)
     data_buffer.store(terrain)
+    with profiler.stage('overlays'):
+        update_overlays()
+
+    global _generate_thread, _erosion_state, _extra_erosion, _generated
+    with _generate_lock:
+        _generate_thread = None
+        _erosion_state = state
+        _extra_erosion = extra_erosion
+        _generated = (params, seed, values)
+
+def stage_settings():
+    """The settings that drive the pipeline, as recorded in the history."""
+    from settings.store import SCHEMA
+    return {key: value for key, value in settings.snapshot().items() if SCHEMA[key].stage}
+
+def record_history(terrain, params, seed, values, erosion=None, seconds=None):
+    """Add a map to the generation history (store.history) with the settings `values` that made it."""
+    if not settings.get('history'):
+        return None
+    from generate.search import map_stats
+
+    stride = max(1, (max(terrain.shape) - 1) // 256)
+    stats = map_stats(terrain[::stride, ::stride])
+    return history.record(terrain, params, seed, erosion, seconds, values, stats)
+
+def preview_ds(size):
+    """Generate the current settings at lattice `size` (2^k+1) with the same seed as
+    the full run. Diamond-square levels match the full-resolution map
+    subsampled every `stride` cells; noise and erosion are scaled to that stride.
+    Does not touch the data buffer.
+    """
+    params = terrain_params()
+    full = params['size']
+    size = min(size, full)
+    stride = (full - 1) // (size - 1)
+    return make(**at_stride(params, stride), seed=current_seed(), stride=stride)
+
+def update_hydrology():
+    """Recompute the river and lake layers of the buffered heightmap with the
+    current settings, or drop them if hydrology is off."""
+    try:
+        array = data_buffer.get()
+    except RuntimeError:
+        array = None
+
+    layers = {}
+    if array is not None and settings.get('hydrology'):
+        method = settings.get('flow_method')
+        layers = analyze(array, method=method)
+        print(f"[INFO] hydrology ({method}): {layers['river'].mean():.2%} river, {layers['lake'].mean():.2%} lake")
 
+    data_buffer.set_layers(layers)
+
+def update_contours():
+    """Trace the contour overlay of the buffered heightmap, or drop it if
+    'contour_levels' is 0. Large maps are subsampled to the display resolution."""
+    global _contours
+    count = settings.get('contour_levels') or 0
+    try:
+        array = data_buffer.get()
+    except RuntimeError:
+        array = None
+
+    if array is None or count <= 0:
+        _contours = None
+        return
+
+    stride = max(1, (max(array.shape) - 1) // (CONTOUR_DISPLAY_SIZE - 1))
+    lines = contours(array[::stride, ::stride], contour_levels(array, count=count))
+    lines.points *= stride
+    lines.shape = array.shape
+    _contours = lines
+
+def update_overlays():
+    """Everything drawn over the terrain colors: hydrology layers and contours."""
+    update_hydrology()
+    update_contours()
+
+def is_busy():
+    with _generate_lock:
+        return bool(_generate_thread and _generate_thread.is_alive())
+
+def erode_more(iterations=5):
+    """Continue the erosion of the last generated terrain by `iterations`
+    steps of every enabled method, instead of regenerating from scratch."""
     global _generate_thread
+    state = _erosion_state
+    if state is None:
+        print("[INFO] Nothing to erode, generate a terrain first.")
+        with _generate_lock:
+            _generate_thread = None
+        return
+
+    start = time.perf_counter()
+    for method, run in (('thermal', run_thermal), ('hydraulic', run_hydraulic)):
+        if settings.get(method):
+            with profiler.stage(f"erosion/{method}"):
+                run(state, iterations=iterations)
+            if _extra_erosion is not None:
+                _extra_erosion[method] = _extra_erosion.get(method, 0) + iterations
+    print(f"[INFO] erode_more: {state}")
+    if _extra_erosion is not None:
+        # filed under what generated the map, not the settings now on screen
+        params, seed, values = _generated
+        seconds = time.perf_counter() - start
+        record_history(state.heightmap, params, seed, values, dict(_extra_erosion), seconds)
+
+    data_buffer.clear()
+    data_buffer.store(state.heightmap)
+    update_overlays()
+
+    with _generate_lock:
+        _generate_thread = None
+
+def save_archive(path=None):
+    """Write the buffered heightmap with its params and seed to an archive
+    (store.archive), by default terrain-<seed>.dsa in the working directory."""
+    global _generate_thread
+    try:
+        array = data_buffer.get()
+    except RuntimeError:
+        print("[INFO] Nothing to save, generate a terrain first.")
+        with _generate_lock:
+            _generate_thread = None
+        return None
+
+    seed = current_seed()
+    path = path or os.path.join(os.getcwd(), f"terrain-{seed}{EXTENSION}")
+    state = _erosion_state
+    meta = {'params': terrain_params(), 'seed': seed, 'erosion': state.iterations if state else {}}
+    write_archive(path, array, meta=meta)
+    print(f"[INFO] saved {array.shape[1]}x{array.shape[0]} terrain to {path}")
+
+    with _generate_lock:
+        _generate_thread = None
+    return path
+
+def load_archive(path):
+    """Replace the buffered heightmap with the map of an archive; erosion continues from it."""
+    global _generate_thread, _erosion_state, _extra_erosion
+    with Archive(path) as archive:
+        terrain = archive.read()
+        print(f"[INFO] loaded {archive}, seed {archive.meta.get('seed')}")
+
+    data_buffer.clear()
+    data_buffer.store(terrain)
+    update_overlays()
+
     with _generate_lock:
         _generate_thread = None
+        _erosion_state = ErosionState.from_heightmap(terrain)
+        _extra_erosion = None
+
+def load_history(key):
+    """Replace the buffered heightmap with a map from the generation history; erosion continues from it
+    (not recorded, see _extra_erosion). The settings that made it are restored by the caller (on the main thread)."""
+    global _generate_thread, _erosion_state, _extra_erosion
+    entry = history.get(key)
+    terrain = history.load(key)
+    print(f"[INFO] reopened {key} from the history, seed {entry['seed']}")
 
-def generate_async(callback=None):
+    data_buffer.clear()
+    data_buffer.store(terrain)
+    update_overlays()
+
+    with _generate_lock:
+        _generate_thread = None
+        _erosion_state = ErosionState.from_heightmap(terrain)
+        _extra_erosion = None
+
+def generate_async(callback=None, task=None, label=None):
     """Run terrain generation in background if not already running.
     Calls `callback(texture)` on main thread when done.
+    `task` replaces the default `generate_ds` job (e.g. `erode_more`);
+    `label` names the job in profiling reports (default: the function name).
     """
     global _generate_thread
+    task = task or generate_ds
+    label = label or getattr(task, '__name__', 'task')
+
+    from kivy.clock import Clock  # UI glue only, keeps generate/ importable without Kivy
+    from texture.plot import prepare_plot, upload_plot
+    from utils.update import update_widget
 
     def run():
-        generate_ds()
+        with profiler.run(label):
+            task()
+            # Coloring happens here; the main thread only uploads the prepared bytes
+            with profiler.stage('colorize'):
+                frame = prepare_plot()
 
-        def on_main_thread(dt):
-            texture = plot()
+        def on_uploaded(texture):
             update_widget('asp_texture', 'update_texture', new_texture=texture)
+            update_widget('asp_texture', 'set_contours', contours=_contours)
             if callback:
                 callback(texture)
 
-        Clock.schedule_once(on_main_thread, 0)
+        Clock.schedule_once(lambda dt: upload_plot(frame, on_uploaded), 0)
 
     with _generate_lock:
         if _generate_thread and _generate_thread.is_alive():
@@ -88,3 +263,71 @@ def generate_async(callback=None):
         _generate_thread = threading.Thread(target=run, name="TerrainGeneratorThread")
         _generate_thread.start()
         return _generate_thread
+
+def erode_more_async(iterations=5, callback=None):
+    """Run `erode_more` in background, see `generate_async`."""
+    return generate_async(callback, task=lambda: erode_more(iterations), label='erode_more')
+
+def save_archive_async(path=None, callback=None):
+    """Run `save_archive` in background, so no generation replaces the map while it is written."""
+    return generate_async(callback, task=lambda: save_archive(path), label='save_archive')
+
+def load_archive_async(path, callback=None):
+    """Run `load_archive` in background and show the map, see `generate_async`."""
+    return generate_async(callback, task=lambda: load_archive(path), label='load_archive')
+
+def load_history_async(key, callback=None):
+    """Run `load_history` in background and show the map, see `generate_async`."""
+    return generate_async(callback, task=lambda: load_history(key), label='load_history')
+
+def hydrology_async(callback=None):
+    """Run `update_hydrology` in background and redraw, see `generate_async`."""
+    return generate_async(callback, task=update_hydrology)
+
+def contours_async(callback=None):
+    """Run `update_contours` in background and redraw, see `generate_async`."""
+    return generate_async(callback, task=update_contours)
+
+def overlays_async(callback=None):
+    """Run `update_overlays` in background and redraw, e.g. after a brush stroke."""
+    if not settings.get('hydrology') and not settings.get('contour_levels'):
+        return None
+    return generate_async(callback, task=update_overlays)
+
+def brush_stroke(row, col, stroke=None):
+    """Apply the selected brush at heightmap cell (row, col) on the main thread.
+    `stroke` is a dict kept for the duration of one touch (e.g. the flatten target).
+    Returns the updated texture, or None if no brush is active or nothing changed.
+    """
+    global _extra_erosion
+    tool = settings.get('brush')
+    if tool in (None, False, 'off'):
+        return None
+
+    if is_busy():
+        return None  # buffer is being replaced
+
+    try:
+        array = data_buffer.get()
+    except RuntimeError:
+        return None
+
+    stroke = stroke if stroke is not None else {}
+    if tool == 'flatten' and 'target' not in stroke:
+        r = min(max(row, 0), array.shape[0] - 1)
+        c = min(max(col, 0), array.shape[1] - 1)
+        stroke['target'] = float(array[r, c])
+
+    region = apply_brush(
+        array, tool, row, col,
+        radius=settings.get('brush_radius') or 16,
+        strength=settings.get('brush_strength') or 0.5,
+        target=stroke.get('target'),
+    )
+    if region is None:
+        return None
+    with _generate_lock:
+        _extra_erosion = None  # an edited map is no longer what its history key describes
+
+    from texture.plot import plot
+    return plot(region=region)
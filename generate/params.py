@@ -0,0 +1,82 @@
+import random
+
+from settings.store import settings
+
+_seed_source = random.SystemRandom()  # independent of the seeded global generator
+
+# Settings keys a parameter sweep can vary, with the values it steps through
+SWEEP_AXES = {
+    'roughness_float'   : [0.3, 0.45, 0.6, 0.75, 0.9],
+    'boundary_type'     : ['fixed', 'periodic', 'clamped', 'mirrored'],
+    'thermal'           : [False, True],
+    'hydraulic'         : [False, True],
+}
+
+def current_seed():
+    """Seed of the current map, drawn once so previews and full runs share it."""
+    seed = settings.get('seed')
+    if seed is None:
+        seed = new_seed()
+    return seed
+
+def new_seed():
+    seed = _seed_source.randint(0, 4294967295)
+    settings.set('seed', seed)
+    return seed
+
+def lattice_size(cells):
+    """Smallest diamond-square lattice (2^k+1) with at least `cells` cells per side."""
+    return 2 ** max(1, (cells - 2).bit_length()) + 1
+
+def at_stride(params, stride):
+    """`make` params of the preview sampled every `stride` cells of the map `params` describe."""
+    return dict(params, **{
+        key: (params[key] - 1) // stride + 1 for key in ('size', 'width', 'height') if params.get(key)
+    })
+
+def terrain_params(values=settings):
+    """Collect the `make` keyword arguments from settings (or a settings snapshot)."""
+    n = values.get('initial_terrain')  # Terrain size
+    width = values.get('terrain_width') or n  # Map size, 0 follows the terrain size
+    height = values.get('terrain_height') or n
+    ds = values.get('roughness_float')  # Roughness
+    boundary_type = values.get('boundary_type')  # Boundary type
+
+    top_left = values.get('initial_edges')[0][0]
+    top_right = values.get('initial_edges')[0][1]
+    bottom_left = values.get('initial_edges')[1][0]
+    bottom_right = values.get('initial_edges')[1][1]
+
+    corner_values = [
+        [top_left, top_right],
+        [bottom_left, bottom_right]
+    ]
+
+    thermal = values.get('thermal') or False
+    hydraulic = values.get('hydraulic') or False
+
+    # TODO: UI IMPLEMENT, now: Adapter -------------------------
+    if thermal and hydraulic:
+        erosion = [['thermal', {}], ['hydraulic', {}]]
+    elif thermal:
+        erosion = [['thermal', {}]]
+    elif hydraulic:
+        erosion = [['hydraulic', {}]]
+    else:
+        erosion = [[False]]
+    # ----------------------------------------------------------
+
+    noise = values.get('noise') or [[False]]
+    smoothing = values.get('smoothing') or [False]
+
+    return dict(
+        size=lattice_size(max(width, height)),
+        width=width,
+        height=height,
+        roughness=ds,
+        boundary=boundary_type,
+        corner_values=corner_values,
+        noise=noise,
+        erosion=erosion,
+        smoothing=smoothing,
+    )
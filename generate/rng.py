@@ -0,0 +1,118 @@
+"""
+Seed tree of one generation job.
+
+Every stage draws from its own generator, derived from the job seed and the
+stage's path in the tree, never from process-global state:
+
+    job seed
+    ├── 'terrain'
+    │   └── level 0, 1, 2, ...      diamond-square displacements, per lattice position
+    ├── 'noise'
+    │   └── layer 0, 1, ...         one per entry of the noise list
+    └── 'erosion' ...               (reserved, the erosion engines are deterministic)
+
+A node's generator is PCG64 seeded with SeedSequence(entropy=job seed,
+spawn_key=path); string keys enter the path as their CRC32. So the stream of
+a stage depends only on the job seed and its own path: concurrent jobs in one
+process do not interfere, and adding, skipping or reordering stages leaves
+every other stage's output unchanged.
+
+Diamond-square displacements are counter-based (`SeedTree.uniform_at`): a
+pure hash of the node and the lattice position, not a stream. A cell gets
+the same value whichever part of the lattice is generated around it, which
+keeps strided previews equal to the subsampled full map and lets W x H
+windows be generated without the rest of the square.
+
+`SeedBatch` is one node across the trees of several jobs, drawing for all
+of them at once; each job's values equal those of its own SeedTree.
+"""
+import zlib
+
+import numpy as np
+
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+
+def _mix(x):
+    """splitmix64 finalizer, elementwise on uint64 arrays."""
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+def _uniform(key, rows, cols, low, high):
+    """Counter-based uniforms: `key` (uint64, broadcastable) hashed with each position."""
+    rows = np.asarray(rows).astype(np.uint64)
+    cols = np.asarray(cols).astype(np.uint64)
+    with np.errstate(over='ignore'):
+        x = _mix(_mix(key ^ (rows * _GOLDEN)) ^ cols)
+    return low + (high - low) * ((x >> np.uint64(11)) * 2.0 ** -53)
+
+def _key(key):
+    if isinstance(key, str):
+        return zlib.crc32(key.encode('utf-8'))
+    if isinstance(key, (int, np.integer)) and key >= 0:
+        return int(key)
+    raise TypeError(f"Seed tree keys are names or non-negative integers, got {key!r}.")
+
+class SeedTree:
+    """A node of the seed tree: job seed plus the path of keys leading to it."""
+
+    def __init__(self, seed, path=()):
+        self.seed = int(seed)
+        self.path = tuple(path)
+
+    def child(self, *keys):
+        return SeedTree(self.seed, self.path + tuple(_key(k) for k in keys))
+
+    def sequence(self):
+        return np.random.SeedSequence(entropy=self.seed, spawn_key=self.path)
+
+    def generator(self):
+        """A fresh numpy Generator for this node; equal nodes give equal streams."""
+        return np.random.Generator(np.random.PCG64(self.sequence()))
+
+    def integer(self):
+        """A 32-bit seed for libraries that take a plain int (e.g. OpenSimplex)."""
+        return int(self.sequence().generate_state(1)[0])
+
+    def key(self):
+        """64-bit key of this node for the counter-based hash of `uniform_at`."""
+        return self.sequence().generate_state(1, dtype=np.uint64)[0]
+
+    def uniform_at(self, rows, cols, low=0.0, high=1.0):
+        """
+        Uniform values in [low, high) at lattice positions (rows, cols), which
+        broadcast against each other; each value depends only on this node and
+        its position.
+        """
+        return _uniform(self.key(), rows, cols, low, high)
+
+    def __repr__(self):
+        return f"SeedTree(seed={self.seed}, path={self.path})"
+
+class SeedBatch:
+    """
+    The same node in the seed trees of several jobs, for batched generation
+    (generate.ds.terrain.make_batch). Arrays drawn from it gain a leading
+    batch axis whose slice k equals what job k's own SeedTree node gives.
+    """
+
+    def __init__(self, seeds, path=()):
+        self.trees = [seed if isinstance(seed, SeedTree) else SeedTree(seed, path) for seed in seeds]
+
+    def __len__(self):
+        return len(self.trees)
+
+    def __iter__(self):
+        return iter(self.trees)
+
+    def child(self, *keys):
+        return SeedBatch([tree.child(*keys) for tree in self.trees])
+
+    def uniform_at(self, rows, cols, low=0.0, high=1.0):
+        """`SeedTree.uniform_at` of every job, stacked: (B, *broadcast(rows, cols).shape)."""
+        keys = np.array([tree.key() for tree in self.trees], dtype=np.uint64)
+        rows, cols = np.broadcast_arrays(rows, cols)
+        return _uniform(keys.reshape((-1,) + (1,) * rows.ndim), rows, cols, low, high)
+
+    def __repr__(self):
+        return f"SeedBatch(seeds={[tree.seed for tree in self.trees]})"
@@ -0,0 +1,250 @@
+"""
+Seed search: find seeds whose maps meet target statistics.
+
+Candidates are rendered at a cheap lattice size (--search-size) with the
+stride preview of the full map (see `at_stride`): the diamond-square levels
+are the full map's lattice points, noise and talus are scaled, so the coarse
+map is a subsampled version of the one the seed gives at full size. Chunks of
+seeds go to a process pool as `make_batch` calls; each map is reduced to the
+statistics of `map_stats` and scored against the targets (lower is better).
+Only the best --top seeds are then generated at full size, re-scored, and
+optionally written to archives (store.archive).
+
+Targets are KEY=VALUE with VALUE a number, a range LO:HI, or for
+'histogram' comma-separated bin weights (low to high):
+
+    python -m generate.search --size 1025 --candidates 2000 --top 5 --target water=0.3 dominance=0.9:1
+"""
+import argparse
+import contextlib
+import io
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from generate.hydrology import analyze
+from generate.params    import at_stride, terrain_params
+from utils.jit          import njit
+
+# Normalized heights below this are water in the terrain colormap, above MOUNTAIN_LEVEL mountains
+SEA_LEVEL = 0.3
+MOUNTAIN_LEVEL = 0.7
+HISTOGRAM_BINS = 8
+
+STATS = ('water', 'mountains', 'dominance', 'relief', 'slope', 'drainage', 'lakes', 'histogram')
+
+@njit(cache=True)
+def _largest_component(mask):
+    """Cells in the largest 4-connected component of `mask`."""
+    rows, cols = mask.shape
+    seen = np.zeros((rows, cols), dtype=np.bool_)
+    stack = np.empty(rows * cols, dtype=np.int64)
+    largest = 0
+    for start in range(rows * cols):
+        r0, c0 = start // cols, start % cols
+        if not mask[r0, c0] or seen[r0, c0]:
+            continue
+        seen[r0, c0] = True
+        stack[0] = start
+        top, size = 1, 0
+        while top:
+            top -= 1
+            index = stack[top]
+            size += 1
+            r, c = index // cols, index % cols
+            for dr, dc in ((-1, 0), (1, 0), (0, -1), (0, 1)):
+                rr, cc = r + dr, c + dc
+                if 0 <= rr < rows and 0 <= cc < cols and mask[rr, cc] and not seen[rr, cc]:
+                    seen[rr, cc] = True
+                    stack[top] = rr * cols + cc
+                    top += 1
+        largest = max(largest, size)
+    return largest
+
+def map_stats(heightmap):
+    """
+    Statistics of a heightmap that do not depend on its resolution, so a
+    stride preview estimates those of the full map:
+    'water' / 'mountains' fraction of cells below SEA_LEVEL / above MOUNTAIN_LEVEL
+    (of the normalized heights), 'dominance' share of the mountain cells in
+    the largest connected range, 'relief' standard deviation of the normalized
+    heights, 'slope' mean height step per map width (previews miss the finest
+    steps and read low), 'drainage' share of the
+    map in the largest drainage basin, 'lakes' fraction of lake cells
+    (generate.hydrology) and 'histogram' of the normalized heights (HISTOGRAM_BINS bins, sums to 1).
+    :return: Dict with the keys of STATS.
+    """
+    heightmap = np.asarray(heightmap, dtype=np.float64)
+    lo, hi = float(np.min(heightmap)), float(np.max(heightmap))
+    normalized = (heightmap - lo) / ((hi - lo) or 1.0)
+
+    mountains = normalized > MOUNTAIN_LEVEL
+    mountain_cells = int(np.count_nonzero(mountains))
+    steps = np.abs(np.diff(normalized, axis=0)).mean() + np.abs(np.diff(normalized, axis=1)).mean()
+    layers = analyze(heightmap)
+    histogram, _ = np.histogram(normalized, bins=HISTOGRAM_BINS, range=(0, 1))
+
+    return {
+        'water': float(np.mean(normalized < SEA_LEVEL)),
+        'mountains': mountain_cells / normalized.size,
+        'dominance': _largest_component(mountains) / mountain_cells if mountain_cells else 0.0,
+        'relief': float(np.std(normalized)),
+        'slope': float(steps / 2 * (max(heightmap.shape) - 1)),
+        'drainage': float(np.max(layers['accumulation'])) / heightmap.size,
+        'lakes': float(np.mean(layers['lake'])),
+        'histogram': (histogram / normalized.size).tolist(),
+    }
+
+def score(stats, targets, weights=None):
+    """
+    Distance of `stats` from `targets` (lower is better): per key the
+    absolute difference from a number, the distance outside a (lo, hi)
+    range, or for 'histogram' half the L1 distance to the normalized target
+    bins; summed with `weights` (default 1 each).
+    """
+    weights = weights or {}
+    total = 0.0
+    for key, target in targets.items():
+        value = stats[key]
+        if key == 'histogram':
+            target = np.asarray(target, dtype=float)
+            distance = 0.5 * float(np.abs(np.asarray(value) - target / target.sum()).sum())
+        elif isinstance(target, (tuple, list)):
+            lo, hi = target
+            distance = max(lo - value, 0.0, value - hi)
+        else:
+            distance = abs(value - target)
+        total += weights.get(key, 1.0) * distance
+    return total
+
+def _search_stride(params, search_size):
+    full = params['size']
+    size = min(search_size, full)
+    return size, (full - 1) // (size - 1)
+
+def score_chunk(params, seeds, search_size):
+    """Process-pool entry point: map_stats of the stride previews of `seeds`, one dict per seed."""
+    from generate.ds.terrain import make_batch
+
+    size, stride = _search_stride(params, search_size)
+    with contextlib.redirect_stdout(io.StringIO()):
+        maps = make_batch(seeds, **dict(at_stride(params, stride), size=size), stride=stride)
+    return [map_stats(heightmap) for heightmap in maps]
+
+def search(params, seeds, targets, weights=None, search_size=129, workers=None, chunk=32):
+    """
+    Score every seed of `seeds` on its preview at lattice size `search_size`.
+    :param params: `make` parameters of the full map (see terrain_params).
+    :param workers: Processes (default: CPU count); 1 runs in this process.
+    :return: List of (score, seed, stats), best first.
+    """
+    seeds = list(seeds)
+    chunks = [seeds[i:i + chunk] for i in range(0, len(seeds), chunk)]
+    workers = workers or os.cpu_count() or 1
+
+    results = []
+    def collect(chunk_seeds, chunk_stats):
+        results.extend(
+            (score(stats, targets, weights), seed, stats) for seed, stats in zip(chunk_seeds, chunk_stats)
+        )
+        print(f"[INFO] search: {len(results)}/{len(seeds)} candidates scored", end='\r')
+
+    if workers == 1:
+        for chunk_seeds in chunks:
+            collect(chunk_seeds, score_chunk(params, chunk_seeds, search_size))
+    else:
+        # spawn: like the sweep pool, workers must not inherit a UI process
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            futures = [(c, pool.submit(score_chunk, params, c, search_size)) for c in chunks]
+            for chunk_seeds, future in futures:
+                collect(chunk_seeds, future.result())
+    print()
+    results.sort(key=lambda result: result[0])
+    return results
+
+def refine(params, ranked, targets, weights=None, top=5, out_dir=None):
+    """
+    Generate the first `top` seeds of `ranked` (see `search`) at full size and score them again.
+    With `out_dir`, each map is written to <out_dir>/terrain-<seed>.dsa with its params and seed.
+    :return: List of (seed, preview score, full score, full stats), in the order of `ranked`.
+    """
+    from generate.ds.terrain import make
+    from store.archive import EXTENSION, write
+
+    rows = []
+    for preview_score, seed, _ in ranked[:top]:
+        with contextlib.redirect_stdout(io.StringIO()):
+            heightmap = make(**params, seed=seed)
+        stats = map_stats(heightmap)
+        rows.append((seed, preview_score, score(stats, targets, weights), stats))
+        if out_dir:
+            os.makedirs(out_dir, exist_ok=True)
+            path = os.path.join(out_dir, f"terrain-{seed}{EXTENSION}")
+            write(path, heightmap, meta={'params': params, 'seed': seed, 'search': {'targets': targets, 'stats': stats}})
+    return rows
+
+def parse_target(text):
+    """'key=value' with value a number, 'lo:hi' or comma-separated histogram bins."""
+    key, _, value = text.partition('=')
+    if key not in STATS:
+        raise argparse.ArgumentTypeError(f"Unknown statistic '{key}', expected one of {STATS}.")
+    if key == 'histogram':
+        return key, [float(v) for v in value.split(',')]
+    if ':' in value:
+        lo, hi = value.split(':')
+        return key, (float(lo), float(hi))
+    return key, float(value)
+
+def _shown(stats, keys):
+    return '  '.join(f"{key} {stats[key]:.3f}" for key in keys if key != 'histogram')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=None, help="full map size (default: the settings)")
+    parser.add_argument('--search-size', type=int, default=129, help="lattice size candidates are scored at")
+    parser.add_argument('--candidates', type=int, default=1000)
+    parser.add_argument('--start', type=int, default=0, help="first seed")
+    parser.add_argument('--target', type=parse_target, nargs='+', required=True, metavar='KEY=VALUE')
+    parser.add_argument('--weight', nargs='*', default=[], metavar='KEY=WEIGHT')
+    parser.add_argument('--top', type=int, default=5, help="seeds generated at full size")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--out', default=None, help="directory for archives of the top seeds")
+    args = parser.parse_args(argv)
+
+    from settings.store import settings
+    values = settings.snapshot()
+    if args.size:
+        values.update(initial_terrain=args.size, terrain_width=0, terrain_height=0)
+    params = terrain_params(values)
+    lattice = args.search_size - 1
+    if lattice < 2 or lattice & (lattice - 1):
+        parser.error(f"--search-size must be 2^k+1 (e.g. 65, 129, 257), got {args.search_size}")
+    if args.search_size > params['size']:
+        parser.error(f"--search-size {args.search_size} is larger than the full map size {params['size']}")
+    targets = dict(args.target)
+    weights = {key: float(weight) for key, weight in (w.split('=', 1) for w in args.weight)}
+
+    size, stride = _search_stride(params, args.search_size)
+    print(f"[INFO] search: {args.candidates} seeds at {size}x{size} (stride {stride} of {params['size']}), targets {targets}")
+    start = time.perf_counter()
+    ranked = search(
+        params, range(args.start, args.start + args.candidates), targets, weights, args.search_size, args.workers
+    )
+    seconds = time.perf_counter() - start
+    print(f"[INFO] search: {args.candidates / seconds:.1f} candidates/s, best score {ranked[0][0]:.4f}")
+
+    rows = refine(params, ranked, targets, weights, args.top, args.out)
+    previews = {seed: stats for _, seed, stats in ranked[:args.top]}
+    for seed, preview_score, full_score, stats in rows:
+        print(f"[INFO]   seed {seed:>10}  score {preview_score:.4f} preview / {full_score:.4f} full")
+        print(f"[INFO]     preview  {_shown(previews[seed], targets)}")
+        print(f"[INFO]     full     {_shown(stats, targets)}")
+    if args.out:
+        print(f"[INFO] archives of the top {len(rows)} seeds in {args.out}")
+
+if __name__ == '__main__':
+    main()
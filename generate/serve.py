@@ -0,0 +1,440 @@
+"""
+Local HTTP server for heightmaps, colorized PNGs and tiles.
+
+    python -m generate.serve --port 8765
+
+    GET /heightmap.npy?seed=1&size=1025&roughness=0.7&boundary=fixed&thermal=1&hydraulic=1
+    GET /heightmap.png?seed=1&width=1100&height=600
+    GET /heightmap.png?seed=1&size=1025
+    GET /tile/{lod}/{x}/{y}.png?seed=1&size=4097     (also .npy)
+    GET /archive/{name}/tile/{lod}/{x}/{y}.png       (also .npy; with --archive-dir)
+    GET /archive/{name}/info
+    GET /health
+
+Tiles are TILE_SIZE cells wide plus a shared one-cell border; level of detail
+`lod` samples every 2^lod-th cell and is generated directly at that
+resolution (see make's `stride`). Generation runs in a process pool that
+hands maps back through shared memory (store.shared), identical
+in-flight requests share one job, results are kept in an LRU cache and
+responses carry ETags derived from the request parameters.
+
+Archive tiles come from {name}.dsa files of the archive directory
+(store.archive); only the chunks under a tile are decompressed.
+"""
+import argparse
+import asyncio
+import io
+import json
+import multiprocessing
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from generate.params import terrain_params
+from generate.sweep import render_shared
+from settings.store import SCHEMA, Settings, canonical_hash
+from store.archive  import EXTENSION, Archive
+from store.shared   import shared_pool
+
+TILE_SIZE = 256
+CHUNK_SIZE = 64 * 1024
+
+# query parameter -> settings key
+QUERY_KEYS = {
+    'size'      : 'initial_terrain',
+    'width'     : 'terrain_width',
+    'height'    : 'terrain_height',
+    'roughness' : 'roughness_float',
+    'boundary'  : 'boundary_type',
+    'thermal'   : 'thermal',
+    'hydraulic' : 'hydraulic',
+}
+
+STATUS_TEXT = {200: 'OK', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+class HTTPError(Exception):
+    def __init__(self, status, message=''):
+        super().__init__(message)
+        self.status = status
+
+def parse_query(query):
+    """
+    Query string to (settings values, seed). Unknown keys are rejected,
+    values are validated against the settings schema.
+    """
+    values = Settings().snapshot()
+    seed = 0
+    for key, items in parse_qs(query, keep_blank_values=True).items():
+        raw = items[-1]
+        if key == 'seed':
+            try:
+                seed = int(raw)
+            except ValueError:
+                seed = -1
+            if seed < 0:
+                raise HTTPError(400, f"seed must be a non-negative integer, got '{raw}'.")
+            continue
+        if key not in QUERY_KEYS:
+            raise HTTPError(400, f"Unknown parameter '{key}'.")
+        setting = QUERY_KEYS[key]
+        field = SCHEMA[setting]
+        if field.type is bool:
+            raw = raw.lower() in ('1', 'true', 'yes', 'on')
+        try:
+            values[setting] = field.coerce(setting, raw if field.type is not int else int(raw))
+        except (TypeError, ValueError) as e:
+            raise HTTPError(400, str(e))
+
+    size = values['initial_terrain']
+    if size < 3 or (size - 1) & (size - 2):
+        raise HTTPError(400, "size must be 2^k+1.")
+    if not all(values[key] == 0 or values[key] >= 3 for key in ('terrain_width', 'terrain_height')):
+        raise HTTPError(400, "width and height must be 0 (= size) or at least 3.")
+    return values, seed
+
+class LRUCache:
+    """Byte-bounded LRU for arrays and encoded responses."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._items = OrderedDict()
+
+    @staticmethod
+    def _size(value):
+        if isinstance(value, tuple):
+            return sum(LRUCache._size(v) for v in value)
+        if isinstance(value, np.ndarray):
+            return value.nbytes
+        if isinstance(value, (bytes, bytearray)):
+            return len(value)
+        return 64
+
+    def get(self, key):
+        if key in self._items:
+            self._items.move_to_end(key)
+            return self._items[key]
+        return None
+
+    def put(self, key, value):
+        if key in self._items:
+            self.bytes -= self._size(self._items.pop(key))
+        self._items[key] = value
+        self.bytes += self._size(value)
+        while self.bytes > self.max_bytes and len(self._items) > 1:
+            _, old = self._items.popitem(last=False)
+            self.bytes -= self._size(old)
+
+def encode_npy(array):
+    buf = io.BytesIO()
+    np.save(buf, np.ascontiguousarray(array, dtype=np.float32))
+    return buf.getvalue()
+
+def encode_png(array, value_range):
+    from PIL import Image
+    from texture.plot import colored_rgba
+
+    buf = io.BytesIO()
+    # Row 0 is the bottom of the map on screen, PNG rows run top-down
+    Image.fromarray(colored_rgba(array[::-1], value_range=value_range), 'RGBA').save(buf, 'PNG', compress_level=3)
+    return buf.getvalue()
+
+def tile_window(shape, lod, tile):
+    """
+    Row and column slices of tile (x, y) at level of detail `lod` in a map of
+    `shape`: TILE_SIZE + 1 samples every 2^lod cells, fewer at the far edges.
+    """
+    stride = 2 ** lod
+    x, y = tile
+    rows, cols = ((n - 1) // stride + 1 for n in shape)
+    if not (0 <= y * TILE_SIZE < rows - 1 and 0 <= x * TILE_SIZE < cols - 1):
+        raise HTTPError(404, "Tile out of range.")
+    span = TILE_SIZE * stride
+    return slice(y * span, (y + 1) * span + 1, stride), slice(x * span, (x + 1) * span + 1, stride)
+
+def encode_archive_tile(archive, kind, lod, tile):
+    array = archive[tile_window(archive.shape, lod, tile)]
+    if kind == 'png':
+        return encode_png(array, archive.value_range)
+    return encode_npy(array)
+
+def parse_tile(parts):
+    """['{lod}', '{x}', '{y}.{ext}'] to (kind, lod, (x, y))."""
+    name, _, ext = parts[2].partition('.')
+    if ext not in ('png', 'npy'):
+        raise HTTPError(404)
+    try:
+        return ext, int(parts[0]), (int(parts[1]), int(name))
+    except ValueError:
+        raise HTTPError(400, "lod, x and y must be integers.")
+
+class TerrainServer:
+    def __init__(self, workers=None, cache_mb=512, archive_dir=None):
+        self.workers = workers or os.cpu_count()
+        self.archive_dir = archive_dir
+        self._archives = {}  # name -> (Archive, file version)
+        self._pool = None
+        self._maps = LRUCache(cache_mb * 1024 * 1024 // 2)        # map key -> (array, lo, hi)
+        self._responses = LRUCache(cache_mb * 1024 * 1024 // 2)   # request key -> bytes
+        self._inflight = {}  # key -> asyncio.Task shared by identical requests
+        self.stats = {'requests': 0, 'generated': 0, 'coalesced': 0, 'cache_hits': 0}
+
+    # --- jobs -------------------------------------------------------------
+
+    async def _coalesced(self, key, cache, factory):
+        hit = cache.get(key)
+        if hit is not None:
+            self.stats['cache_hits'] += 1
+            return hit
+
+        task = self._inflight.get(key)
+        if task is None:
+            async def run():
+                try:
+                    value = await factory()
+                    cache.put(key, value)
+                    return value
+                finally:
+                    self._inflight.pop(key, None)
+            task = self._inflight[key] = asyncio.ensure_future(run())
+        else:
+            self.stats['coalesced'] += 1
+
+        # a client hanging up must not cancel the job for everyone else
+        return await asyncio.shield(task)
+
+    async def get_map(self, values, seed, lod):
+        params = terrain_params(values)
+        stride = 2 ** lod
+        size = (params['size'] - 1) // stride + 1
+        key = canonical_hash({'params': params, 'seed': seed, 'size': size, 'stride': stride})
+
+        async def generate():
+            loop = asyncio.get_running_loop()
+            try:
+                handle = await loop.run_in_executor(self._pool, render_shared, params, seed, size, stride, shared_pool)
+            except BrokenProcessPool:
+                # a worker died: start a fresh pool, then drop the segments the dead ones left
+                broken, self._pool = self._pool, self._new_pool()
+                await loop.run_in_executor(None, broken.shutdown)
+                shared_pool.reap()
+                raise
+            # mapped, not copied; the memory goes when the cache drops the array
+            array = handle.take('r')
+            self.stats['generated'] += 1
+            return array, float(array.min()), float(array.max())
+
+        return await self._coalesced(key, self._maps, generate)
+
+    @staticmethod
+    def request_key(kind, values, seed, lod=0, tile=None):
+        """Identifies a response; also its ETag, since output is a pure function of it."""
+        return canonical_hash({'kind': kind, 'params': terrain_params(values), 'seed': seed, 'lod': lod, 'tile': tile})
+
+    async def get_response(self, kind, values, seed, lod=0, tile=None):
+        key = self.request_key(kind, values, seed, lod, tile)
+
+        async def build():
+            array, lo, hi = await self.get_map(values, seed, lod)
+            if tile is not None:
+                # the map is already at this lod
+                array = array[tile_window(array.shape, 0, tile)]
+            loop = asyncio.get_running_loop()
+            if kind == 'png':
+                return await loop.run_in_executor(None, encode_png, array, (lo, hi))
+            return await loop.run_in_executor(None, encode_npy, array)
+
+        return key, await self._coalesced(key, self._responses, build)
+
+    # --- archives ---------------------------------------------------------
+
+    def get_archive(self, name):
+        """
+        Archive `name` of the archive directory and its file version (mtime, size);
+        reopened when the file changes.
+        """
+        if not self.archive_dir:
+            raise HTTPError(404, "No archive directory configured.")
+        if name != os.path.basename(name) or name.startswith('.'):
+            raise HTTPError(404)
+        path = os.path.join(self.archive_dir, name + EXTENSION)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            raise HTTPError(404, f"No archive '{name}'.")
+        version = (stat.st_mtime_ns, stat.st_size)
+        entry = self._archives.get(name)
+        if entry is None or entry[1] != version:
+            try:
+                entry = self._archives[name] = (Archive(path), version)
+            except ValueError as e:
+                raise HTTPError(500, str(e))
+        return entry
+
+    @staticmethod
+    def archive_key(name, version, kind, lod, tile):
+        """Identifies an archive response and is its ETag; changes with the file."""
+        return canonical_hash({'kind': kind, 'archive': name, 'version': list(version), 'lod': lod, 'tile': tile})
+
+    async def get_archive_response(self, archive, key, kind, lod, tile):
+        async def build():
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, encode_archive_tile, archive, kind, lod, tile)
+
+        return await self._coalesced(key, self._responses, build)
+
+    async def dispatch_archive(self, parts, headers):
+        if len(parts) == 2 and parts[1] == 'info':
+            archive, _ = self.get_archive(parts[0])
+            info = {
+                'shape': list(archive.shape), 'chunk': archive.chunk, 'codec': archive.codec,
+                'value_range': list(archive.value_range), 'tile_size': TILE_SIZE, 'meta': archive.meta,
+            }
+            return 200, 'application/json', json.dumps(info).encode(), None
+        if len(parts) != 5 or parts[1] != 'tile':
+            raise HTTPError(404)
+
+        kind, lod, tile = parse_tile(parts[2:])
+        archive, version = self.get_archive(parts[0])
+        if lod < 0 or (max(archive.shape) - 1) >> lod < 2:
+            raise HTTPError(400, "lod out of range.")
+
+        tile_window(archive.shape, lod, tile)  # out-of-range tiles are 404, also for conditional requests
+        content_type = 'image/png' if kind == 'png' else 'application/octet-stream'
+        key = self.archive_key(parts[0], version, kind, lod, tile)
+        etag = f'"{key}"'
+        if headers.get('if-none-match') == etag:
+            return 304, content_type, b'', etag
+
+        body = await self.get_archive_response(archive, key, kind, lod, tile)
+        return 200, content_type, body, etag
+
+    # --- http -------------------------------------------------------------
+
+    async def dispatch(self, method, target, headers):
+        if method not in ('GET', 'HEAD'):
+            raise HTTPError(405)
+        url = urlsplit(target)
+        parts = [p for p in url.path.split('/') if p]
+
+        if parts == ['health']:
+            return 200, 'text/plain', b'ok', None
+        if parts and parts[0] == 'archive':
+            return await self.dispatch_archive(parts[1:], headers)
+
+        if len(parts) == 1 and parts[0] in ('heightmap.npy', 'heightmap.png', 'heightmap', 'png'):
+            kind = 'png' if parts[0].endswith('png') else 'npy'
+            lod, tile = 0, None
+        elif len(parts) == 4 and parts[0] == 'tile':
+            kind, lod, tile = parse_tile(parts[1:])
+        else:
+            raise HTTPError(404)
+
+        values, seed = parse_query(url.query)
+        params = terrain_params(values)
+        if lod < 0 or (params['size'] - 1) >> lod < 2:
+            raise HTTPError(400, "lod out of range.")
+        if tile is not None:
+            # out-of-range tiles are 404, also for conditional requests; the map at `lod`
+            # samples the full window every 2^lod cells
+            tile_window((params['height'], params['width']), lod, tile)
+
+        content_type = 'image/png' if kind == 'png' else 'application/octet-stream'
+        etag = f'"{self.request_key(kind, values, seed, lod, tile)}"'
+        if headers.get('if-none-match') == etag:
+            return 304, content_type, b'', etag
+
+        _, body = await self.get_response(kind, values, seed, lod, tile)
+        return 200, content_type, body, etag
+
+    async def respond(self, writer, status, content_type, body, etag, keep_alive, head=False):
+        lines = [
+            f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}",
+            f"Content-Type: {content_type}",
+            f"Content-Length: {len(body)}",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}",
+        ]
+        if etag:
+            lines += [f"ETag: {etag}", "Cache-Control: public, max-age=31536000, immutable"]
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+
+        if not head:
+            view = memoryview(body)
+            for start in range(0, len(view), CHUNK_SIZE):
+                writer.write(view[start:start + CHUNK_SIZE])
+                await writer.drain()
+        await writer.drain()
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                self.stats['requests'] += 1
+                try:
+                    status, content_type, body, etag = await self.dispatch(method, target, headers)
+                except HTTPError as e:
+                    status, content_type, body, etag = e.status, 'text/plain', str(e).encode(), None
+                except Exception as e:
+                    print(f"[WARN] serve: {target}: {e}")
+                    status, content_type, body, etag = 500, 'text/plain', str(e).encode(), None
+
+                await self.respond(writer, status, content_type, body, etag, keep_alive, head=method == 'HEAD')
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def _new_pool(self):
+        # spawn: workers start clean instead of forking the event loop
+        return ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+
+    async def serve(self, host='127.0.0.1', port=8765):
+        self._pool = self._new_pool()
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"[INFO] serving terrain on http://{host}:{port} with {self.workers} workers")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self._pool.shutdown(cancel_futures=True)
+            shared_pool.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=None, help="generation processes (default: CPU count)")
+    parser.add_argument('--cache-mb', type=int, default=512)
+    parser.add_argument('--archive-dir', default=None, help=f"directory of {EXTENSION} archives served under /archive/")
+    args = parser.parse_args(argv)
+
+    server = TerrainServer(workers=args.workers, cache_mb=args.cache_mb, archive_dir=args.archive_dir)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        print(f"\n[INFO] stopped, {server.stats}")
+
+if __name__ == '__main__':
+    main()
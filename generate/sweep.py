@@ -0,0 +1,141 @@
+import contextlib
+import io
+import itertools
+import multiprocessing
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from generate.params import SWEEP_AXES, at_stride, terrain_params
+from settings.store import canonical_hash
+
+def sweep_grid(x_key, y_key=None, axes=SWEEP_AXES):
+    """
+    Cells of a one- or two-parameter sweep, row by row.
+    :return: List of rows, each a list of {settings_key: value} overrides.
+    """
+    x_values = axes[x_key]
+    y_values = axes[y_key] if y_key else [None]
+    return [
+        [{x_key: x, **({y_key: y} if y_key else {})} for x in x_values]
+        for y in y_values
+    ]
+
+def render_heightmap(params, seed, size, stride=1):
+    """
+    Process-pool entry point: heightmap for `make` params, without the progress prints.
+    `size` is the lattice of the preview at `stride`; the map window shrinks with it.
+    """
+    from generate.ds.terrain import make
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        return make(**dict(at_stride(params, stride), size=size), seed=seed, stride=stride)
+
+def render_shared(params, seed, size, stride, pool):
+    """
+    Like `render_heightmap`, but the result goes into a segment of `pool`
+    (store.shared) and only its handle is pickled back to the parent.
+    """
+    return pool.share(render_heightmap(params, seed, size, stride))
+
+class SweepRunner:
+    """
+    Renders sweep thumbnails concurrently on a process pool.
+
+    Results are cached by the hash of (make params, seed, size),
+    so stepping back and forth through sweeps only renders new cells.
+    `on_result(cell, heightmap)` is called from a pool callback thread as
+    soon as each thumbnail is ready; UI callers must hop to their main thread.
+    Thumbnails of an earlier or cancelled run still finishing are cached but
+    not passed on.
+    """
+
+    CACHE_SIZE = 256
+
+    def __init__(self, max_workers=None, thumbnail_size=65):
+        self.max_workers = max_workers
+        self.thumbnail_size = thumbnail_size
+        self._executor = None
+        self._futures = []
+        self._run = 0  # token of the current run, see cancel
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        if self._executor is None:
+            # spawn: workers must not inherit the UI process (and its GL context)
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn')
+            )
+        return self._executor
+
+    def cell_key(self, params, seed):
+        return canonical_hash({'params': params, 'seed': seed, 'size': self.thumbnail_size})
+
+    def _cached(self, key):
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        return None
+
+    def _store(self, key, array):
+        with self._lock:
+            self._cache[key] = array
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.CACHE_SIZE:
+                self._cache.popitem(last=False)
+
+    def run(self, values, cells, seed, on_result):
+        """
+        Render every cell of `cells` (see `sweep_grid`) on top of the settings
+        snapshot `values`. Cancels thumbnails of a previous run still queued.
+        """
+        self.cancel()
+        run = self._run
+        full = terrain_params(values)['size']
+        size = min(self.thumbnail_size, full)
+        stride = (full - 1) // (size - 1)
+
+        for cell in itertools.chain.from_iterable(cells):
+            params = terrain_params({**values, **cell})
+            key = self.cell_key(params, seed)
+            cached = self._cached(key)
+            if cached is not None:
+                on_result(cell, cached)
+                continue
+
+            future = self._pool().submit(render_heightmap, params, seed, size, stride)
+            future.add_done_callback(
+                lambda f, cell=cell, key=key: self._done(f, cell, key, on_result, run)
+            )
+            self._futures.append(future)
+
+    def _done(self, future, cell, key, on_result, run):
+        if future.cancelled():
+            return
+        try:
+            array = np.asarray(future.result())
+        except Exception as e:
+            print(f"[WARN] sweep thumbnail {cell} failed: {e}")
+            return
+        self._store(key, array)
+        if run == self._run:
+            on_result(cell, array)
+
+    def cancel(self):
+        """Drop queued thumbnails; the ones already rendering are only cached."""
+        self._run += 1
+        for future in self._futures:
+            future.cancel()
+        self._futures = []
+
+    def shutdown(self):
+        self.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+sweep_runner = SweepRunner()
@@ -1,3 +1,6 @@
+from utils.startup import startup_trace
+startup_trace.install_if_enabled()  # before any heavy import, so they are traced
+
 from app import DiamondSquareApp
 
 if __name__ == "__main__":
@@ -1,49 +1,239 @@
+import copy
+import hashlib
+import json
+import threading
+from contextlib import contextmanager
+
+# Pipeline stages in execution order; a change invalidates its stage and every later one.
+STAGES = ['terrain', 'noise', 'erosion', 'smoothing']
+
+class Field:
+    """Declared type, default and pipeline stage of one setting."""
+
+    def __init__(self, type, default, stage=None, choices=None, optional=False):
+        self.type = type
+        self.default = default
+        self.stage = stage          # None: UI-only, not part of any stage hash
+        self.choices = choices
+        self.optional = optional    # None is an accepted value
+
+    def coerce(self, key, value):
+        if value is None:
+            if self.optional:
+                return None
+            raise ValueError(f"Setting '{key}' may not be None.")
+        if self.type is bool:
+            value = bool(value)
+        elif self.type is int:
+            if isinstance(value, float) and not value.is_integer():
+                raise TypeError(f"Setting '{key}' expects an integer, got {value!r}.")
+            value = int(value)
+        elif self.type is float:
+            value = float(value)
+        elif not isinstance(value, self.type):
+            raise TypeError(f"Setting '{key}' expects {self.type.__name__}, got {type(value).__name__}.")
+        else:
+            value = copy.deepcopy(value)
+        if self.choices is not None and value not in self.choices:
+            raise ValueError(f"Setting '{key}' must be one of {self.choices}, got {value!r}.")
+        return value
+
+# Important: Empty [None] not allowed, use [False] instead.
+SCHEMA = {
+    'initial_terrain'   : Field(int,   129,     'terrain'),     # Initial Terrain Array Size Variable (N)
+    'terrain_width'     : Field(int,   0,       'terrain'),     # Map width in cells, 0 = N
+    'terrain_height'    : Field(int,   0,       'terrain'),     # Map height in cells, 0 = N
+    # Array Initial Edge Condition (2D python List, NOT array)
+    'initial_edges'     : Field(list,  [[2.0, 2.0], [2.0, 2.0]], 'terrain'),
+
+    'roughness_float'   : Field(float, 0.7,     'terrain'),     # Terrain Roughness Variable (S/dS)
+    'boundary_type'     : Field(str,   'fixed', 'terrain',      # 'fixed' Boundary Condition
+                                choices=['clamped', 'fixed', 'mirrored', 'periodic', 'reflective', 'wrap_around']),
+    'seed'              : Field(int,   None,    'terrain', optional=True), # Shared by previews and the full run, None draws a new one
+
+    'noise'             : Field(list,  [['simplex', {'scale': 0.01, 'strength': 0.4}]], 'noise'),
+    'thermal'           : Field(bool,  True,    'erosion'),
+    'hydraulic'         : Field(bool,  True,    'erosion'),
+    'smoothing'         : Field(list,  [[False]], 'smoothing'), # [["gauss",  {'sigma': 3.0, 'scale': 8.0}], [False]]
+
+    'live_preview'      : Field(bool,  True),                   # Low-resolution preview while dragging sliders
+    'history'           : Field(bool,  True),                   # Keep every generated map, see store.history
+    'upload_budget_ms'  : Field(float, 4.0),                    # Texture upload time per frame, larger maps take several; 0 = no limit
+
+    # Analysis of the finished map, does not change the heightmap itself
+    'hydrology'         : Field(bool,  False),                  # River and lake layers
+    'flow_method'       : Field(str,   'd8',    choices=['d8', 'dinf']),
+    'contour_levels'    : Field(int,   0),                      # Contour lines over the map, 0 = off
+
+    'brush'             : Field(str,   'off',   choices=['off', 'raise', 'lower', 'smooth', 'flatten', 'erode']),
+    'brush_radius'      : Field(int,   16),                     # Brush radius in heightmap cells
+    'brush_strength'    : Field(float, 0.5),                    # Brush strength (0 to 1)
+}
+
+def stage_of(key):
+    """Pipeline stage a setting key feeds, or None for UI-only and unknown keys ('initial_edges_<i>' included)."""
+    field = SCHEMA.get('initial_edges' if key.startswith('initial_edges_') else key)
+    return field.stage if field is not None else None
+
+def canonical_hash(params):
+    """Stable short hash of a JSON-serializable parameter dict."""
+    blob = json.dumps(params, sort_keys=True, separators=(',', ':'), default=repr)
+    return hashlib.sha1(blob.encode('utf-8')).hexdigest()[:16]
+
 class Settings:
+    """
+    Typed settings store.
+
+    Values are validated against SCHEMA. Observers registered with `observe`
+    are called as `callback(key, old, new)` after a value actually changed;
+    inside `batch()` every key is reported once, when the batch ends.
+    `snapshot`/`diff` and `stage_hash` let caches tell which pipeline stages
+    a change invalidates.
+    """
+
     def __init__(self):
+        self._lock = threading.RLock()
+        self._observers = {}    # key or '*' -> [callback]
+        self._batch_depth = 0
+        self._batched = {}      # key -> (old, new) collected during batch()
+        self.settings = {}
         self.reset()
-    
+
     def reset(self):
-        # Important: Empty [None] not allowed, use [False] instead.
-        self.settings = {
-            'initial_terrain'   : 129,          # Initial Terrain Array Size Variable (N)
-            # Array Initial Edge Condition (2D python List, NOT array)
-            'initial_edges'     : [[2.0, 2.0], [2.0, 2.0]],
-
-            'roughness_float'   : 0.7,          # Terrain Roughness Variable (S/dS)
-            'boundary_type'     : 'fixed',      # 'fixed' Boundary Condition
-
-            'noise'             : [['simplex', 0.8]],
-            'thermal'           : True,
-            'hydraulic'         : True,
-            'smoothing'         : [[False]], # [["gauss",  {'sigma': 3.0, 'scale': 8.0}], [False]]
-        }
+        with self._lock:
+            old = self.settings
+            self.settings = {key: copy.deepcopy(field.default) for key, field in SCHEMA.items()}
+            changes = self.diff(old, self.settings) if old else {}
+        self._notify(changes)
+
+    # --- observers --------------------------------------------------------
+
+    def observe(self, key, callback):
+        """Call `callback(key, old, new)` when `key` changes; key '*' observes everything."""
+        with self._lock:
+            self._observers.setdefault(key, []).append(callback)
+
+    def unobserve(self, key, callback):
+        with self._lock:
+            callbacks = self._observers.get(key, [])
+            if callback in callbacks:
+                callbacks.remove(callback)
+
+    @contextmanager
+    def batch(self):
+        """Apply several `set` calls and notify every changed key once afterwards."""
+        with self._lock:
+            self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._batch_depth -= 1
+                changes = {}
+                if self._batch_depth == 0:
+                    changes, self._batched = self._batched, {}
+            self._notify(changes)
+
+    def _record(self, key, old, new):
+        if old == new:
+            return
+        with self._lock:
+            if self._batch_depth:
+                first_old = self._batched.get(key, (old, None))[0]
+                self._batched[key] = (first_old, new)
+                return
+        self._notify({key: (old, new)})
+
+    def _notify(self, changes):
+        for key, (old, new) in changes.items():
+            if old == new:
+                continue
+            with self._lock:
+                callbacks = self._observers.get(key, []) + self._observers.get('*', [])
+            for callback in callbacks:
+                try:
+                    callback(key, old, new)
+                except Exception as e:
+                    print(f"[WARN] settings observer for '{key}' failed: {e}")
+
+    # --- access -----------------------------------------------------------
 
     def set_initial_edge(self, index, value):
         """Set value for initial_edges based on a flat index (0 to 3)."""
-        i, j = divmod(index, len(self.settings['initial_edges'][0]))
-        self.settings['initial_edges'][i][j] = value
-    
+        with self._lock:
+            old = self.settings['initial_edges']
+            i, j = divmod(index, len(old[0]))
+            new = copy.deepcopy(old)
+            new[i][j] = float(value)
+            self.settings['initial_edges'] = new
+        self._record('initial_edges', old, new)
+
     def get_initial_edge(self, index):
         """Get value for initial_edges based on a flat index (0 to 3)."""
         i, j = divmod(index, len(self.settings['initial_edges'][0]))
         return self.settings['initial_edges'][i][j]
-        
+
     def set(self, key, value):
         if key.startswith('initial_edges_'):
             index = int(key.split('_')[-1])
             self.set_initial_edge(index, value)
-        elif key in self.settings:
-            print(f"Setting {key} to {value}")  # ← debug
-            self.settings[key] = value
-    
+        elif key in SCHEMA:
+            value = SCHEMA[key].coerce(key, value)
+            with self._lock:
+                old = self.settings[key]
+                self.settings[key] = value
+            self._record(key, old, value)
+
     def get(self, key, default=None):
         if key.startswith('initial_edges_'):
             index = int(key.split('_')[-1])
             return self.get_initial_edge(index)
         return self.settings.get(key, default)
-    
+
     def get_all(self):
         return self.settings
 
+    # --- snapshots and hashing -------------------------------------------
+
+    def snapshot(self):
+        """Deep copy of all current values."""
+        with self._lock:
+            return copy.deepcopy(self.settings)
+
+    def diff(self, old, new=None):
+        """Changed keys between two snapshots (`new` defaults to now): {key: (old, new)}."""
+        new = self.snapshot() if new is None else new
+        return {
+            key: (old.get(key), new.get(key))
+            for key in set(old) | set(new)
+            if old.get(key) != new.get(key)
+        }
+
+    @staticmethod
+    def affected_stages(changes):
+        """Pipeline stages invalidated by `changes` (keys or a diff), in order."""
+        touched = [STAGES.index(SCHEMA[key].stage) for key in changes
+                   if key in SCHEMA and SCHEMA[key].stage is not None]
+        return STAGES[min(touched):] if touched else []
+
+    def stage_params(self, stage, snapshot=None):
+        """Parameters of `stage` only."""
+        values = self.settings if snapshot is None else snapshot
+        return {key: values.get(key) for key, field in SCHEMA.items() if field.stage == stage}
+
+    def stage_hash(self, stage, snapshot=None):
+        """
+        Canonical hash of `stage` and every stage before it, so the hash
+        changes exactly when that stage's output would.
+        """
+        with self._lock:
+            upstream = STAGES[:STAGES.index(stage) + 1]
+            params = {name: self.stage_params(name, snapshot) for name in upstream}
+        return canonical_hash(params)
+
+    def params_hash(self, snapshot=None):
+        """Hash of the whole pipeline's parameters."""
+        return self.stage_hash(STAGES[-1], snapshot)
+
 # Create a global settings instance
 settings = Settings()
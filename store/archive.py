@@ -0,0 +1,394 @@
+"""
+Chunked heightmap archives (.dsa).
+
+A map is stored as square chunks, each quantized to uint16 between its own
+min and max and compressed on its own (zlib or lzma), so reading a window
+decompresses only the chunks under it and a writer holds at most one row
+of chunks. Layout, little-endian:
+
+    header    magic b'DSARCHV1', version, codec, chunk size, height, width,
+              length of the metadata
+    metadata  JSON (make params, seed, ...)
+    index     one INDEX_DTYPE record per chunk, row-major: offset and
+              length of its payload, its min and max
+    payloads  compressed uint16 cells of each chunk, filtered: each cell
+              minus its left neighbour (mod 2^16), then all low bytes
+              followed by all high bytes
+
+The index sits at a fixed offset, so readers map it with np.memmap instead
+of parsing it; writers reserve its space up front and fill it in on close.
+The quantization error is at most (max - min) / 131070 of the chunk.
+
+    python -m store.archive pack terrain.npy terrain.dsa --codec lzma
+    python -m store.archive info terrain.dsa
+    python -m store.archive unpack terrain.dsa terrain.npy
+"""
+import argparse
+import json
+import lzma
+import os
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+from store.shared import as_array
+
+EXTENSION = '.dsa'
+MAGIC = b'DSARCHV1'
+VERSION = 1
+CHUNK = 256
+
+_HEADER = struct.Struct('<8sHHIIIQ')  # magic, version, codec, chunk, height, width, metadata length
+
+INDEX_DTYPE = np.dtype([('offset', '<u8'), ('length', '<u8'), ('min', '<f8'), ('max', '<f8')])
+
+# name -> (id in the header, compress(data, level), decompress(data), default level)
+CODECS = {
+    'none': (0, lambda data, level: data, lambda data: data, 0),
+    'zlib': (1, lambda data, level: zlib.compress(data, level), zlib.decompress, 6),
+    'lzma': (2, lambda data, level: lzma.compress(data, preset=level), lzma.decompress, 6),
+}
+_CODEC_NAMES = {codec_id: name for name, (codec_id, *_) in CODECS.items()}
+
+_LEVELS = 65535
+
+def quantize(block):
+    """Chunk cells to (uint16 cells, min, max)."""
+    lo, hi = float(np.min(block)), float(np.max(block))
+    if not np.isfinite(lo) or not np.isfinite(hi):
+        raise ValueError("Archives store finite heights only.")
+    if hi == lo:
+        return np.zeros(block.shape, dtype='<u2'), lo, hi
+    q = np.subtract(block, lo, dtype=np.float64)
+    np.multiply(q, _LEVELS / (hi - lo), out=q)
+    np.rint(q, out=q)
+    np.clip(q, 0, _LEVELS, out=q)
+    return q.astype('<u2'), lo, hi
+
+def dequantize(q, lo, hi):
+    return lo + q * ((hi - lo) / _LEVELS)
+
+def _filter(q):
+    # neighbouring heights are close: their differences and the high bytes compress well
+    rows = q.shape[0]
+    d = np.diff(q, axis=1, prepend=np.zeros((rows, 1), dtype='<u2'))
+    return d.view(np.uint8).reshape(-1, 2).T.tobytes()
+
+def _unfilter(data, shape):
+    d = np.frombuffer(data, dtype=np.uint8).reshape(2, -1).T.copy().view('<u2').reshape(shape)
+    return np.cumsum(d, axis=1, dtype=np.uint16)
+
+class ArchiveWriter:
+    """
+    Streams a map into an archive, chunk by chunk (`write_chunk`, any order)
+    or band by band (`write_rows`, top to bottom). The file appears at `path`
+    only once `close()` has written the index.
+    """
+
+    def __init__(self, path, height, width, chunk=CHUNK, codec='zlib', level=None, meta=None):
+        if codec not in CODECS:
+            raise ValueError(f"Unknown codec '{codec}', expected one of {sorted(CODECS)}.")
+        if height < 1 or width < 1 or chunk < 1:
+            raise ValueError(f"Invalid archive shape {height}x{width} with chunk {chunk}.")
+        self.path = path
+        self.shape = (int(height), int(width))
+        self.chunk = int(chunk)
+        self.codec = codec
+        codec_id, self._compress, _, default_level = CODECS[codec]
+        self.level = default_level if level is None else level
+        self.grid = (-(-self.shape[0] // self.chunk), -(-self.shape[1] // self.chunk))
+
+        self._index = np.zeros(self.grid, dtype=INDEX_DTYPE)
+        self._written = np.zeros(self.grid, dtype=bool)
+        self._band = None
+        self._next_row = 0
+
+        # written next to the target and renamed on close, so a crash never leaves a truncated archive
+        self._tmp_path = f"{path}.tmp"
+        self._file = open(self._tmp_path, 'wb')
+        meta_bytes = json.dumps(meta or {}).encode('utf-8')
+        self._file.write(_HEADER.pack(MAGIC, VERSION, codec_id, self.chunk, *self.shape, len(meta_bytes)))
+        self._file.write(meta_bytes)
+        self._index_offset = self._file.tell()
+        self._file.write(bytes(self._index.nbytes))
+
+    def _chunk_shape(self, cy, cx):
+        c = self.chunk
+        return min(c, self.shape[0] - cy * c), min(c, self.shape[1] - cx * c)
+
+    def write_chunk(self, cy, cx, block):
+        """Quantize, compress and append chunk (cy, cx); `block` is its full extent (smaller at the edges)."""
+        block = np.asarray(block)
+        if block.shape != self._chunk_shape(cy, cx):
+            raise ValueError(f"Chunk ({cy}, {cx}) must be {self._chunk_shape(cy, cx)}, got {block.shape}.")
+        if self._written[cy, cx]:
+            raise ValueError(f"Chunk ({cy}, {cx}) written twice.")
+        q, lo, hi = quantize(block)
+        payload = self._compress(_filter(q), self.level)
+        self._index[cy, cx] = (self._file.tell(), len(payload), lo, hi)
+        self._file.write(payload)
+        self._written[cy, cx] = True
+
+    def write_rows(self, rows):
+        """Append the next rows of the map (any number, top to bottom); full chunk rows are written out."""
+        rows = np.asarray(rows)
+        if rows.ndim != 2 or rows.shape[1] != self.shape[1]:
+            raise ValueError(f"Rows must be (n, {self.shape[1]}), got {rows.shape}.")
+        if self._next_row + rows.shape[0] > self.shape[0]:
+            raise ValueError(f"More than {self.shape[0]} rows written.")
+        while rows.shape[0]:
+            cy, offset = divmod(self._next_row, self.chunk)
+            height = self._chunk_shape(cy, 0)[0]
+            if self._band is None:
+                self._band = np.empty((height, self.shape[1]))
+            take = min(height - offset, rows.shape[0])
+            self._band[offset:offset + take] = rows[:take]
+            rows = rows[take:]
+            self._next_row += take
+            if offset + take == height:
+                for cx in range(self.grid[1]):
+                    self.write_chunk(cy, cx, self._band[:, cx * self.chunk:(cx + 1) * self.chunk])
+                self._band = None
+
+    def close(self):
+        """Write the index and move the archive into place. :return: The path."""
+        if self._file is None:
+            return self.path
+        if not self._written.all():
+            missing = np.argwhere(~self._written)[:4].tolist()
+            self.abort()
+            raise ValueError(f"Archive incomplete, chunks missing: {missing}...")
+        self._file.seek(self._index_offset)
+        self._file.write(self._index.tobytes())
+        self._file.close()
+        self._file = None
+        os.replace(self._tmp_path, self.path)
+        return self.path
+
+    def abort(self):
+        """Drop the archive being written."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            os.unlink(self._tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+def write(path, array, chunk=CHUNK, codec='zlib', level=None, meta=None):
+    """
+    Write a 2D map (array, memmap or store.shared handle) to an archive,
+    one row of chunks at a time. :return: The path.
+    """
+    array = as_array(array)
+    with ArchiveWriter(path, *array.shape, chunk=chunk, codec=codec, level=level, meta=meta) as writer:
+        for y in range(0, array.shape[0], chunk):
+            writer.write_rows(array[y:y + chunk])
+    return path
+
+class Archive:
+    """
+    Read-only archive. The index is memory-mapped; `archive[y0:y1:step, x0:x1:step]`
+    decompresses only the chunks under the window. Decoded chunks are kept
+    in a small LRU, so neighbouring tiles reuse them. Safe to share between threads.
+    """
+
+    def __init__(self, path, cache_chunks=64):
+        self.path = path
+        with open(path, 'rb') as f:
+            header = f.read(_HEADER.size)
+            if len(header) < _HEADER.size or header[:len(MAGIC)] != MAGIC:
+                raise ValueError(f"{path} is not a heightmap archive.")
+            _, version, codec_id, chunk, height, width, meta_length = _HEADER.unpack(header)
+            if version > VERSION:
+                raise ValueError(f"{path}: archive version {version} is newer than supported ({VERSION}).")
+            if codec_id not in _CODEC_NAMES:
+                raise ValueError(f"{path}: unknown codec id {codec_id}.")
+            self.meta = json.loads(f.read(meta_length).decode('utf-8'))
+
+        self.codec = _CODEC_NAMES[codec_id]
+        self._decompress = CODECS[self.codec][2]
+        self.chunk = chunk
+        self.shape = (height, width)
+        self.grid = (-(-height // chunk), -(-width // chunk))
+        self.index = np.memmap(
+            path, dtype=INDEX_DTYPE, mode='r', offset=_HEADER.size + meta_length, shape=self.grid
+        )
+        self.cache_chunks = cache_chunks
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._file = open(path, 'rb')
+
+    ndim = 2
+    dtype = np.dtype(np.float64)
+
+    @property
+    def value_range(self):
+        """(min, max) of the whole map, from the index."""
+        return float(self.index['min'].min()), float(self.index['max'].max())
+
+    @property
+    def nbytes(self):
+        """Size of the decoded map in memory."""
+        return self.shape[0] * self.shape[1] * self.dtype.itemsize
+
+    def chunk_at(self, cy, cx):
+        """Decoded chunk (cy, cx), read-only."""
+        key = (cy, cx)
+        with self._lock:
+            block = self._cache.get(key)
+            if block is not None:
+                self._cache.move_to_end(key)
+                return block
+            offset, length, lo, hi = self.index[cy, cx].tolist()
+            self._file.seek(offset)
+            payload = self._file.read(length)
+
+        rows = min(self.chunk, self.shape[0] - cy * self.chunk)
+        cols = min(self.chunk, self.shape[1] - cx * self.chunk)
+        q = _unfilter(self._decompress(payload), (rows, cols))
+        block = dequantize(q, lo, hi)
+        block.flags.writeable = False
+
+        with self._lock:
+            self._cache[key] = block
+            while len(self._cache) > self.cache_chunks:
+                self._cache.popitem(last=False)
+        return block
+
+    def _axis(self, key, size):
+        if isinstance(key, (int, np.integer)):
+            index = key + size if key < 0 else key
+            if not 0 <= index < size:
+                raise IndexError(f"Index {key} out of range for size {size}.")
+            return slice(index, index + 1, 1), True
+        if not isinstance(key, slice):
+            raise TypeError(f"Archives are indexed with ints and slices, got {key!r}.")
+        start, stop, step = key.indices(size)
+        if step < 1:
+            raise ValueError("Archives are read with positive steps only.")
+        return slice(start, max(start, stop), step), False
+
+    def _spans(self, window):
+        """Per chunk the window touches: (chunk index, local slice, output slice)."""
+        spans, out = [], 0
+        start, stop, step = window.start, window.stop, window.step
+        while start < stop:
+            c = start // self.chunk
+            end = min(stop, (c + 1) * self.chunk)
+            count = -(-(end - start) // step)
+            local = start - c * self.chunk
+            spans.append((c, slice(local, local + (count - 1) * step + 1, step), slice(out, out + count)))
+            out += count
+            start += count * step
+        return spans, out
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if key and key[0] is Ellipsis:
+            key = key[1:]
+        if len(key) > 2:
+            raise IndexError(f"Archives are 2D, got {len(key)} indices.")
+        key = key + (slice(None),) * (2 - len(key))
+
+        (rows, drop_row), (cols, drop_col) = (self._axis(k, n) for k, n in zip(key, self.shape))
+        row_spans, height = self._spans(rows)
+        col_spans, width = self._spans(cols)
+        out = np.empty((height, width))
+        for cy, local_rows, out_rows in row_spans:
+            for cx, local_cols, out_cols in col_spans:
+                out[out_rows, out_cols] = self.chunk_at(cy, cx)[local_rows, local_cols]
+        if drop_row or drop_col:
+            out = out[0 if drop_row else slice(None), 0 if drop_col else slice(None)]
+        return out
+
+    def read(self):
+        """The whole map."""
+        return self[:, :]
+
+    def __array__(self, dtype=None, copy=None):
+        array = self.read()
+        return array if dtype is None else array.astype(dtype)
+
+    def close(self):
+        with self._lock:
+            self._cache.clear()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        self.index = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __repr__(self):
+        return f"Archive({os.path.basename(self.path)}, shape={self.shape}, chunk={self.chunk}, codec={self.codec})"
+
+def load_heightmap(path):
+    """
+    Heightmap from an archive (.dsa, decoded), an erosion checkpoint (.npz)
+    or a .npy file (memory-mapped).
+    """
+    if path.endswith(EXTENSION):
+        with Archive(path) as archive:
+            return archive.read()
+    if path.endswith('.npz'):
+        with np.load(path) as data:
+            return data['heightmap']
+    return np.load(path, mmap_mode='r')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    pack = commands.add_parser('pack', help="heightmap (.npy, .npz) to archive")
+    pack.add_argument('input')
+    pack.add_argument('output')
+    pack.add_argument('--chunk', type=int, default=CHUNK)
+    pack.add_argument('--codec', choices=sorted(CODECS), default='zlib')
+    pack.add_argument('--level', type=int, default=None)
+
+    unpack = commands.add_parser('unpack', help="archive to .npy")
+    unpack.add_argument('input')
+    unpack.add_argument('output')
+
+    info = commands.add_parser('info', help="shape, chunks, codec, size and metadata")
+    info.add_argument('input')
+    args = parser.parse_args(argv)
+
+    if args.command == 'pack':
+        write(args.output, load_heightmap(args.input), args.chunk, args.codec, args.level)
+        ratio = os.path.getsize(args.output) / max(1, os.path.getsize(args.input))
+        print(f"[INFO] {args.input} -> {args.output} ({ratio:.1%} of the input size)")
+    elif args.command == 'unpack':
+        with Archive(args.input) as archive:
+            out = np.lib.format.open_memmap(args.output, mode='w+', dtype=np.float64, shape=archive.shape)
+            for cy in range(archive.grid[0]):
+                y = cy * archive.chunk
+                out[y:y + archive.chunk] = archive[y:y + archive.chunk, :]
+            out.flush()
+        print(f"[INFO] {args.input} -> {args.output}")
+    else:
+        with Archive(args.input) as archive:
+            lo, hi = archive.value_range
+            print(f"[INFO] {archive}")
+            print(f"[INFO] {archive.grid[0]}x{archive.grid[1]} chunks, heights {lo:.6g}..{hi:.6g}, "
+                  f"{os.path.getsize(args.input) / archive.nbytes:.1%} of {archive.nbytes / 2**20:.1f} MiB")
+            if archive.meta:
+                print(f"[INFO] meta: {json.dumps(archive.meta)}")
+
+if __name__ == '__main__':
+    main()
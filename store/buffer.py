@@ -1,9 +1,13 @@
 import threading
 import numpy as np
 
+from store.shared import SharedArray
+
 class DataBuffer:
     """Singleton buffer storing exactly one numpy array at a time.
     Raises an exception if an attempt is made to overwrite existing buffer.
+    Named layers derived from that array (e.g. river and lake masks) live
+    alongside it and are dropped together with it.
     """
 
     _instance = None
@@ -20,13 +24,17 @@ class DataBuffer:
             self.buffer = None  # stores the numpy array directly
             self.dtype = None
             self.shape = None
+            self.layers = {}    # name -> numpy array shaped like the buffer
             self.initialized = True
 
     def store(self, data):
-        """Store exactly one numpy array. Raises if buffer is occupied."""
-        data = np.asarray(data)
+        """
+        Store exactly one numpy array. Raises if buffer is occupied.
+        A SharedArray handle (from a worker process) is mapped, not copied.
+        """
         if self.buffer is not None:
             raise RuntimeError("Buffer already contains data. Clear before storing new array.")
+        data = data.take() if isinstance(data, SharedArray) else np.asarray(data)
         self.buffer = data
         self.dtype = data.dtype
         self.shape = data.shape
@@ -38,10 +46,39 @@ class DataBuffer:
         return self.buffer
 
     def clear(self):
-        """Clear the stored array."""
+        """Clear the stored array and its layers."""
         self.buffer = None
         self.dtype = None
         self.shape = None
+        self.layers = {}
+
+    def store_layer(self, name, data):
+        """Store (or replace) a layer derived from the stored array."""
+        data = data.take() if isinstance(data, SharedArray) else np.asarray(data)
+        if self.buffer is None:
+            raise RuntimeError("Buffer is empty.")
+        if data.shape != self.shape:
+            raise ValueError(f"Layer '{name}' has shape {data.shape}, buffer has {self.shape}.")
+        self.layers[name] = data
+
+    def set_layers(self, layers):
+        """Replace all layers at once, so readers never see a mix of old and new."""
+        layers = {
+            name: data.take() if isinstance(data, SharedArray) else np.asarray(data)
+            for name, data in layers.items()
+        }
+        for name, data in layers.items():
+            if data.shape != self.shape:
+                raise ValueError(f"Layer '{name}' has shape {data.shape}, buffer has {self.shape}.")
+        self.layers = layers
+
+    def get_layer(self, name, default=None):
+        """Return the layer `name`, or `default` if it is not stored."""
+        return self.layers.get(name, default)
+
+    def clear_layers(self):
+        """Drop all layers, e.g. after the stored array was edited in place."""
+        self.layers = {}
 
     def get_shape(self):
         """Get the shape of the stored array."""
@@ -0,0 +1,296 @@
+"""
+Generation history: every finished map, kept on disk so it can be reopened
+without regenerating it.
+
+Entries are keyed by the hash of what produced the map (make params, seed
+and any erosion run on top, see `entry_key`), so generating the same map
+again adds nothing. Layout under the history directory (DSGUI_HISTORY_DIR,
+default ~/.dsgui/history):
+
+    index.sqlite       one row per entry: key, times, seed, shape,
+                       generation seconds, params, settings, statistics
+    thumbs/<key>.png   colormap thumbnail, drawn like the main view
+    maps/<key>.dsa     the full heightmap (store.archive), read on demand
+
+Archives are written by a background thread, so recording costs the
+generation thread one copy of the map; an entry is listed once its files
+are complete. Beyond MAX_ENTRIES entries or MAX_BYTES on disk
+(DSGUI_HISTORY_MAX_MB) the least recently opened entries go.
+
+    python -m store.history list
+    python -m store.history export <key> terrain.dsa
+    python -m store.history prune 100 --max-mb 500
+"""
+import argparse
+import json
+import os
+import queue
+import shutil
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from settings.store import canonical_hash
+from store.archive  import EXTENSION, Archive, write as write_archive
+
+ENV = 'DSGUI_HISTORY_DIR'
+MAX_MB_ENV = 'DSGUI_HISTORY_MAX_MB'
+THUMBNAIL_SIZE = 128
+MAX_ENTRIES = 500
+MAX_BYTES = 2 * 2**30  # a 4097x4097 map takes about 27 MB
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key      TEXT PRIMARY KEY,
+    created  REAL NOT NULL,
+    opened   REAL NOT NULL,
+    seed     INTEGER,
+    width    INTEGER,
+    height   INTEGER,
+    seconds  REAL,
+    params   TEXT,
+    erosion  TEXT,
+    settings TEXT,
+    stats    TEXT,
+    bytes    INTEGER
+)
+"""
+COLUMNS = ('key', 'created', 'opened', 'seed', 'width', 'height', 'seconds', 'params', 'erosion', 'settings', 'stats', 'bytes')
+JSON_COLUMNS = ('params', 'erosion', 'settings', 'stats')
+
+def default_root():
+    return os.environ.get(ENV) or os.path.join(os.path.expanduser('~'), '.dsgui', 'history')
+
+def default_max_bytes():
+    value = os.environ.get(MAX_MB_ENV)
+    return int(float(value) * 2**20) if value else MAX_BYTES
+
+def entry_key(params, seed, erosion=None):
+    """Key of the map `make(**params, seed=seed)` gives, plus `erosion` ({method: iterations}) run on it later."""
+    return canonical_hash({'params': params, 'seed': seed, 'erosion': erosion or {}})
+
+def thumbnail_rgba(heightmap, size=THUMBNAIL_SIZE):
+    """Colormap thumbnail of at most `size` cells per side, rows flipped so row 0 is at the bottom as on screen."""
+    from texture.plot import colored_rgba, remove_padding
+
+    inner = remove_padding(np.asarray(heightmap))
+    stride = max(1, -(-max(inner.shape) // size))
+    return np.ascontiguousarray(colored_rgba(inner[::stride, ::stride])[::-1])
+
+class History:
+    """
+    SQLite index plus thumbnail and archive files of generated maps.
+    Safe to use from several threads; each call opens its own connection.
+    """
+
+    def __init__(self, root=None, max_entries=MAX_ENTRIES, max_bytes=None):
+        self.root = root or default_root()
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes or default_max_bytes()
+        self._lock = threading.Lock()
+        self._ready = False
+        self._queue = None
+        self._writer = None
+
+    # --- storage ----------------------------------------------------------
+
+    def _connect(self):
+        if not self._ready:
+            os.makedirs(os.path.join(self.root, 'thumbs'), exist_ok=True)
+            os.makedirs(os.path.join(self.root, 'maps'), exist_ok=True)
+        connection = sqlite3.connect(os.path.join(self.root, 'index.sqlite'), timeout=10)
+        if not self._ready:
+            connection.execute(SCHEMA)
+            connection.commit()
+            self._ready = True
+        return connection
+
+    @contextmanager
+    def _index(self):
+        """Connection to the index that commits and closes on exit, one thread at a time."""
+        with self._lock:
+            connection = self._connect()
+            try:
+                with connection:
+                    yield connection
+            finally:
+                connection.close()
+
+    def thumbnail_path(self, key):
+        return os.path.join(self.root, 'thumbs', f"{key}.png")
+
+    def map_path(self, key):
+        return os.path.join(self.root, 'maps', f"{key}{EXTENSION}")
+
+    # --- recording --------------------------------------------------------
+
+    def __contains__(self, key):
+        with self._index() as connection:
+            return connection.execute("SELECT 1 FROM entries WHERE key = ?", (key,)).fetchone() is not None
+
+    def record(self, heightmap, params, seed, erosion=None, seconds=None, settings=None, stats=None):
+        """
+        Add a map to the history unless its key is already there (then it only
+        counts as opened). The map is copied; thumbnail, archive and index row
+        are written by the background writer.
+        :return: The entry key.
+        """
+        key = entry_key(params, seed, erosion)
+        if self.touch(key):
+            return key
+        entry = {
+            'key': key, 'seed': seed, 'seconds': seconds,
+            'params': params, 'erosion': erosion or {}, 'settings': settings or {}, 'stats': stats or {},
+        }
+        self._submit(np.array(heightmap, copy=True), entry)
+        return key
+
+    def _submit(self, heightmap, entry):
+        with self._lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._queue = queue.Queue()
+                self._writer = threading.Thread(target=self._write_loop, name="HistoryWriterThread", daemon=True)
+                self._writer.start()
+        self._queue.put((heightmap, entry))
+
+    def _write_loop(self):
+        while True:
+            heightmap, entry = self._queue.get()
+            try:
+                self.add(heightmap, entry)
+            except Exception as e:
+                print(f"[WARN] history: could not record {entry['key']}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def add(self, heightmap, entry):
+        """Write the files and index row of `entry` (see `record`) in the calling thread."""
+        from PIL import Image
+
+        key = entry['key']
+        with self._index():
+            pass  # directories and table
+        Image.fromarray(thumbnail_rgba(heightmap), 'RGBA').save(self.thumbnail_path(key))
+        meta = {'params': entry['params'], 'seed': entry['seed'], 'erosion': entry['erosion']}
+        write_archive(self.map_path(key), heightmap, meta=meta)
+
+        now = time.time()
+        row = dict(
+            entry, created=now, opened=now, height=heightmap.shape[0], width=heightmap.shape[1],
+            bytes=os.path.getsize(self.map_path(key)) + os.path.getsize(self.thumbnail_path(key)),
+        )
+        for column in JSON_COLUMNS:
+            row[column] = json.dumps(row[column])
+        with self._index() as connection:
+            connection.execute(
+                f"INSERT OR REPLACE INTO entries ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                [row[column] for column in COLUMNS],
+            )
+        self.prune(self.max_entries, self.max_bytes)
+
+    def flush(self):
+        """Wait until every recorded map is on disk."""
+        if self._queue is not None:
+            self._queue.join()
+
+    # --- browsing ---------------------------------------------------------
+
+    def _select(self, clause='', args=()):
+        with self._index() as connection:
+            rows = connection.execute(f"SELECT {', '.join(COLUMNS)} FROM entries {clause}", args).fetchall()
+        entries = []
+        for values in rows:
+            entry = dict(zip(COLUMNS, values))
+            for column in JSON_COLUMNS:
+                entry[column] = json.loads(entry[column]) if entry[column] else {}
+            entries.append(entry)
+        return entries
+
+    def entries(self, limit=-1):
+        """Index rows, most recently opened first, as dicts (JSON columns decoded); no array is read."""
+        return self._select("ORDER BY opened DESC LIMIT ?", (limit,))
+
+    def get(self, key):
+        """Index row of `key`, or None."""
+        return next(iter(self._select("WHERE key = ?", (key,))), None)
+
+    def touch(self, key):
+        """Mark `key` as opened now. :return: Whether the entry exists."""
+        with self._index() as connection:
+            return connection.execute("UPDATE entries SET opened = ? WHERE key = ?", (time.time(), key)).rowcount > 0
+
+    def load(self, key):
+        """The full heightmap of `key`, decoded from its archive."""
+        with Archive(self.map_path(key)) as archive:
+            heightmap = archive.read()
+        self.touch(key)
+        return heightmap
+
+    def remove(self, key):
+        with self._index() as connection:
+            connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+        for path in (self.map_path(key), self.thumbnail_path(key)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def prune(self, keep, max_bytes=None):
+        """
+        Remove all but the `keep` most recently opened entries, and the oldest
+        of those while they take more than `max_bytes`; the most recent entry
+        always stays. :return: Keys removed.
+        """
+        with self._index() as connection:
+            rows = connection.execute("SELECT key, bytes FROM entries ORDER BY opened DESC").fetchall()
+        keys = []
+        total = 0
+        for i, (key, size) in enumerate(rows):
+            total += size or 0
+            if i >= keep or (max_bytes is not None and total > max_bytes and i > 0):
+                keys.append(key)
+        for key in keys:
+            self.remove(key)
+        return keys
+
+    def nbytes(self):
+        with self._index() as connection:
+            return connection.execute("SELECT COALESCE(SUM(bytes), 0) FROM entries").fetchone()[0]
+
+    def __len__(self):
+        with self._index() as connection:
+            return connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+history = History()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--root', default=None, help=f"history directory (default: ${ENV} or ~/.dsgui/history)")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list', help="entries, most recently opened first")
+    export = commands.add_parser('export', help="copy the archive of an entry")
+    export.add_argument('key')
+    export.add_argument('output')
+    prune = commands.add_parser('prune', help="keep only the most recently opened entries")
+    prune.add_argument('keep', type=int)
+    prune.add_argument('--max-mb', type=float, default=None, help="also keep at most this much on disk")
+    args = parser.parse_args(argv)
+
+    store = History(args.root) if args.root else history
+    if args.command == 'list':
+        for entry in store.entries():
+            created = time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['created']))
+            seconds = f"{entry['seconds']:.1f}s" if entry['seconds'] is not None else '-'
+            print(f"{entry['key']}  {created}  seed {entry['seed']:>10}  {entry['width']}x{entry['height']}  "
+                  f"{seconds:>7}  {json.dumps(entry['erosion'])}")
+        print(f"[INFO] {len(store)} entries, {store.nbytes() / 2**20:.1f} MiB in {store.root}")
+    elif args.command == 'export':
+        shutil.copyfile(store.map_path(args.key), args.output)
+        print(f"[INFO] {args.key} -> {args.output}")
+    else:
+        removed = store.prune(args.keep, None if args.max_mb is None else int(args.max_mb * 2**20))
+        print(f"[INFO] removed {len(removed)} entries")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+"""
+Zero-copy array transport between processes.
+
+Workers write results into .npy segment files in a directory owned by a
+SharedPool (on /dev/shm where available, so the pages never touch disk) and
+send back a SharedArray handle: a path, shape and dtype, a few hundred bytes
+to pickle instead of the whole array. The receiver maps the segment with
+`take()`, which also unlinks the file. The mapping stays valid until the
+last array referencing it is gone, then the kernel frees the memory, so
+a segment that has been taken needs no further cleanup.
+
+Segments are named after the process that created them. `reap()` removes
+the ones whose creator died before they were taken (a crashed worker),
+`close()` removes the pool directory, and a new pool removes the
+directories of pools whose owner process is gone.
+"""
+import atexit
+import itertools
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+
+import numpy as np
+
+POOL_PREFIX = 'diamond-square-'
+
+def _default_root():
+    return '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    try:
+        # a crashed worker stays a zombie until its pool joins it
+        with open(f'/proc/{pid}/stat') as f:
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except (OSError, IndexError):
+        return True
+
+def _owner(name, prefix=''):
+    """Creator pid encoded in a pool directory or segment name, or None."""
+    head = name[len(prefix):].split('-', 1)[0].split('.', 1)[0]
+    return int(head) if name.startswith(prefix) and head.isdigit() else None
+
+class SharedArray:
+    """Picklable handle of an array stored in a pool segment."""
+
+    __slots__ = ('path', 'shape', 'dtype')
+
+    def __init__(self, path, shape, dtype):
+        self.path = path
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+
+    def __getstate__(self):
+        return self.path, self.shape, self.dtype.str
+
+    def __setstate__(self, state):
+        self.path, self.shape, dtype = state
+        self.dtype = np.dtype(dtype)
+
+    @property
+    def nbytes(self):
+        return int(np.prod(self.shape, dtype=np.int64)) * self.dtype.itemsize
+
+    def open(self, mode='r+'):
+        """Map the segment; 'r+' writes through to every process that has it open."""
+        return np.load(self.path, mmap_mode=mode)
+
+    def take(self, mode='r+'):
+        """
+        Map the segment and unlink its file: the returned array owns the memory
+        from now on (copy-on-write with mode='c'). Call at most once per handle.
+        """
+        array = self.open(mode)
+        self.unlink()
+        return array
+
+    def unlink(self):
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        except PermissionError:
+            pass  # still mapped on Windows; the pool directory goes on close()
+
+    def __repr__(self):
+        return f"SharedArray({os.path.basename(self.path)}, shape={self.shape}, dtype={self.dtype})"
+
+def as_array(data, mode='r'):
+    """`data` as an array: SharedArray handles are mapped (not taken), arrays pass through."""
+    return data.open(mode) if isinstance(data, SharedArray) else data
+
+class SharedPool:
+    """
+    Directory of segment files. The pool object pickles as its directory,
+    so worker processes can create segments the parent owns.
+    """
+
+    def __init__(self, root=None):
+        self.root = root or _default_root()
+        self.path = None
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        return {'root': self.root, 'path': self._directory()}
+
+    def __setstate__(self, state):
+        self.__init__(state['root'])
+        self.path = state['path']
+
+    def _directory(self):
+        with self._lock:
+            if self.path is None:
+                self.sweep()
+                self.path = tempfile.mkdtemp(prefix=f"{POOL_PREFIX}{os.getpid()}-", dir=self.root)
+                atexit.register(self.close)
+            return self.path
+
+    def allocate(self, shape, dtype=np.float64):
+        """A new zero-filled segment. :return: SharedArray handle."""
+        name = f"{os.getpid()}-{next(self._counter)}-{uuid.uuid4().hex[:8]}.npy"
+        path = os.path.join(self._directory(), name)
+        np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=tuple(shape))
+        return SharedArray(path, shape, dtype)
+
+    def share(self, array):
+        """Copy `array` into a new segment. :return: SharedArray handle."""
+        array = np.asarray(array)
+        handle = self.allocate(array.shape, array.dtype)
+        target = handle.open('r+')
+        target[...] = array
+        target.flush()
+        del target
+        return handle
+
+    def reap(self):
+        """Remove segments whose creating process has exited without them being taken."""
+        if self.path is None:
+            return 0
+        removed = 0
+        for name in os.listdir(self.path):
+            pid = _owner(name)
+            if pid is not None and not _alive(pid):
+                SharedArray(os.path.join(self.path, name), (), np.uint8).unlink()
+                removed += 1
+        if removed:
+            print(f"[WARN] shared pool: removed {removed} segments of exited workers")
+        return removed
+
+    def sweep(self):
+        """Remove pool directories left behind by processes that are gone."""
+        try:
+            names = os.listdir(self.root)
+        except OSError:
+            return
+        for name in names:
+            pid = _owner(name, POOL_PREFIX)
+            if pid is not None and pid != os.getpid() and not _alive(pid):
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+
+    def close(self):
+        """Remove the pool directory and every segment not yet taken."""
+        with self._lock:
+            if self.path is not None:
+                shutil.rmtree(self.path, ignore_errors=True)
+                self.path = None
+
+shared_pool = SharedPool()
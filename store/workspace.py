@@ -0,0 +1,187 @@
+"""
+Reusable scratch arrays for the generation kernels.
+
+Every diamond-square level and erosion iteration needs several temporaries
+the size of the map; allocating them fresh costs page faults and allocator
+churn that grow with the map (gigabytes per run at 4097x4097). Kernels borrow
+them from a Workspace instead: buffers given back are kept per (shape, dtype)
+and handed out again by the next request for that shape, later in the same
+iteration, in the next iteration or in the next run. Borrowed buffers are
+not initialized. A buffer the caller keeps (a result) is simply never given
+back; the pool only knows its free buffers.
+
+Free buffers beyond `limit` bytes are dropped, least recently given back
+first. The counters (`stats`) report what each run allocated, so allocation
+regressions show up as numbers; `measure` adds peak traced memory and page
+faults:
+
+    python -m store.workspace --size 2049 --runs 3
+"""
+import argparse
+import contextlib
+import io
+import os
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+
+ENV = 'DSGUI_WORKSPACE_MB'
+LIMIT = int(os.environ.get(ENV, 2048)) * 2**20
+
+class Workspace:
+    """
+    Pool of free arrays keyed by (shape, dtype). Thread-safe; a buffer is
+    only ever handed to one borrower at a time.
+    """
+
+    def __init__(self, limit=LIMIT):
+        self.limit = limit
+        self.enabled = True         # False: every take allocates, give drops (for comparisons)
+        self._lock = threading.Lock()
+        self._free = {}             # (shape, dtype) -> [array]
+        self._order = OrderedDict() # id(array) -> (key, array), least recently given back first
+        self._free_bytes = 0
+        self.reset_stats()
+
+    @staticmethod
+    def _key(shape, dtype):
+        return tuple(int(n) for n in shape), np.dtype(dtype).str
+
+    def take(self, shape, dtype=np.float64):
+        """An uninitialized C-contiguous array of `shape` and `dtype`, reused if a free one fits."""
+        key = self._key(shape, dtype)
+        with self._lock:
+            free = self._free.get(key)
+            if self.enabled and free:
+                array = free.pop()
+                del self._order[id(array)]
+                self._free_bytes -= array.nbytes
+                self.reused += array.nbytes
+                return array
+        array = np.empty(key[0], dtype=key[1])
+        with self._lock:
+            self.allocated += array.nbytes
+            self.allocations += 1
+        return array
+
+    def zeros(self, shape, dtype=np.float64):
+        array = self.take(shape, dtype)
+        array.fill(0)
+        return array
+
+    def give(self, *arrays):
+        """Return buffers from `take` to the pool (None is ignored). They must not be used afterwards."""
+        if not self.enabled:
+            return
+        with self._lock:
+            for array in arrays:
+                if array is None or id(array) in self._order:
+                    continue
+                key = self._key(array.shape, array.dtype)
+                self._free.setdefault(key, []).append(array)
+                self._order[id(array)] = (key, array)
+                self._free_bytes += array.nbytes
+            while self._free_bytes > self.limit and self._order:
+                _, (key, array) = self._order.popitem(last=False)
+                self._free[key].remove(array)
+                self._free_bytes -= array.nbytes
+
+    @contextmanager
+    def borrow(self, *specs):
+        """`with workspace.borrow(shape, (shape, bool)) as (a, mask):` buffers given back on exit."""
+        arrays = [self.take(*spec) if spec and isinstance(spec[0], tuple) else self.take(spec) for spec in specs]
+        try:
+            yield arrays
+        finally:
+            self.give(*arrays)
+
+    def clear(self):
+        """Drop every free buffer."""
+        with self._lock:
+            self._free = {}
+            self._order = OrderedDict()
+            self._free_bytes = 0
+
+    # --- accounting -------------------------------------------------------
+
+    def reset_stats(self):
+        self.allocated = 0      # bytes of new buffers
+        self.allocations = 0
+        self.reused = 0         # bytes handed out again from the pool
+
+    def stats(self):
+        """Counters since the last reset: bytes allocated and reused, allocations, bytes held free."""
+        with self._lock:
+            return {
+                'allocated': self.allocated, 'allocations': self.allocations,
+                'reused': self.reused, 'free': self._free_bytes,
+            }
+
+workspace = Workspace()
+
+def _minor_faults():
+    try:
+        import resource
+    except ImportError:  # not on Windows
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_minflt
+
+@contextmanager
+def measure(pool=workspace):
+    """
+    Allocation report of the enclosed block, filled in on exit: bytes the
+    pool allocated and reused, the peak of traced memory (tracemalloc, which
+    sees NumPy's buffers too) and the minor page faults of the process.
+    """
+    report = {}
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    before = pool.stats()
+    faults = _minor_faults()
+    start = time.perf_counter()
+    try:
+        yield report
+    finally:
+        after = pool.stats()
+        report.update(
+            seconds=time.perf_counter() - start,
+            allocated=after['allocated'] - before['allocated'],
+            reused=after['reused'] - before['reused'],
+            peak=tracemalloc.get_traced_memory()[1],
+            faults=_minor_faults() - faults,
+        )
+        if not tracing:
+            tracemalloc.stop()
+
+def format_report(report):
+    mib = 2**20
+    return (f"{report['seconds']:6.2f}s  pool allocated {report['allocated'] / mib:8.1f} MiB, "
+            f"reused {report['reused'] / mib:8.1f} MiB  peak {report['peak'] / mib:8.1f} MiB  "
+            f"page faults {report['faults']:>8}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=1025)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--no-pool', action='store_true', help="allocate every buffer fresh, for comparison")
+    args = parser.parse_args(argv)
+
+    from generate.ds.terrain import make
+    # Run as a script this module is __main__; the kernels use the pool of store.workspace
+    from store.workspace import measure, workspace
+
+    workspace.enabled = not args.no_pool
+    print(f"[INFO] workspace: make(size={args.size}) x {args.runs}, pool {'off' if args.no_pool else 'on'}")
+    for run in range(args.runs):
+        with measure() as report, contextlib.redirect_stdout(io.StringIO()):
+            make(size=args.size, seed=run)
+        print(f"[INFO]   run {run + 1}: {format_report(report)}")
+
+if __name__ == '__main__':
+    main()
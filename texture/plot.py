@@ -1,4 +1,4 @@
-from kivy.graphics.texture import Texture
+import time
 
 import numpy as np
 
@@ -125,6 +125,59 @@ def grayscale_centered(array, border_width=1, **kwargs):
 
     return image
 
+i = int(51) # 1/5 of 255, 0-5i
+
+TERRAIN_COLORS = [
+    [1*i, 1*i, 3*i, 5*i], # Dark blue   (deep water)
+    [0*i, 3*i, 5*i, 5*i], # Blue        (shallow water)
+    [0*i, 4*i, 2*i, 5*i], # Green       (lowlands)
+    [5*i, 5*i, 3*i, 5*i], # Yellow      (higher elevation)
+    [3*i, 2*i, 1*i, 5*i], # Brown       (mountains)
+    [5*i, 5*i, 5*i, 5*i], # White       (snow-capped peaks)
+]
+del i
+
+# Hydrology overlays, drawn over the colormap where the layer mask is set
+OVERLAY_COLORS = {
+    'lake' : [40, 90, 200, 255],
+    'river': [30, 60, 170, 255],
+}
+
+_terrain_lut = None
+
+def terrain_lut():
+    """
+    Return the cached (256, 4) uint8 lookup table for the terrain colormap.
+    """
+    global _terrain_lut
+    if _terrain_lut is None:
+        _terrain_lut = generate_gradient(TERRAIN_COLORS)
+    return _terrain_lut
+
+def colored_rgba(array, value_range=None):
+    """
+    Numpy array to a C-contiguous (H, W, 4) uint8 RGBA array using the terrain colormap.
+    A (B, H, W) batch of maps gives (B, H, W, 4), each map normalized to its own range.
+
+    :param array: 2D numpy array, already cropped to the area that should be colored.
+    :param value_range: Optional (min, max) used for normalization instead of the array's own range.
+    :return: RGBA array whose buffer can be handed to the texture as-is.
+    """
+    if value_range is not None:
+        lo, hi = value_range
+    else:
+        lo = np.min(array, axis=(-2, -1), keepdims=True)
+        hi = np.max(array, axis=(-2, -1), keepdims=True)
+    span = hi - lo
+    span = np.where(span == 0, 1.0, span)
+
+    # Normalize into LUT indices [0, 255] without keeping float intermediates around
+    index = np.subtract(array, lo, dtype=np.float64)
+    np.multiply(index, 255.0 / span, out=index)
+    np.clip(index, 0, 255, out=index)
+
+    return np.take(terrain_lut(), index.astype(np.uint8), axis=0)
+
 def colored(array):
     """
     Numpy array to colored PNG using a custom colormap.
@@ -133,52 +186,229 @@ def colored(array):
     # Unknown fix for array edge trash (TODO: fix)
     array = remove_padding(array)
 
-    # Normalize the array to the range [0, 1]
-    norm_array = normalize_array(array)
+    # Convert to PIL image
+    return Image.fromarray(colored_rgba(array), 'RGBA')
 
-    # Define the color gradient: steps list
-    i = int(51) # 1/5 of 255, 0-5i
+def overlay_layers(rgba, layers, y0=0, x0=0, pad_width=1):
+    """
+    Paint the masks in `layers` (as stored in the data buffer, padded like the
+    heightmap) over `rgba`, which covers the unpadded area starting at (y0, x0).
+    """
+    height, width = rgba.shape[:2]
+    for name, color in OVERLAY_COLORS.items():
+        mask = layers.get(name)
+        if mask is None:
+            continue
+        mask = remove_padding(mask, pad_width)[y0:y0 + height, x0:x0 + width]
+        rgba[mask] = color
+    return rgba
 
-    matplotlib_terrain = [
-        [1*i, 1*i, 3*i, 5*i], # Dark blue   (deep water)
-        [0*i, 3*i, 5*i, 5*i], # Blue        (shallow water)
-        [0*i, 4*i, 2*i, 5*i], # Green       (lowlands)
-        [5*i, 5*i, 3*i, 5*i], # Yellow      (higher elevation)
-        [3*i, 2*i, 1*i, 5*i], # Brown       (mountains)
-        [5*i, 5*i, 5*i, 5*i], # White       (snow-capped peaks)
-    ]
+class _TextureSlot:
+    """Persistent texture of one widget plus the value range it was colored with."""
 
-    colors = generate_gradient(matplotlib_terrain)
+    def __init__(self, texture, value_range):
+        self.texture = texture
+        self.value_range = value_range
 
-    # Map array values to color indices
-    colormap = np.array([colors[int(val * 255)] for val in norm_array.flatten()])
-    colormap = colormap.reshape((array.shape[0], array.shape[1], 4))
+# maps widget id -> _TextureSlot
+_textures = {}
 
-    # Convert to PIL image
-    image = Image.fromarray(colormap.astype('uint8'), 'RGBA')
-    return image
+def _blit(texture, rgba, pos=(0, 0)):
+    """Upload a contiguous RGBA array into `texture` at `pos` (x, y)."""
+    height, width = rgba.shape[:2]
+    texture.blit_buffer(
+        rgba.reshape(-1), pos=pos, size=(width, height),
+        colorfmt='rgba', bufferfmt='ubyte'
+    )
+
+def texture_from_rgba(rgba):
+    """New nearest-filtered texture holding a contiguous (H, W, 4) uint8 array."""
+    from kivy.graphics.texture import Texture
+    texture = Texture.create(size=(rgba.shape[1], rgba.shape[0]), colorfmt='rgba')
+    texture.mag_filter = 'nearest'
+    texture.min_filter = 'nearest'
+    _blit(texture, rgba)
+    return texture
 
-def plot():
+def _texture_region(region, shape, pad_width=1):
     """
-    from buffer: numpy array to Kivy texture
-    :return: Texture object
+    Translate a (y0, y1, x0, x1) heightmap region into texture coordinates,
+    accounting for the padding stripped by `colored`. Returns None if empty.
+    """
+    y0, y1, x0, x1 = region
+    height, width = shape
+    y0, y1 = max(y0 - pad_width, 0), min(y1 - pad_width, height)
+    x0, x1 = max(x0 - pad_width, 0), min(x1 - pad_width, width)
+    if y0 >= y1 or x0 >= x1:
+        return None
+    return y0, y1, x0, x1
+
+def _texture_slot(widget_id, size):
+    """The persistent texture of `widget_id`, recreated if its size (width, height) changed."""
+    slot = _textures.get(widget_id)
+    if slot is None or tuple(slot.texture.size) != size:
+        from kivy.graphics.texture import Texture
+
+        texture = Texture.create(size=size, colorfmt='rgba')
+
+        # Disable smoothing
+        texture.mag_filter = 'nearest'
+        texture.min_filter = 'nearest'
+
+        slot = _textures[widget_id] = _TextureSlot(texture, None)
+    return slot
+
+class PreparedFrame:
+    """
+    A heightmap colored for `widget_id` (overlays included) that only has to
+    be uploaded: built by `prepare_plot` on any thread, shown by `upload_plot`.
     """
+
+    def __init__(self, widget_id, rgba, value_range):
+        self.widget_id = widget_id
+        self.rgba = rgba
+        self.value_range = value_range
+
+def prepare_plot(widget_id='asp_texture', array=None):
+    """
+    CPU half of `plot`, safe to run on a worker thread: normalization, LUT
+    mapping and overlays of the buffered heightmap (or `array`) into an RGBA array.
+    :return: PreparedFrame, or None if there is nothing to plot.
+    """
+    layers = data_buffer.layers if array is None else {}
     try:
-        array = data_buffer.get()
+        array = data_buffer.get() if array is None else array
         if array is None or array.size == 0:
             raise ValueError("Data buffer is empty")
     except Exception as e:
         print(f"Exception at plot: {str(e)}")
         return None  # Early return if no valid array
 
-    image = colored(array)
-    image_data = image.tobytes()
+    # Unknown fix for array edge trash (TODO: fix)
+    inner = remove_padding(array)
+    value_range = (float(np.min(inner)), float(np.max(inner)))
+    rgba = overlay_layers(colored_rgba(inner, value_range=value_range), layers)
+    return PreparedFrame(widget_id, rgba, value_range)
 
-    texture = Texture.create(size=image.size, colorfmt='rgba')
-    texture.blit_buffer(image_data, colorfmt='rgba', bufferfmt='ubyte')
+class _Upload:
+    """A PreparedFrame being copied into its texture band by band, see `upload_plot`."""
 
-    # Disable smoothing
-    texture.mag_filter = 'nearest'
-    texture.min_filter = 'nearest'
+    # Rows of the first band are chosen for about this many bytes, later ones from measured speed
+    FIRST_BAND_BYTES = 1 << 20
 
-    return texture
+    def __init__(self, frame, slot, callback, budget_ms):
+        self.frame = frame
+        self.slot = slot
+        self.callback = callback
+        self.budget = budget_ms / 1000
+        self.row = 0
+        height, width = frame.rgba.shape[:2]
+        self.band = height if budget_ms <= 0 else max(1, self.FIRST_BAND_BYTES // (width * 4))
+
+    def step(self, dt=None):
+        """Upload bands until the frame budget is used up; True once the whole frame is in."""
+        if _uploads.get(self.frame.widget_id) is not self:
+            return True  # replaced by a newer upload
+        rgba = self.frame.rgba
+        start = time.perf_counter()
+        while self.row < rgba.shape[0]:
+            band_start = time.perf_counter()
+            end = min(self.row + self.band, rgba.shape[0])
+            _blit(self.slot.texture, rgba[self.row:end], pos=(0, self.row))
+            rows, self.row = end - self.row, end
+
+            if self.budget > 0:
+                now = time.perf_counter()
+                # next bands take about half the budget at the speed just measured
+                self.band = max(1, int(rows / max(now - band_start, 1e-6) * self.budget / 2))
+                if now - start >= self.budget:
+                    break
+
+        if self.row < rgba.shape[0]:
+            from kivy.clock import Clock
+            Clock.schedule_once(self.step, 0)
+            return False
+
+        del _uploads[self.frame.widget_id]
+        if self.callback:
+            self.callback(self.slot.texture)
+        return True
+
+# maps widget id -> _Upload still in progress
+_uploads = {}
+
+def upload_plot(frame, callback=None, budget_ms=None):
+    """
+    GPU half of `plot`, on the main thread: copy a PreparedFrame into the
+    persistent texture of its widget. What does not fit into `budget_ms`
+    (default: the 'upload_budget_ms' setting, 0 = no limit) is uploaded in row
+    bands over the next frames, so large maps never stall the window; a
+    texture already on screen fills in band by band meanwhile.
+    `callback(texture)` is called once the frame is complete (right away if it
+    fit), or with None if `frame` is None. A newer upload for the same widget
+    replaces one still in progress.
+    """
+    if frame is None:
+        if callback:
+            callback(None)
+        return None
+    if budget_ms is None:
+        from settings.store import settings
+        budget_ms = settings.get('upload_budget_ms') or 0
+
+    rgba = frame.rgba
+    slot = _texture_slot(frame.widget_id, (rgba.shape[1], rgba.shape[0]))
+    slot.value_range = frame.value_range
+
+    upload = _uploads[frame.widget_id] = _Upload(frame, slot, callback, budget_ms)
+    upload.step()
+    return slot.texture
+
+def finish_upload(widget_id='asp_texture'):
+    """Complete a band upload of `widget_id` still in progress right away."""
+    upload = _uploads.get(widget_id)
+    if upload is not None:
+        upload.budget = 0
+        upload.band = upload.frame.rgba.shape[0]
+        upload.step()
+
+def plot(widget_id='asp_texture', region=None, array=None):
+    """
+    from buffer: numpy array to Kivy texture, in one go on the calling (main) thread
+
+    The texture of `widget_id` is kept and reused while its size is unchanged.
+    If `region` (y0, y1, x0, x1 in heightmap coordinates) is given, only that
+    sub-rectangle is recolored and uploaded.
+    `array` plots a heightmap that is not in the buffer (e.g. a preview).
+    River and lake layers stored next to the buffered heightmap are drawn on top.
+    Whole maps from worker threads go through `prepare_plot` / `upload_plot` instead.
+    :return: Texture object
+    """
+    if region is None:
+        _uploads.pop(widget_id, None)
+        return upload_plot(prepare_plot(widget_id, array), budget_ms=0)
+
+    finish_upload(widget_id)  # the region is recolored over the finished frame
+    source = array
+    layers = data_buffer.layers if array is None else {}
+    try:
+        array = data_buffer.get() if array is None else array
+        if array is None or array.size == 0:
+            raise ValueError("Data buffer is empty")
+    except Exception as e:
+        print(f"Exception at plot: {str(e)}")
+        return None  # Early return if no valid array
+
+    # Unknown fix for array edge trash (TODO: fix)
+    inner = remove_padding(array)
+    slot = _textures.get(widget_id)
+    if slot is None or tuple(slot.texture.size) != (inner.shape[1], inner.shape[0]):
+        return plot(widget_id, array=source)
+
+    region = _texture_region(region, inner.shape)
+    if region is None:
+        return slot.texture
+    y0, y1, x0, x1 = region
+    rgba = colored_rgba(inner[y0:y1, x0:x1], value_range=slot.value_range)
+    _blit(slot.texture, overlay_layers(rgba, layers, y0, x0), pos=(x0, y0))
+    return slot.texture
@@ -2,27 +2,7 @@ from kivy.uix.gridlayout import GridLayout
 from kivy.uix.button import Button
 
 class N_Buttons(GridLayout):
-    _instances = {}  # maps id -> instance
-
-    def __new__(cls, **kwargs):
-        kivy_id = kwargs.get('id')
-        if kivy_id and kivy_id in cls._instances:
-            existing_instance = cls._instances[kivy_id]
-            parent = existing_instance.parent
-            if parent:
-                parent.remove_widget(existing_instance)
-            del cls._instances[kivy_id]
-
-        instance = super().__new__(cls)
-        if kivy_id:
-            cls._instances[kivy_id] = instance
-        return instance
-
     def __init__(self, button_data=None, **kwargs):
-        # Avoid reinitialization
-        if getattr(self, '_initialized', False):
-            return
-
         # button_data should be a list of tuples: (button_name, button_action)
         if button_data is None:
             button_data = []
@@ -35,20 +15,31 @@ class N_Buttons(GridLayout):
                 btn.bind(on_press=lambda instance, act=action: act())
             self.add_widget(btn)
 
-        self._initialized = True
+# Import the generation stack on first use, not while building the UI
+def _generate_async():
+    from generate.main import generate_async
+    return generate_async()
+
+def _erode_more_async():
+    from generate.main import erode_more_async
+    return erode_more_async()
+
+def _save_archive_async():
+    from generate.main import save_archive_async
+    return save_archive_async()
 
 class ActionButtons(N_Buttons):
     def __init__(self, 
                  btn_1_name='Reset', btn_1_action=None, 
-                 btn_2_name='Generate', btn_2_action=None, 
-                 btn_3_name='Save', btn_3_action=None, 
+                 btn_2_name='Generate', btn_2_action=_generate_async, 
+                 btn_3_name='Save', btn_3_action=_save_archive_async, 
+                 btn_4_name='Erode +', btn_4_action=_erode_more_async,
                  **kwargs):
-        
-        from generate.main import generate_async as btn_2_action
 
         button_data = [
             (btn_1_name, btn_1_action),
             (btn_2_name, btn_2_action),
+            (btn_4_name, btn_4_action),
             (btn_3_name, btn_3_action)
         ]
         
@@ -6,11 +6,12 @@ from kivy.clock import Clock
 
 import ui.widgets.sliders, ui.widgets.selectors, ui.widgets.toggles
 from settings.store import settings
+from utils.startup import load_kv
 
 import os
 kv_dir = os.path.join(os.path.dirname(__file__))
 KV_PATH = os.path.join(kv_dir, "content.kv")
-Builder.load_file(KV_PATH)
+load_kv(KV_PATH)
 
 class ContentWidget(BoxLayout):
     def __init__(self, **kwargs):
@@ -20,13 +21,26 @@ class ContentWidget(BoxLayout):
     def populate(self):
         # Adding the dynamic widgets based on the settings
         self.ids.initial_terrain_slider.setting_key = 'initial_terrain'
+        self.ids.terrain_width_slider.setting_key = 'terrain_width'
+        self.ids.terrain_height_slider.setting_key = 'terrain_height'
         self.ids.roughness_float_slider.setting_key = 'roughness_float'
         self.ids.boundary_type_selector.setting_key = 'boundary_type'
         self.ids.erosion_toggle.setting_key = 'erosion'
+        self.ids.hydrology_toggle.setting_key = 'hydrology'
+        self.ids.flow_method_selector.setting_key = 'flow_method'
+        self.ids.contour_levels_slider.setting_key = 'contour_levels'
+        self.ids.brush_selector.setting_key = 'brush'
+        self.ids.brush_radius_slider.setting_key = 'brush_radius'
+        self.ids.brush_strength_slider.setting_key = 'brush_strength'
 
         # Set values dynamically for the sliders (you can adjust this as needed)
         self.ids.initial_terrain_slider.set_value(settings.get('initial_terrain', 129))
+        self.ids.terrain_width_slider.set_value(settings.get('terrain_width', 0))
+        self.ids.terrain_height_slider.set_value(settings.get('terrain_height', 0))
         self.ids.roughness_float_slider.set_value(settings.get('roughness_float', 0.7))
+        self.ids.contour_levels_slider.set_value(settings.get('contour_levels', 0))
+        self.ids.brush_radius_slider.set_value(settings.get('brush_radius', 16))
+        self.ids.brush_strength_slider.set_value(settings.get('brush_strength', 0.5))
 
         # Initialize the edge sliders
         for i in range(4):
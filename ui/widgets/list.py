@@ -1,14 +1,18 @@
-#TODO: WORK IN PROGRESS
-# IS NOT IMPLEMENTED
-
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.popup import Popup
 from kivy.uix.togglebutton import ToggleButton
 from kivy.uix.button import Button
+from kivy.uix.behaviors import ButtonBehavior
+from kivy.uix.image import Image
 from kivy.uix.label import Label
 from kivy.uix.scrollview import ScrollView
 from kivy.uix.gridlayout import GridLayout
-from kivy.properties import StringProperty, ObjectProperty, ListProperty
+from kivy.properties import StringProperty, ObjectProperty, ListProperty, DictProperty
+from kivy.clock import Clock
+from kivy.metrics import dp
+
+from settings.store import settings, canonical_hash
+from generate.params import SWEEP_AXES
 
 
 class ExpandablePresetList(BoxLayout):
@@ -52,3 +56,199 @@ class ExpandablePresetList(BoxLayout):
         selected = [[name] for name, btn in self.toggle_buttons.items() if btn.state == 'down']
         self.settings.set(self.setting_key, selected)
         popup.dismiss()
+
+
+class ThumbnailButton(ButtonBehavior, BoxLayout):
+    cell = DictProperty()
+
+    def __init__(self, cell, **kwargs):
+        super().__init__(orientation='vertical', **kwargs)
+        self.cell = cell
+        self.image = Image(fit_mode='contain')
+        self.add_widget(self.image)
+        self.add_widget(Label(
+            text=', '.join(f'{k}={v}' for k, v in cell.items()),
+            font_size='11sp', size_hint_y=None, height=dp(18)
+        ))
+
+
+class SweepExplorer(ExpandablePresetList):
+    """
+    Pick one or two parameters from the preset list and get a grid of
+    low-resolution thumbnails rendered concurrently with the current seed.
+    Clicking a thumbnail applies its values and starts the full-resolution run.
+    """
+    MAX_AXES = 2
+
+    def __init__(self, **kwargs):
+        super().__init__(orientation='vertical', **kwargs)
+        self.available_presets = list(SWEEP_AXES)
+        self._axes = []         # selected keys in click order
+        self._thumbs = {}       # hash of cell -> ThumbnailButton
+        self._sweep = 0         # token of the sweep the grid shows
+        self._seed = None
+        self._popup = None
+        self._queued = None     # promotion waiting for a running generation, see _start_promoted
+
+        btn = Button(text="Parameter sweep...")
+        btn.bind(on_press=lambda _: self.open_popup())
+        self.add_widget(btn)
+
+    def open_popup(self):
+        from generate.sweep import sweep_runner
+
+        content = BoxLayout(orientation='vertical', spacing=10, padding=10)
+
+        axes = GridLayout(rows=1, spacing=5, size_hint_y=None, height=dp(40))
+        self.toggle_buttons = {}
+        for key in self.available_presets:
+            btn = ToggleButton(text=key, state='down' if key in self._axes else 'normal')
+            btn.bind(state=self._on_axis)
+            axes.add_widget(btn)
+            self.toggle_buttons[key] = btn
+
+        btn_run = Button(text="Run sweep", size_hint_y=None, height=dp(40))
+        btn_run.bind(on_press=lambda _: self.run_sweep())
+
+        scroll = ScrollView()
+        self.grid = GridLayout(cols=1, spacing=5, size_hint_y=None, row_default_height=dp(160))
+        self.grid.bind(minimum_height=self.grid.setter('height'))
+        scroll.add_widget(self.grid)
+
+        content.add_widget(Label(text="Select up to two parameters", size_hint_y=None, height=dp(30)))
+        content.add_widget(axes)
+        content.add_widget(btn_run)
+        content.add_widget(scroll)
+
+        self._popup = Popup(title="Parameter sweep", content=content, size_hint=(0.9, 0.9))
+        self._popup.bind(on_dismiss=lambda *_: sweep_runner.cancel())
+        self._popup.open()
+
+    def _on_axis(self, btn, state):
+        key = btn.text
+        if state == 'down' and key not in self._axes:
+            self._axes.append(key)
+            if len(self._axes) > self.MAX_AXES:
+                self.toggle_buttons[self._axes[0]].state = 'normal'
+        elif state == 'normal' and key in self._axes:
+            self._axes.remove(key)
+
+    def run_sweep(self):
+        from generate.params import current_seed
+        from generate.sweep import sweep_grid, sweep_runner
+
+        if not self._axes:
+            return
+        cells = sweep_grid(*self._axes)
+
+        self.grid.clear_widgets()
+        self.grid.cols = len(cells[0])
+        self._thumbs = {}
+        for row in cells:
+            for cell in row:
+                thumb = ThumbnailButton(cell)
+                thumb.bind(on_press=self._promote)
+                self.grid.add_widget(thumb)
+                self._thumbs[canonical_hash(cell)] = thumb
+
+        self._seed = current_seed()
+        self._sweep += 1
+        sweep = self._sweep
+        sweep_runner.run(
+            settings.snapshot(), cells, self._seed, lambda cell, array: self._on_result(sweep, cell, array)
+        )
+
+    def _on_result(self, sweep, cell, array):
+        # Called from the pool's callback thread: color here, upload on the main thread
+        from texture.plot import colored_rgba, remove_padding
+        rgba = colored_rgba(remove_padding(array))
+        Clock.schedule_once(lambda dt: self._show(sweep, cell, rgba))
+
+    def _show(self, sweep, cell, rgba):
+        from texture.plot import texture_from_rgba
+        if sweep != self._sweep:
+            return  # from a sweep the grid no longer shows, whose cells may share keys with this one
+        thumb = self._thumbs.get(canonical_hash(cell))
+        if thumb is not None:
+            thumb.image.texture = texture_from_rgba(rgba)
+
+    def _promote(self, thumb):
+        with settings.batch():
+            for key, value in thumb.cell.items():
+                settings.set(key, value)
+            settings.set('seed', self._seed)
+
+        if self._popup:
+            self._popup.dismiss()
+        if self._queued is not None:
+            self._queued.cancel()  # an earlier pick still waiting: the settings now hold this one
+        self._start_promoted()
+
+    def _start_promoted(self, dt=None):
+        """Start the full-resolution run; while another generation runs, try again shortly."""
+        from generate.main import generate_async, generate_ds, is_busy
+
+        self._queued = None
+        if is_busy():
+            if dt is None:
+                print("[INFO] sweep: a generation is running, the selected cell starts when it finishes")
+            self._queued = Clock.schedule_once(self._start_promoted, 0.25)
+            return
+        generate_async(task=lambda: generate_ds(reseed=False))
+
+
+class HistoryBrowser(BoxLayout):
+    """
+    Button that opens the generation history (store.history) as a grid of
+    thumbnails, read from their small PNG files only. Clicking one restores
+    its settings and loads its full map from the archive.
+    """
+    LIMIT = 200
+
+    def __init__(self, **kwargs):
+        super().__init__(orientation='vertical', **kwargs)
+        self._popup = None
+
+        btn = Button(text="History...")
+        btn.bind(on_press=lambda _: self.open_popup())
+        self.add_widget(btn)
+
+    def open_popup(self):
+        from store.history import history
+
+        content = BoxLayout(orientation='vertical', spacing=10, padding=10)
+        scroll = ScrollView()
+        grid = GridLayout(cols=4, spacing=5, size_hint_y=None, row_default_height=dp(160))
+        grid.bind(minimum_height=grid.setter('height'))
+
+        entries = history.entries(self.LIMIT)
+        for entry in entries:
+            thumb = ThumbnailButton({
+                'seed': entry['seed'],
+                'size': f"{entry['width']}x{entry['height']}",
+                **({'erosion': '+' + '+'.join(map(str, entry['erosion'].values()))} if entry['erosion'] else {}),
+            })
+            thumb.image.source = history.thumbnail_path(entry['key'])
+            thumb.bind(on_press=lambda _, entry=entry: self._open(entry))
+            grid.add_widget(thumb)
+        scroll.add_widget(grid)
+
+        content.add_widget(Label(
+            text=f"{len(entries)} maps, {history.nbytes() / 2**20:.1f} MiB" if entries else "Nothing generated yet",
+            size_hint_y=None, height=dp(30)
+        ))
+        content.add_widget(scroll)
+
+        self._popup = Popup(title="Generation history", content=content, size_hint=(0.9, 0.9))
+        self._popup.open()
+
+    def _open(self, entry):
+        from generate.main import load_history_async
+
+        with settings.batch():
+            for key, value in entry['settings'].items():
+                settings.set(key, value)
+
+        if self._popup:
+            self._popup.dismiss()
+        load_history_async(entry['key'])
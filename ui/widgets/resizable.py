@@ -1,40 +1,23 @@
 from kivy.uix.widget import Widget
-from kivy.graphics import Rectangle, Color
+from kivy.graphics import Rectangle, Color, Mesh, InstructionGroup, PushMatrix, PopMatrix, Translate, Scale
 from kivy.graphics.texture import Texture
 from kivy.properties import ObjectProperty
 
 class AspectRatioTextureWidget(Widget):
-    _instances = {}  # map id -> widget instance
-
     texture = ObjectProperty(None, allownone=True)
 
-    def __new__(cls, **kwargs):
-        kivy_id = kwargs.get('id')
-        if kivy_id and kivy_id in cls._instances:
-            existing_instance = cls._instances[kivy_id]
-            parent = existing_instance.parent
-            if parent:
-                parent.remove_widget(existing_instance)
-            del cls._instances[kivy_id]
-
-        instance = super().__new__(cls)
-        if kivy_id:
-            cls._instances[kivy_id] = instance
-        return instance
-
     def __init__(self, texture=None, **kwargs):
-        if getattr(self, '_initialized', False):
-            return
         super().__init__(**kwargs)
         self.texture = texture or self._default_texture()
         self.rect = None
+        self._contours = None       # InstructionGroup drawing contour lines in canvas.after
+        self._contour_transform = None
 
         with self.canvas:
             Color(1, 1, 1, 1)
             self.rect = Rectangle(pos=self.pos, size=self.size, texture=self.texture)
 
         self.bind(pos=self._update_rect, size=self._update_rect, texture=self._update_texture)
-        self._initialized = True
 
     def _default_texture(self):
         tex = Texture.create(size=(1, 1), colorfmt='rgba')
@@ -62,12 +45,117 @@ class AspectRatioTextureWidget(Widget):
 
         self.rect.size = (width, height)
         self.rect.pos = (x, y)
+        self._place_contours()
 
     def _update_texture(self, new_texture, *args):
         if self.rect:
             self.rect.texture = new_texture
             self.canvas.ask_update()
 
+    # Kivy meshes index vertices with unsigned shorts
+    MESH_VERTICES = 65535
+
+    def set_contours(self, contours=None, pad_width=1):
+        """
+        Draw contour lines (export.contours.Contours, in heightmap cells) over
+        the texture as batched line meshes; None removes them.
+        """
+        if self._contours is not None:
+            self.canvas.after.remove(self._contours)
+            self._contours = self._contour_transform = None
+        if contours is None or not len(contours.points):
+            return
+
+        import numpy as np
+
+        points = contours.points
+        # segment i -> i + 1 unless i is the last point of its chain
+        last = np.zeros(len(points), dtype=bool)
+        last[contours.offsets[1:] - 1] = True
+        starts = np.flatnonzero(~last)
+
+        group = InstructionGroup()
+        group.add(Color(0.15, 0.1, 0.05, 0.8))
+        group.add(PushMatrix())
+        translate, scale = Translate(), Scale()
+        group.add(translate)
+        group.add(scale)
+
+        # chunks overlap by one point so every segment lies inside one chunk
+        step = self.MESH_VERTICES - 1
+        vertices = np.zeros((len(points), 4), dtype=np.float32)
+        vertices[:, :2] = points - pad_width
+        for begin in range(0, len(points) - 1, step):
+            end = min(begin + self.MESH_VERTICES, len(points))
+            chunk = starts[(starts >= begin) & (starts < end - 1)] - begin
+            if not len(chunk):
+                continue
+            indices = np.column_stack([chunk, chunk + 1]).ravel()
+            group.add(Mesh(vertices=vertices[begin:end].ravel().tolist(), indices=indices.tolist(), mode='lines'))
+        group.add(PopMatrix())
+
+        self._contours = group
+        self._contour_transform = (translate, scale)
+        self.canvas.after.add(group)
+        self._place_contours()
+
+    def _place_contours(self):
+        """Map heightmap cells (minus padding) onto the drawn texture rectangle."""
+        if self._contour_transform is None or not self.rect or not self.rect.texture:
+            return
+        translate, scale = self._contour_transform
+        tex_width, tex_height = self.rect.texture.size
+        sx, sy = self.rect.size[0] / tex_width, self.rect.size[1] / tex_height
+        # texture row 0 is drawn at the bottom, like heightmap row 0; lines run through pixel centers
+        translate.xy = (self.rect.pos[0] + 0.5 * sx, self.rect.pos[1] + 0.5 * sy)
+        scale.x, scale.y = sx, sy
+
+    def _touch_to_cell(self, touch, pad_width=1):
+        """Map a touch inside the drawn texture to (row, col) of the heightmap."""
+        if not self.rect or not self.rect.texture:
+            return None
+        x, y = self.rect.pos
+        width, height = self.rect.size
+        if width <= 0 or height <= 0 or not (x <= touch.x < x + width and y <= touch.y < y + height):
+            return None
+        tex_width, tex_height = self.rect.texture.size
+        # Texture row 0 is drawn at the bottom, matching heightmap row 0
+        col = int((touch.x - x) / width * tex_width) + pad_width
+        row = int((touch.y - y) / height * tex_height) + pad_width
+        return row, col
+
+    def _brush(self, touch):
+        cell = self._touch_to_cell(touch)
+        if cell is None:
+            return False
+        from generate.main import brush_stroke
+        texture = brush_stroke(*cell, stroke=touch.ud.setdefault('brush', {}))
+        if texture is None:
+            return False
+        self.update_texture(texture)
+        return True
+
+    def on_touch_down(self, touch):
+        if self._brush(touch):
+            touch.grab(self)
+            return True
+        return super().on_touch_down(touch)
+
+    def on_touch_move(self, touch):
+        if touch.grab_current is self:
+            self._brush(touch)
+            return True
+        return super().on_touch_move(touch)
+
+    def on_touch_up(self, touch):
+        if touch.grab_current is self:
+            touch.ungrab(self)
+            # River, lake and contour overlays are stale after the stroke edited the heightmap
+            from generate.main import overlays_async
+            overlays_async()
+            return True
+        return super().on_touch_up(touch)
+
     def update_texture(self, new_texture: Texture) -> None:
         """Update the texture externally."""
         self._update_texture(new_texture)
@@ -50,3 +50,23 @@ class StringSelector(N_Selector):
             options=['fixed', 'periodic', 'clamped'],
             **kwargs
         )
+
+class BrushSelector(N_Selector):
+    def __init__(self, **kwargs):
+        super().__init__(
+            options=['off', 'raise', 'lower', 'smooth', 'flatten', 'erode'],
+            **kwargs
+        )
+
+class FlowMethodSelector(N_Selector):
+    def __init__(self, **kwargs):
+        super().__init__(
+            options=['d8', 'dinf'],
+            **kwargs
+        )
+
+    def _on_select(self, instance):
+        super()._on_select(instance)
+        if self.settings and self.settings.get('hydrology'):
+            from generate.main import hydrology_async
+            hydrology_async()
@@ -4,6 +4,9 @@ from kivy.uix.label import Label
 from kivy.properties import StringProperty, ObjectProperty, NumericProperty, BooleanProperty
 import math
 
+from settings.store import stage_of
+from utils.preview import live_preview
+
 class SliderWidget(BoxLayout):
     setting_key = StringProperty('')
     settings = ObjectProperty(None)
@@ -17,6 +20,10 @@ class SliderWidget(BoxLayout):
         self.label = Label(font_size=self.font_size)
         self.slider = Slider(min=self.min_value, max=self.max_value)
         self.slider.bind(value=self._on_value_change)
+        self._dragging = False
+        self.slider.bind(value=self._on_drag_value,
+                         on_touch_down=self._on_slider_down,
+                         on_touch_up=self._on_slider_up)
         self.add_widget(self.label)
         self.add_widget(self.slider)
 
@@ -47,6 +54,25 @@ class SliderWidget(BoxLayout):
     def _update_label(self, value):
         self.label.text = f'{self.setting_key}: {value:.1f}'
 
+    # Live preview: only user drags request previews, not set_value()
+    def _drives_pipeline(self):
+        """Whether the setting changes the generated map; UI-only ones (e.g. the brush) must not regenerate it."""
+        return bool(self.setting_key) and stage_of(self.setting_key) is not None
+
+    def _on_slider_down(self, slider, touch):
+        if slider.collide_point(*touch.pos) and not slider.disabled:
+            self._dragging = True
+
+    def _on_drag_value(self, instance, value):
+        if self._dragging and self._drives_pipeline():
+            live_preview.request()
+
+    def _on_slider_up(self, slider, touch):
+        if self._dragging:
+            self._dragging = False
+            if self._drives_pipeline():
+                live_preview.settle()
+
     def set_value(self, value):
         # Update slider value and label
         self.slider.value = value
@@ -66,6 +92,18 @@ class IntegerSliderWidget(SliderWidget):
     def _update_label(self, value):
         self.label.text = f'{self.setting_key}: {value}'
 
+class ContourSliderWidget(IntegerSliderWidget):
+    """Number of contour levels; redraws the overlay on release instead of previewing terrain."""
+
+    def _on_drag_value(self, instance, value):
+        pass
+
+    def _on_slider_up(self, slider, touch):
+        if self._dragging:
+            self._dragging = False
+            from generate.main import contours_async
+            contours_async()
+
 class ExponentialSliderWidget(IntegerSliderWidget):
     def set_value(self, value):
         # Convert real value to slider value using log2 scale
@@ -54,3 +54,14 @@ class N_Toggle(GridLayout):
 class ErosionToggleWidget(N_Toggle):
     def __init__(self, **kwargs):
         super().__init__(options=['thermal', 'hydraulic'], **kwargs)
+
+class HydrologyToggleWidget(N_Toggle):
+    def __init__(self, **kwargs):
+        super().__init__(options=['hydrology'], **kwargs)
+
+    def _on_toggle(self, instance, value):
+        was = self.settings.get('hydrology') if self.settings else None
+        super()._on_toggle(instance, value)
+        if self.settings and self.settings.get('hydrology') != was:
+            from generate.main import hydrology_async
+            hydrology_async()
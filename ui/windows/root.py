@@ -15,6 +15,8 @@ from kivy.metrics import dp
 from kivy.factory import Factory
 
 import ui.widgets.__self__ # __init__.py in ui/widgets imports all custom widgets
+from utils.startup import load_kv
+from utils.registry import registry
 
 class RootLayoutDesktop(BoxLayout):
     pass
@@ -36,35 +38,38 @@ class RootWindow(BoxLayout):
     INTERMEDIATE_WIDTH_THRESHOLD    = 800 # dp
     MOBILE_WIDTH_THRESHOLD          = 500 # dp
 
+    LAYOUTS = {
+        'desktop'       : (RootLayoutDesktop,       'desktop.kv'),
+        'intermediate'  : (RootLayoutIntermediate,  'intermediate.kv'),
+        'mobile'        : (RootLayoutMobile,        'mobile.kv'),
+    }
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self._load_all_kv()
 
-        # Create instances of each layout
-        self.layouts = {
-            'desktop': RootLayoutDesktop(),
-            'intermediate': RootLayoutIntermediate(),
-            'mobile': RootLayoutMobile()
-        }
+        # Layout instances, each built (and its KV loaded) on first use
+        self.layouts = {}
 
         Window.bind(size=self.on_window_resize)
-        # Schedule the initial layout check after initialization 
-        # TODO: Update layout once after init with Kivy's factoryWindow.resize (or at the end of init)
-        Clock.schedule_once(lambda dt: self.check_layout_mode(Window.size), 0)
-
-
-    def _load_all_kv(self):
-        """Loads all necessary KV files at the start."""
-        kv_dir = os.path.join(os.path.dirname(__file__))
-        layout_kv_files = ['desktop.kv', 'intermediate.kv', 'mobile.kv']
-
-        for kv_file in layout_kv_files:
-            path = os.path.join(kv_dir, kv_file)
-            try:
-                Builder.load_file(path)
-                # print(f"Loaded KV: {kv_file}") # Debugging
-            except Exception as e:
-                print(f"Error loading initial KV file {path}: {e}")
+        self.check_layout_mode(Window.size)
+        self._update_layout()
+
+    def _load_kv(self, kv_file):
+        """Loads the KV file of one layout."""
+        path = os.path.join(os.path.dirname(__file__), kv_file)
+        try:
+            load_kv(path)
+            # print(f"Loaded KV: {kv_file}") # Debugging
+        except Exception as e:
+            print(f"Error loading KV file {path}: {e}")
+
+    def get_layout(self, mode):
+        """Layout instance for `mode`, built on first request."""
+        if mode not in self.layouts:
+            cls, kv_file = self.LAYOUTS[mode]
+            self._load_kv(kv_file)
+            self.layouts[mode] = cls()
+        return self.layouts[mode]
 
     def on_window_resize(self, instance, size):
         old_layout_mode = self.layout_mode
@@ -83,9 +88,19 @@ class RootWindow(BoxLayout):
 
     def _update_layout(self):
         """Clears current widgets and adds the appropriate layout instance."""
+        previous_view = registry.get('asp_texture')
+
         self.clear_widgets()
-        current_layout_widget = self.layouts[self.layout_mode]
+        current_layout_widget = self.get_layout(self.layout_mode)
         self.add_widget(current_layout_widget)
+
+        # ids like 'asp_texture' now resolve to the widgets on screen
+        registry.register_ids(current_layout_widget.ids)
+
+        # Carry the terrain over to the new layout's view
+        view = registry.get('asp_texture')
+        if previous_view is not None and view is not previous_view and previous_view.rect:
+            view.update_texture(previous_view.rect.texture)
         # print(f"Switched to layout: {self.layout_mode}") # Debugging
 
     def generate_terrain(self):
@@ -95,7 +110,7 @@ class RootWindow(BoxLayout):
         pass
 
     def start_compute_task(self, settings):
-        current_layout_widget = self.layouts[self.layout_mode]
+        current_layout_widget = self.get_layout(self.layout_mode)
         status_label = current_layout_widget.ids.get('status_label')
 
         if status_label:
@@ -0,0 +1,9 @@
+# Kernels are plain Python loops compiled with numba when it is installed;
+# without it they still run, only much slower on large maps.
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        if args and callable(args[0]):
+            return args[0]
+        return lambda func: func
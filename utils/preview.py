@@ -0,0 +1,119 @@
+import threading
+import time
+
+from kivy.clock import Clock
+
+from settings.store import settings
+from utils.update import update_widget
+
+class LivePreview:
+    """
+    Low-resolution generation while a slider is dragged.
+
+    Every value change requests a preview (at most one per PREVIEW_DELAY) at
+    one of PREVIEW_SIZES, chosen from the measured cost of the previous
+    previews so a single one stays within PREVIEW_BUDGET. Once no change
+    arrived for SETTLE_DELAY, or the slider is released, the full-resolution
+    run is started with the same seed.
+    """
+
+    PREVIEW_SIZES   = [65, 129, 257]
+    PREVIEW_DELAY   = 0.05  # seconds between previews while dragging
+    PREVIEW_BUDGET  = 0.15  # seconds one preview may take
+    SETTLE_DELAY    = 0.8   # seconds without change before the full run
+
+    def __init__(self):
+        self._preview_trigger = Clock.create_trigger(self._run_preview, self.PREVIEW_DELAY)
+        self._settle_trigger = Clock.create_trigger(self._run_full, self.SETTLE_DELAY)
+        self._thread = None
+        self._pending = False   # a change arrived while a preview was running
+        self._token = 0         # bumped by every full run, outdates previews in flight
+        self._timings = {}      # preview size -> last duration in seconds
+        self._size_index = 1
+
+    def request(self):
+        """A setting changed: preview now-ish, full run once it settles."""
+        if not settings.get('live_preview'):
+            return
+        self._preview_trigger()
+        self._settle_trigger.cancel()
+        self._settle_trigger()
+
+    def settle(self):
+        """The value is final (e.g. slider released): start the full run."""
+        if not settings.get('live_preview'):
+            return
+        self._settle_trigger.cancel()
+        self._run_full()
+
+    def _preview_busy(self):
+        return bool(self._thread and self._thread.is_alive())
+
+    def _pick_size(self):
+        from generate.params import terrain_params
+        target = terrain_params()['size']
+        sizes = [s for s in self.PREVIEW_SIZES if s < target] or [target]
+        i = min(self._size_index, len(sizes) - 1)
+
+        last = self._timings.get(sizes[i])
+        if last is not None:
+            if last > self.PREVIEW_BUDGET and i > 0:
+                i -= 1
+            elif last * 4 < self.PREVIEW_BUDGET and i + 1 < len(sizes):
+                i += 1  # next size has ~4x the cells
+
+        self._size_index = i
+        return sizes[i]
+
+    def _run_preview(self, dt):
+        from generate.main import is_busy
+        if is_busy():
+            return
+        if self._preview_busy():
+            self._pending = True
+            return
+
+        self._thread = threading.Thread(
+            target=self._preview_job, args=(self._pick_size(), self._token),
+            name="TerrainPreviewThread", daemon=True
+        )
+        self._thread.start()
+
+    def _preview_job(self, size, token):
+        from generate.main import preview_ds
+        from texture.plot import prepare_plot
+
+        start = time.perf_counter()
+        array = preview_ds(size)
+        self._timings[size] = time.perf_counter() - start
+
+        frame = prepare_plot(array=array)
+        Clock.schedule_once(lambda dt: self._show(frame, token))
+
+    def _show(self, frame, token):
+        from generate.main import is_busy
+        from texture.plot import upload_plot
+
+        if token == self._token and not is_busy():
+            texture = upload_plot(frame, budget_ms=0)  # previews are small
+            update_widget('asp_texture', 'update_texture', new_texture=texture)
+            # overlays belong to the full map, the next full run brings them back
+            update_widget('asp_texture', 'set_contours', contours=None)
+
+        if self._pending:
+            self._pending = False
+            self._preview_trigger()
+
+    def _run_full(self, *args):
+        from generate.main import generate_async, generate_ds, is_busy
+
+        # A running preview may finish alongside (each run owns its RNGs);
+        # the new token makes sure it is never shown over the full map
+        if is_busy():
+            self._settle_trigger()
+            return
+
+        self._token += 1
+        generate_async(task=lambda: generate_ds(reseed=False))
+
+live_preview = LivePreview()
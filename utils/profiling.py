@@ -0,0 +1,343 @@
+"""
+Per-stage profiling of generation runs.
+
+Off by default. When on, every run (a `make` call, or a whole UI job:
+generation, history, overlays, coloring) records for each stage
+(diamond_square, noise, erosion/<method>, smoothing, rescale, colorize, ...)
+its wall and CPU time, the tracemalloc peak above the memory at its start
+and the allocation sites that grew most, plus what each `make` borrowed
+from the scratch-array pool (store.workspace: 'workspace', bytes allocated
+and reused), and writes a JSON report with the run's parameters and seed
+to the profile directory (DSGUI_PROFILE_DIR,
+default ~/.dsgui/profiles). With cProfile on, the run's call graph is also
+written in collapsed-stack format (`<report>.collapsed`), the input of
+flamegraph.pl and speedscope.
+
+Switches: DSGUI_PROFILE=1 (DSGUI_PROFILE=cprofile adds the call graph), the
+hidden Ctrl+Shift+P toggle in the app, or this module's CLI:
+
+    python -m utils.profiling --size 1025 --cprofile
+
+When off, `stage` and `run` return a shared null context: no timing, no
+tracing. Only the thread that opened a run is profiled (the pipeline's
+process and thread pools are seen as the time they take), and one run at
+a time: tracemalloc and its peak are process-wide, so a run opened in
+another thread meanwhile (e.g. a live preview next to a generation) goes
+unprofiled. Memory figures are process-wide as well: what other threads
+allocate during a stage counts in its peak and allocation sites. Tracing
+starts with each run; in the first run of a process it also sees JIT
+compilation (or the loading of cached machine code), whose 100k+ traces
+take seconds to group: stages that start or end with that many get no
+allocation sites ('sites' null). Taking snapshots is reported as the run's
+'overhead'; stage times exclude it.
+"""
+import argparse
+import cProfile
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+import numpy as np
+
+_OFF = nullcontext()
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def default_root():
+    return os.environ.get(Profiler.DIR_ENV) or os.path.join(os.path.expanduser('~'), '.dsgui', 'profiles')
+
+def collapsed_stacks(profile, min_seconds=1e-5):
+    """
+    Collapsed stacks ('outer;inner;leaf' -> microseconds of self time) of a
+    cProfile.Profile. cProfile keeps caller/callee edges, not stacks: a
+    function's time is split over the paths leading to it in proportion to
+    the time spent under each caller. Recursive edges are cut.
+    """
+    entries = pstats.Stats(profile).stats
+    children = defaultdict(list)
+    for function, (_, _, _, _, callers) in entries.items():
+        for caller, edge in callers.items():
+            children[caller].append((function, edge[3]))
+
+    def name(function):
+        filename, line, label = function
+        if filename == '~':
+            return label
+        return f"{label} ({os.path.basename(filename)}:{line})"
+
+    stacks = defaultdict(float)
+    def walk(function, path, names, share):
+        own = entries[function][2] * share
+        names = names + (name(function),)
+        if own > 0:
+            stacks[';'.join(names)] += own
+        for child, edge_seconds in children[function]:
+            child_total = entries[child][3]
+            if child in path or child_total <= 0 or edge_seconds * share < min_seconds:
+                continue
+            walk(child, path | {child}, names, share * edge_seconds / child_total)
+
+    for function, (_, _, _, _, callers) in entries.items():
+        if not callers:
+            walk(function, {function}, (), 1.0)
+    return {stack: round(seconds * 1e6) for stack, seconds in stacks.items() if seconds * 1e6 >= 1}
+
+class _Run:
+    """Report being collected by the thread that opened a run."""
+
+    def __init__(self, label, params, seed, cprofile):
+        self.report = {
+            'label': label, 'started': time.time(), 'params': params, 'seed': seed, 'stages': [],
+        }
+        self.path = []      # open stage names
+        self.peaks = []     # per open stage (and the run): highest traced memory seen so far
+        self.stopped_tracing = not tracemalloc.is_tracing()
+        if self.stopped_tracing:
+            tracemalloc.start(Profiler.FRAMES)
+        self.skipped = set()  # runs of other threads left unprofiled meanwhile
+        self.overhead = 0.0  # seconds spent taking and comparing snapshots
+        self.profile = cProfile.Profile() if cprofile else None
+
+class Profiler:
+    """
+    Opt-in stage profiler. `run` opens the report of one generation, `stage`
+    times a step inside it; both are free when profiling is off or no run is
+    open in the calling thread.
+    """
+
+    ENV = 'DSGUI_PROFILE'
+    DIR_ENV = 'DSGUI_PROFILE_DIR'
+    TOP = 8     # allocation sites listed per stage
+    FRAMES = 4  # traced frames per allocation, so pooled buffers are attributed to their borrower
+    # Allocation sites are searched among traces allocated by the project or NumPy (not by
+    # numba's compiler); a site is the innermost project frame outside the helpers
+    PROJECT = [
+        tracemalloc.Filter(True, os.path.join(ROOT, '*')),
+        tracemalloc.Filter(True, os.path.join(os.path.dirname(np.__file__), '*')),
+    ]
+    HELPERS = (os.path.join('store', 'workspace.py'), os.path.join('utils', 'profiling.py'))
+    MAX_TRACE_MEMORY = 4 * 2**20  # tracemalloc's own memory (about 50k traces) above which sites are skipped
+
+    def __init__(self):
+        self.enabled = False
+        self.cprofile = False
+        self.root = None    # None: default_root()
+        self.last = None    # path of the last report written
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._active = None  # the run being profiled, in whichever thread
+
+    def enable_if_set(self):
+        value = os.environ.get(self.ENV, '')
+        if value not in ('', '0'):
+            self.enable(cprofile=value.lower() == 'cprofile')
+
+    def enable(self, cprofile=False, root=None):
+        self.enabled = True
+        self.cprofile = cprofile
+        self.root = root or self.root
+
+    def disable(self):
+        """Runs already open finish their reports."""
+        self.enabled = False
+
+    def toggle(self):
+        if self.enabled:
+            self.disable()
+        else:
+            self.enable(self.cprofile)
+        return self.enabled
+
+    # --- recording --------------------------------------------------------
+
+    def run(self, label, params=None, seed=None):
+        """
+        Context manager around one run; its report is written on exit.
+        Inside another run of the same thread it is a stage of that run, and
+        fills in its params and seed if the outer run had none.
+        """
+        if not self.enabled:
+            return _OFF
+        current = getattr(self._local, 'run', None)
+        if current is not None:
+            if current.report['params'] is None:
+                current.report.update(params=params, seed=seed)
+            return self._stage(current, label)
+        return self._run(label, params, seed)
+
+    def stage(self, label):
+        """Context manager timing one stage of the run open in this thread."""
+        current = getattr(self._local, 'run', None) if self.enabled else None
+        if current is None:
+            return _OFF
+        return self._stage(current, label)
+
+    @contextmanager
+    def _run(self, label, params, seed):
+        with self._lock:
+            active = self._active
+            if active is None:
+                run = self._active = _Run(label, params, seed, self.cprofile)
+        if active is not None:
+            if label not in active.skipped:
+                active.skipped.add(label)
+                print(f"[INFO] profiling: {label} not profiled while {active.report['label']} is")
+            yield None
+            return
+        self._local.run = run
+        totals = {}
+        try:
+            if run.profile is not None:
+                run.profile.enable()
+            with self._stage(run, label, record=False) as totals:
+                yield run.report
+        finally:
+            if run.profile is not None:
+                run.profile.disable()
+            self._local.run = None
+            if run.stopped_tracing:
+                tracemalloc.stop()
+            with self._lock:
+                self._active = None
+            run.report.update(totals, overhead=run.overhead)
+            if not totals:
+                return
+            try:
+                self.last = self._save(run)
+                print_report(run.report, self.last)
+            except OSError as e:
+                print(f"[WARN] profiling: could not write the report of {label}: {e}")
+
+    @contextmanager
+    def _stage(self, run, label, record=True):
+        if run.peaks:
+            run.peaks[-1] = max(run.peaks[-1], tracemalloc.get_traced_memory()[1])
+        start_memory = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        before = None
+        if record and tracemalloc.get_tracemalloc_memory() <= self.MAX_TRACE_MEMORY:
+            before = tracemalloc.take_snapshot().filter_traces(self.PROJECT)
+        run.overhead += time.perf_counter() - started
+        tracemalloc.reset_peak()
+        run.path.append(label)
+        run.peaks.append(start_memory)
+        totals = {}
+        wall, cpu, process_cpu = time.perf_counter(), time.thread_time(), time.process_time()
+        try:
+            yield totals
+        finally:
+            totals.update(
+                wall=time.perf_counter() - wall,
+                cpu=time.thread_time() - cpu,
+                process_cpu=time.process_time() - process_cpu,
+                peak=max(run.peaks.pop(), tracemalloc.get_traced_memory()[1]) - start_memory,
+            )
+            if record:
+                started = time.perf_counter()
+                totals.update(stage='/'.join(run.path), sites=self._sites(before))
+                run.report['stages'].append(totals)
+                run.overhead += time.perf_counter() - started
+            run.path.pop()
+
+    def _sites(self, before):
+        """
+        Allocation sites whose memory grew since the project-filtered
+        snapshot `before`, largest first; None without a snapshot or past
+        MAX_TRACE_MEMORY.
+        """
+        if before is None or tracemalloc.get_tracemalloc_memory() > self.MAX_TRACE_MEMORY:
+            return None
+        after = tracemalloc.take_snapshot().filter_traces(self.PROJECT)
+        sites = defaultdict(lambda: [0, 0])
+        for diff in after.compare_to(before, 'traceback'):
+            if diff.size_diff <= 0:
+                continue
+            # tracebacks run oldest frame first
+            frame = next((
+                f for f in reversed(diff.traceback) if f.filename.startswith(ROOT) and not f.filename.endswith(self.HELPERS)
+            ), None)
+            if frame is None:
+                continue  # the profiler's own, or NumPy's beyond the traced frames
+            site = sites[f"{frame.filename}:{frame.lineno}"]
+            site[0] += diff.size_diff
+            site[1] += diff.count_diff
+        ranked = sorted(sites.items(), key=lambda item: item[1][0], reverse=True)
+        return [{'site': site, 'bytes': size, 'count': count} for site, (size, count) in ranked[:self.TOP]]
+
+    def _save(self, run):
+        root = self.root or default_root()
+        os.makedirs(root, exist_ok=True)
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(run.report['started']))
+        seed = run.report['seed']
+        if isinstance(seed, (list, tuple)):
+            seed = f"{seed[0]}+{len(seed)}" if seed else 'none'
+        name = f"{stamp}-{run.report['label']}-{seed}"
+        path = os.path.join(root, f"{name}.json")
+        if run.profile is not None:
+            stacks = collapsed_stacks(run.profile)
+            run.report['collapsed'] = f"{name}.collapsed"
+            with open(os.path.join(root, run.report['collapsed']), 'w') as file:
+                file.writelines(f"{stack} {count}\n" for stack, count in sorted(stacks.items()))
+        with open(path, 'w') as file:
+            json.dump(run.report, file, indent=1, default=repr)
+        return path
+
+profiler = Profiler()
+profiler.enable_if_set()
+
+def _print_workspace(entry, indent):
+    usage = entry.get('workspace')
+    if usage:
+        mib = 2**20
+        print(f"[PROFILE] {indent}workspace: {usage['allocated'] / mib:.1f} MiB allocated "
+              f"({usage['allocations']} arrays), {usage['reused'] / mib:.1f} MiB reused")
+
+def print_report(report, path=None):
+    mib = 2**20
+    print(f"[PROFILE] {report['label']} (seed {report['seed']}): {report['wall']:.2f} s wall, "
+          f"{report['cpu']:.2f} s cpu, peak {report['peak'] / mib:.1f} MiB, {report['overhead']:.2f} s profiler overhead"
+          + (f" -> {path}" if path else ''))
+    _print_workspace(report, '  ')
+    for stage in report['stages']:
+        print(f"[PROFILE]   {stage['stage']:<32} {stage['wall'] * 1000:9.1f} ms wall {stage['cpu'] * 1000:9.1f} ms cpu "
+              f"{stage['peak'] / mib:8.1f} MiB peak")
+        _print_workspace(stage, '    ')
+        for site in [site for site in stage['sites'] or [] if site['bytes'] >= 2**16][:3]:
+            print(f"[PROFILE]     {site['bytes'] / mib:8.1f} MiB  {site['site']}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=None, help="map size (default: the settings)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--runs', type=int, default=1)
+    parser.add_argument('--cprofile', action='store_true', help="also write collapsed call stacks")
+    parser.add_argument('--out', default=None, help=f"report directory (default: ${Profiler.DIR_ENV} or ~/.dsgui/profiles)")
+    args = parser.parse_args(argv)
+
+    import contextlib
+    import io
+
+    from generate.ds.terrain import make
+    from generate.params import terrain_params
+    from settings.store import settings
+    # Run as a script this module is __main__; the pipeline reports to the profiler of utils.profiling
+    from utils.profiling import profiler
+
+    values = settings.snapshot()
+    if args.size:
+        values.update(initial_terrain=args.size, terrain_width=0, terrain_height=0)
+    params = terrain_params(values)
+
+    profiler.enable(cprofile=args.cprofile, root=args.out)
+    for run in range(args.runs):
+        with contextlib.redirect_stdout(io.StringIO()):
+            make(**params, seed=args.seed + run)
+        with open(profiler.last) as file:
+            print_report(json.load(file), profiler.last)
+
+if __name__ == '__main__':
+    main()
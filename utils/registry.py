@@ -0,0 +1,37 @@
+import threading
+import weakref
+
+class WidgetRegistry:
+    """
+    Central id -> widget map holding weak references only, so closed layouts
+    and popups drop out on their own. Registering an id again replaces the
+    previous widget (e.g. the texture widget of the layout now on screen).
+    """
+
+    def __init__(self):
+        self._widgets = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+
+    def register(self, widget_id, widget):
+        # KV ids may hold weak proxies, store the widget itself
+        widget = getattr(widget, '__self__', widget)
+        with self._lock:
+            self._widgets[widget_id] = widget
+
+    def register_ids(self, ids):
+        """Register every entry of a KV `ids` mapping."""
+        for widget_id, widget in ids.items():
+            self.register(widget_id, widget)
+
+    def unregister(self, widget_id, widget=None):
+        """Remove `widget_id`, only if it still points to `widget` when given."""
+        with self._lock:
+            current = self._widgets.get(widget_id)
+            if current is not None and (widget is None or current is getattr(widget, '__self__', widget)):
+                del self._widgets[widget_id]
+
+    def get(self, widget_id):
+        with self._lock:
+            return self._widgets.get(widget_id)
+
+registry = WidgetRegistry()
@@ -0,0 +1,111 @@
+import builtins
+import importlib
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+class StartupTrace:
+    """
+    Opt-in startup profiler, enabled with DSGUI_STARTUP_TRACE=1.
+
+    Times every first-time import (inclusive and self time, per thread) and
+    every KV file load, and prints a report once the first frame is drawn.
+    Must be imported before anything heavy so those imports are seen.
+    """
+
+    ENV = 'DSGUI_STARTUP_TRACE'
+    TOP = 25  # imports listed in the report
+
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.enabled = False
+        self.imports = {}   # module -> (inclusive, self) seconds
+        self.timings = []   # (label, seconds) for KV loads and background work
+        self._local = threading.local()
+        self._original_import = None
+
+    def install_if_enabled(self):
+        if os.environ.get(self.ENV, '') not in ('', '0'):
+            self.install()
+
+    def install(self):
+        if self.enabled:
+            return
+        self.enabled = True
+        self._original_import = builtins.__import__
+        builtins.__import__ = self._import
+
+    def uninstall(self):
+        if self._original_import is not None:
+            builtins.__import__ = self._original_import
+            self._original_import = None
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level or name in sys.modules:
+            return self._original_import(name, globals, locals, fromlist, level)
+
+        stack = self._local.__dict__.setdefault('stack', [])
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            return self._original_import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - start
+            children = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            self.imports.setdefault(name, (elapsed, elapsed - children))
+
+    @contextmanager
+    def timed(self, label):
+        """Record how long the block takes (only when tracing)."""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings.append((label, time.perf_counter() - start))
+
+    def first_frame(self):
+        """Call once the first frame is drawn: stops import tracing and prints the report."""
+        if not self.enabled:
+            return
+        elapsed = time.perf_counter() - self.t0
+        self.uninstall()
+        self.report(elapsed)
+
+    def report(self, first_frame=None):
+        if first_frame is not None:
+            print(f"[STARTUP] time to first frame: {first_frame * 1000:8.1f} ms")
+        for label, seconds in self.timings:
+            print(f"[STARTUP] {label:<48} {seconds * 1000:8.1f} ms")
+        ranked = sorted(self.imports.items(), key=lambda item: item[1][1], reverse=True)
+        for name, (inclusive, own) in ranked[:self.TOP]:
+            print(f"[STARTUP] import {name:<41} {own * 1000:8.1f} ms self {inclusive * 1000:8.1f} ms total")
+
+    def preload(self, *modules):
+        """Import `modules` on a background thread, e.g. after the first frame."""
+        def run():
+            for name in modules:
+                with self.timed(f"background import {name}"):
+                    importlib.import_module(name)
+            if self.enabled:
+                for label, seconds in self.timings:
+                    if label.startswith('background'):
+                        print(f"[STARTUP] {label:<48} {seconds * 1000:8.1f} ms")
+
+        thread = threading.Thread(target=run, name="PreloadThread", daemon=True)
+        thread.start()
+        return thread
+
+startup_trace = StartupTrace()
+
+def load_kv(path):
+    """Builder.load_file, timed under the startup trace."""
+    from kivy.lang import Builder
+    with startup_trace.timed(f"kv {os.path.basename(path)}"):
+        return Builder.load_file(path)
@@ -1,30 +1,40 @@
-from kivy.app import App
+import threading
+from collections import OrderedDict
+
 from kivy.clock import Clock
 
-def find_widget_by_id(widget, target_id):
-    if hasattr(widget, 'ids') and target_id in widget.ids:
-        return widget.ids[target_id]
+from utils.registry import registry
 
-    for child in widget.children:
-        result = find_widget_by_id(child, target_id)
-        if result:
-            return result
+# (widget_id, method_name) -> kwargs of the latest call, flushed once per frame
+_pending = OrderedDict()
+_pending_lock = threading.Lock()
 
-    return None
+def _flush(dt):
+    with _pending_lock:
+        calls = list(_pending.items())
+        _pending.clear()
 
-def update_widget(widget_id, method_name, **kwargs) -> bool:
-    def _update(dt):
+    for (widget_id, method_name), kwargs in calls:
         try:
-            app = App.get_running_app()
-            widget = find_widget_by_id(app.root, widget_id)
+            widget = registry.get(widget_id)
             if widget is None:
                 raise KeyError(f"Widget ID '{widget_id}' not found.")
             method = getattr(widget, method_name)
             method(**kwargs)
         except Exception as e:
             print(f"[update_widget] Error: {e}")
-            return False
+
+_flush_trigger = Clock.create_trigger(_flush)
+
+def update_widget(widget_id, method_name, **kwargs) -> bool:
+    """Call `method_name(**kwargs)` on the registered widget on the main thread.
+    Calls for the same widget and method within one frame are coalesced, only
+    the latest arguments are applied. Safe to call from any thread.
+    """
+    with _pending_lock:
+        _pending.pop((widget_id, method_name), None)
+        _pending[(widget_id, method_name)] = kwargs
 
     # Schedule on the main thread
-    Clock.schedule_once(_update)
+    _flush_trigger()
     return True